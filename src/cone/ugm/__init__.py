@@ -11,13 +11,17 @@ from cone.ugm.model.groups import Groups
 from cone.ugm.model.user import User
 from cone.ugm.model.users import Users
 from cone.ugm.settings import GeneralSettings
+from cone.ugm.settings import check_principal_changes
+from cone.ugm.settings import check_settings_generation
 from cone.ugm.settings import LocalManagerSettings
 from cone.ugm.settings import ugm_cfg
+from pyramid.events import NewRequest
 from pyramid.security import ALL_PERMISSIONS
 from pyramid.security import Allow
 from pyramid.security import Deny
 from pyramid.security import Everyone
 import logging
+import os
 
 
 logger = logging.getLogger('cone.ugm')
@@ -79,6 +83,30 @@ def initialize_ugm(config, global_config, settings):
     # config file locations
     ugm_cfg.ugm_settings = settings.get('ugm.config', '')
     ugm_cfg.lm_settings = settings.get('ugm.localmanager_config', '')
+    generation_file = settings.get('ugm.generation_file', '')
+    if not generation_file and ugm_cfg.ugm_settings:
+        generation_file = '{}.generation'.format(
+            os.path.splitext(ugm_cfg.ugm_settings)[0]
+        )
+    ugm_cfg.generation_file = generation_file
+    changes_file = settings.get('ugm.changes_file', '')
+    if not changes_file and ugm_cfg.ugm_settings:
+        changes_file = '{}.changes'.format(
+            os.path.splitext(ugm_cfg.ugm_settings)[0]
+        )
+    ugm_cfg.changes_file = changes_file
+    autoincrement_file = settings.get('ugm.autoincrement_file', '')
+    if not autoincrement_file and ugm_cfg.ugm_settings:
+        autoincrement_file = '{}.autoincrement'.format(
+            os.path.splitext(ugm_cfg.ugm_settings)[0]
+        )
+    ugm_cfg.autoincrement_file = autoincrement_file
+
+    # reload settings and UGM backend if changed by other processes
+    config.add_subscriber(check_settings_generation, NewRequest)
+
+    # reload principals if changed by other processes
+    config.add_subscriber(check_principal_changes, NewRequest)
 
     # UGM settings
     register_config('ugm_general', GeneralSettings)
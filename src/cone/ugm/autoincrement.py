@@ -0,0 +1,137 @@
+from cone.ugm.settings import ugm_cfg
+import json
+import logging
+import os
+import threading
+
+
+try:  # pragma: no cover
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+logger = logging.getLogger('cone.ugm')
+
+
+def highest_principal_number(principals, prefix):
+    """Return highest number of principal ids consisting of prefix and
+    number or None if no such principal id exists.
+    """
+    result = principals.search(
+        attrlist=['id'],
+        criteria={'id': u'%s*' % prefix}
+    )
+    highest = None
+    for _, attrs in result:
+        principal_id = attrs['id']
+        if isinstance(principal_id, list):
+            # XXX: is node.ext.ldap behavior attr list values are lists.
+            #      keep until node.ext.ldap supports single valued fields.
+            principal_id = principal_id[0]
+        try:
+            number = int(principal_id[len(prefix):])
+        except ValueError:
+            continue
+        if highest is None or number > highest:
+            highest = number
+    return highest
+
+
+class AutoIncrementSequence(object):
+    """Sequence of auto incremented principal id numbers shared between
+    processes.
+
+    The next number of each principal id prefix is stored as JSON in the
+    state file defined at ``ugm_cfg.autoincrement_file``. The file gets
+    locked exclusively while a number is allocated and synced to disk before
+    the number is returned, thus concurrent allocations never return the same
+    number.
+
+    If no number is stored for a prefix yet, or the state file is unreadable,
+    the sequence gets seeded once from the highest existing number. If no
+    state file is defined, or the state file cannot be opened, locked or
+    written, the sequence is seeded on each allocation.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return ugm_cfg.autoincrement_file
+
+    def allocate(self, prefix, start, seed, exists=None):
+        """Return next number for prefix.
+
+        ``start`` is the lowest number returned. ``seed`` is a callable
+        returning the highest number in use or None. ``exists`` is an
+        optional callable checking whether number is already in use, e.g.
+        by a principal created with explicit id, in which case it gets
+        skipped.
+        """
+        path = self.path
+        if path:
+            with self._lock:
+                try:
+                    return self._allocate(path, prefix, start, seed, exists)
+                except EnvironmentError as e:
+                    logger.error((
+                        'Cannot use auto increment state file {}, sequence '
+                        'gets seeded from existing principals: {}'
+                    ).format(path, e))
+        return self._next(seed(), None, start, exists)
+
+    def _allocate(self, path, prefix, start, seed, exists):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            state = self._read(fd)
+            value = state.get(prefix)
+            highest = seed() if value is None else None
+            value = self._next(highest, value, start, exists)
+            state[prefix] = value + 1
+            self._write(fd, state)
+            return value
+        finally:
+            # closing the file releases the lock
+            os.close(fd)
+
+    def _next(self, highest, value, start, exists):
+        if value is None:
+            value = start if highest is None else highest + 1
+        value = max(value, start)
+        if exists is not None:
+            while exists(value):
+                value += 1
+        return value
+
+    def _read(self, fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        chunks = list()
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        try:
+            state = json.loads(b''.join(chunks).decode('utf-8'))
+        except ValueError:
+            return dict()
+        if not isinstance(state, dict):
+            return dict()
+        return dict([
+            (prefix, value) for prefix, value in state.items()
+            if isinstance(value, int)
+        ])
+
+    def _write(self, fd, state):
+        data = json.dumps(state, sort_keys=True).encode('utf-8')
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, data)
+        os.fsync(fd)
+
+
+autoincrement_sequence = AutoIncrementSequence()
@@ -1,5 +1,8 @@
 from cone.ugm.model.group import Group
 from cone.ugm.model.user import User
+from cone.ugm.settings import PRINCIPAL_DELETED
+from cone.ugm.settings import principals_changed
+from cone.ugm.unitofwork import unit_of_work
 from pyramid.i18n import get_localizer
 from pyramid.i18n import TranslationStringFactory
 from pyramid.view import view_config
@@ -18,40 +21,72 @@ LM_TARGET_GID_IS_DEFAULT = 2
 
 
 class ManageMembershipError(Exception):
+    """Raised if managing membership violates local manager restrictions.
 
-    def __init__(self, reason, data):
+    ``reason`` and ``data`` refer to the first violation, ``violations``
+    contains all violations as list of ``(reason, data)`` tuples.
+    """
+
+    def __init__(self, reason, data, violations=None):
         self.reason = reason
         self.data = data
+        if violations is None:
+            violations = [(reason, data)]
+        self.violations = violations
 
+    def data_for(self, reason):
+        """Return list of violation data for reason.
+        """
+        return [data for rsn, data in self.violations if rsn is reason]
 
-def validate_add_users_to_groups(model, user_ids, group_ids):
+
+def membership_violations(model, user_ids, group_ids, remove=False):
+    """Return local manager restrictions violated by adding respective
+    removing users to groups as list of ``(reason, data)`` tuples.
+
+    Ids are checked against the sets of target and default ids of the local
+    manager state, thus validation is done in one pass.
+    """
     if not model.local_manager_consider_for_user:
-        return
-    lm_gids = model.local_manager_target_gids
-    for group_id in group_ids:
-        if group_id not in lm_gids:
-            raise ManageMembershipError(LM_TARGET_GID_NOT_ALLOWED, group_id)
-    lm_uids = model.local_manager_target_uids
-    for user_id in user_ids:
-        if user_id not in lm_uids:
-            raise ManageMembershipError(LM_TARGET_UID_NOT_ALLOWED, user_id)
+        return []
+    state = model.local_manager_state
+    lm_gids = state.target_gid_set
+    lm_uids = state.target_uids
+    violations = [
+        (LM_TARGET_GID_NOT_ALLOWED, group_id)
+        for group_id in group_ids if group_id not in lm_gids
+    ]
+    violations += [
+        (LM_TARGET_UID_NOT_ALLOWED, user_id)
+        for user_id in user_ids if user_id not in lm_uids
+    ]
+    if remove:
+        default_gids = state.default_gid_set
+        violations += [
+            (LM_TARGET_GID_IS_DEFAULT, group_id)
+            for group_id in group_ids
+            if group_id in lm_gids and group_id in default_gids
+        ]
+    return violations
+
+
+def validate_add_users_to_groups(model, user_ids, group_ids):
+    violations = membership_violations(model, user_ids, group_ids)
+    if violations:
+        reason, data = violations[0]
+        raise ManageMembershipError(reason, data, violations=violations)
 
 
 def validate_remove_users_from_groups(model, user_ids, group_ids):
-    if not model.local_manager_consider_for_user:
-        return
-    lm_gids = model.local_manager_target_gids
-    for group_id in group_ids:
-        if group_id not in lm_gids:
-            raise ManageMembershipError(LM_TARGET_GID_NOT_ALLOWED, group_id)
-    lm_uids = model.local_manager_target_uids
-    for user_id in user_ids:
-        if user_id not in lm_uids:
-            raise ManageMembershipError(LM_TARGET_UID_NOT_ALLOWED, user_id)
-    adm_gid = model.local_manager_gid
-    for group_id in group_ids:
-        if model.local_manager_is_default(adm_gid, group_id):
-            raise ManageMembershipError(LM_TARGET_GID_IS_DEFAULT, group_id)
+    violations = membership_violations(
+        model,
+        user_ids,
+        group_ids,
+        remove=True
+    )
+    if violations:
+        reason, data = violations[0]
+        raise ManageMembershipError(reason, data, violations=violations)
 
 
 ###############################################################################
@@ -70,9 +105,12 @@ def delete_user_action(model, request):
     try:
         users = model.parent.backend
         uid = model.model.name
+        group_ids = model.model.group_ids
         del users[uid]
         users()
         model.parent.invalidate()
+        principals_changed(users=[uid], action=PRINCIPAL_DELETED)
+        principals_changed(groups=group_ids)
         localizer = get_localizer(request)
         message = localizer.translate(_(
             'delete_user_from_database',
@@ -108,10 +146,11 @@ def user_add_to_group_action(model, request):
         user = model.model
         validate_add_users_to_groups(model, [user.id], group_ids)
         groups = user.root.groups
+        uow = unit_of_work(model.root, request)
         for group_id in group_ids:
             groups[group_id].add(user.name)
-        groups()
-        model.parent.invalidate(user.name)
+            uow.membership_changed(user.name, group_id)
+        uow.flush()
         localizer = get_localizer(request)
         message = localizer.translate(_(
             'added_user_to_group',
@@ -137,7 +176,7 @@ def user_add_to_group_action(model, request):
             ),
             mapping={
                 'uid': user.id,
-                'gid': e.data
+                'gid': ', '.join(e.data_for(e.reason))
             }
         ))
         return {
@@ -145,6 +184,7 @@ def user_add_to_group_action(model, request):
             'message': message
         }
     except Exception as e:
+        unit_of_work(model.root, request).discard()
         return {
             'success': False,
             'message': str(e)
@@ -169,10 +209,11 @@ def user_remove_from_group_action(model, request):
         user = model.model
         validate_remove_users_from_groups(model, [user.id], group_ids)
         groups = user.root.groups
+        uow = unit_of_work(model.root, request)
         for group_id in group_ids:
             del groups[group_id][user.name]
-        groups()
-        model.parent.invalidate(user.name)
+            uow.membership_changed(user.name, group_id)
+        uow.flush()
         localizer = get_localizer(request)
         message = localizer.translate(_(
             'removed_user_from_group',
@@ -196,7 +237,7 @@ def user_remove_from_group_action(model, request):
                     "Manage membership denied for target group."),
                 mapping={
                     'uid': user.id,
-                    'gid': e.data
+                    'gid': ', '.join(e.data_for(e.reason))
                 }
             ))
         elif e.reason is LM_TARGET_GID_IS_DEFAULT:
@@ -208,7 +249,7 @@ def user_remove_from_group_action(model, request):
                 ),
                 mapping={
                     'uid': user.id,
-                    'gid': e.data
+                    'gid': ', '.join(e.data_for(e.reason))
                 }
             ))
         else:
@@ -218,6 +259,7 @@ def user_remove_from_group_action(model, request):
             'message': message
         }
     except Exception as e:
+        unit_of_work(model.root, request).discard()
         return {
             'success': False,
             'message': str(e)
@@ -240,9 +282,12 @@ def delete_group_action(model, request):
     try:
         groups = model.parent.backend
         uid = model.model.name
+        member_ids = model.model.member_ids
         del groups[uid]
         groups()
         model.parent.invalidate()
+        principals_changed(groups=[uid], action=PRINCIPAL_DELETED)
+        principals_changed(users=member_ids)
     except Exception as e:
         return {
             'success': False,
@@ -276,10 +321,11 @@ def group_add_user_action(model, request):
     try:
         group = model.model
         validate_add_users_to_groups(model, user_ids, [group.id])
+        uow = unit_of_work(model.root, request)
         for user_id in user_ids:
             group.add(user_id)
-        group()
-        model.parent.invalidate(group.name)
+            uow.membership_changed(user_id, group.name)
+        uow.flush()
         localizer = get_localizer(request)
         message = localizer.translate(_(
             'added_user_to_group',
@@ -304,7 +350,7 @@ def group_add_user_action(model, request):
                 "Manage membership denied for user."
             ),
             mapping={
-                'uid': e.data,
+                'uid': ', '.join(e.data_for(e.reason)),
                 'gid': group.id
             }
         ))
@@ -313,6 +359,7 @@ def group_add_user_action(model, request):
             'message': message
         }
     except Exception as e:
+        unit_of_work(model.root, request).discard()
         return {
             'success': False,
             'message': str(e)
@@ -336,10 +383,11 @@ def group_remove_user_action(model, request):
     try:
         group = model.model
         validate_remove_users_from_groups(model, user_ids, [group.id])
+        uow = unit_of_work(model.root, request)
         for user_id in user_ids:
             del group[user_id]
-        group()
-        model.parent.invalidate(group.name)
+            uow.membership_changed(user_id, group.name)
+        uow.flush()
         localizer = get_localizer(request)
         message = localizer.translate(_(
             'removed_user_from_group',
@@ -363,7 +411,7 @@ def group_remove_user_action(model, request):
                     "Manage membership denied for user."
                 ),
                 mapping={
-                    'uid': e.data,
+                    'uid': ', '.join(e.data_for(e.reason)),
                     'gid': group.id
                 }
             ))
@@ -376,7 +424,7 @@ def group_remove_user_action(model, request):
                 ),
                 mapping={
                     'uid': ', '.join(user_ids),
-                    'gid': e.data
+                    'gid': ', '.join(e.data_for(e.reason))
                 }
             ))
         else:
@@ -386,6 +434,7 @@ def group_remove_user_action(model, request):
             'message': message
         }
     except Exception as e:
+        unit_of_work(model.root, request).discard()
         return {
             'success': False,
             'message': str(e)
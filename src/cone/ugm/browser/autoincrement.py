@@ -1,3 +1,5 @@
+from cone.ugm.autoincrement import autoincrement_sequence
+from cone.ugm.autoincrement import highest_principal_number
 from cone.ugm.utils import general_settings
 from plumber import Behavior
 from plumber import default
@@ -17,41 +19,24 @@ class AutoIncrementForm(Behavior):
     @default
     @property
     def autoincrement_support(self):
-        settings = general_settings(self.model)
-        return settings.attrs.user_id_autoincrement == 'True'
+        settings = general_settings(self.model).snapshot
+        return settings.user_id_autoincrement
 
     @default
     @property
     def next_principal_id(self):
-        settings = general_settings(self.model)
-        prefix = settings.attrs.user_id_autoincrement_prefix
-        default = int(settings.attrs.user_id_autoincrement_start)
-        search = u'%s*' % prefix
+        """Allocate next principal id from ``autoincrement_sequence``.
+        """
+        settings = general_settings(self.model).snapshot
+        prefix = settings.user_id_autoincrement_prefix
         backend = self.model.parent.backend
-        backend.invalidate()
-        result = backend.search(attrlist=['id'], criteria={'id': search})
-        if result and isinstance(result[0][1]['id'], list):
-            # XXX: is node.ext.ldap behavior attr list values are lists.
-            #      keep until node.ext.ldap supports single valued fields.
-            principlal_ids = [_[1]['id'][0] for _ in result]
-        else:
-            principlal_ids = [_[1]['id'] for _ in result]
-        matching = list()
-        for principal_id in principlal_ids:
-            if prefix:
-                principal_id = principal_id[len(prefix):]
-            try:
-                principal_id = int(principal_id)
-            except ValueError:
-                continue
-            matching.append(principal_id)
-        if not matching:
-            principal_id = default
-        else:
-            principal_id = sorted(matching)[-1] + 1
-        if principal_id < default:
-            principal_id = default
-        return u'%s%i' % (prefix, principal_id)
+        number = autoincrement_sequence.allocate(
+            prefix,
+            settings.user_id_autoincrement_start,
+            lambda: highest_principal_number(backend, prefix),
+            lambda number: u'%s%i' % (prefix, number) in backend
+        )
+        return u'%s%i' % (prefix, number)
 
     @plumb
     def prepare(_next, self):
@@ -129,16 +129,16 @@ class ExpirationForm(Behavior):
         ``self.form``.
         """
         _next(self)
-        settings = general_settings(self.model)
-        if settings.attrs.users_account_expiration != 'True':
+        settings = general_settings(self.model).snapshot
+        if not settings.users_account_expiration:
             return
         mode = 'edit'
         if not self.request.has_permission(
                 'manage_expiration', self.model.parent):
             mode = 'display'
         if self.action_resource == 'edit':
-            attr = settings.attrs.users_expires_attr
-            unit = int(settings.attrs.users_expires_unit)
+            attr = settings.users_expires_attr
+            unit = settings.users_expires_unit
             value = int(self.model.attrs.get(attr, 0))
             # if format days, convert to seconds
             if unit == 0:
@@ -159,12 +159,13 @@ class ExpirationForm(Behavior):
 
     @plumb
     def save(_next, self, widget, data):
+        changed = False
         if self.request.has_permission(
                 'manage_expiration', self.model.parent):
-            settings = general_settings(self.model)
-            if settings.attrs.users_account_expiration == 'True':
-                attr = settings.attrs.users_expires_attr
-                unit = int(settings.attrs.users_expires_unit)
+            settings = general_settings(self.model).snapshot
+            if settings.users_account_expiration:
+                attr = settings.users_expires_attr
+                unit = settings.users_expires_unit
                 value = data.fetch('userform.active').extracted
                 if value is UNSET:
                     if unit == 0:
@@ -180,4 +181,7 @@ class ExpirationForm(Behavior):
                         value += add
                     value = int(value)
                 self.model.attrs[attr] = str(value)
+                changed = True
         _next(self, widget, data)
+        if changed and self.action_resource in ['edit', 'overlayedit']:
+            self.model.parent.invalidate(self.model.name)
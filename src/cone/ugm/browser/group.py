@@ -5,22 +5,25 @@ from cone.app.browser.authoring import ContentEditForm
 from cone.app.browser.form import Form
 from cone.app.browser.utils import make_query
 from cone.app.browser.utils import make_url
+from cone.app.browser.utils import request_property
 from cone.app.ugm import ugm_backend
 from cone.tile import Tile
 from cone.tile import tile
 from cone.ugm.browser.authoring import AddFormFiddle
 from cone.ugm.browser.authoring import EditFormFiddle
 from cone.ugm.browser.listing import ColumnListing
+from cone.ugm.browser.listing import RelatedPrincipalsListing
 from cone.ugm.browser.principal import PrincipalForm
 from cone.ugm.browser.principal import group_field
 from cone.ugm.browser.roles import PrincipalRolesForm
 from cone.ugm.model.group import Group
+from cone.ugm.settings import PRINCIPAL_ADDED
+from cone.ugm.settings import principals_changed
 from cone.ugm.utils import general_settings
 from odict import odict
 from plumber import plumbing
 from pyramid.i18n import TranslationStringFactory
 from webob.exc import HTTPFound
-import fnmatch
 import itertools
 
 
@@ -49,94 +52,78 @@ class GroupRightColumn(Tile):
     pass
 
 
-class UsersListing(ColumnListing):
-    members_only = False
+class UsersListing(RelatedPrincipalsListing):
+    list_columns = ColumnListing.user_list_columns
+    listing_attrs = ColumnListing.user_attrs
+    localmanager_ids = ColumnListing.user_localmanager_ids
+    sort_attr = ColumnListing.user_default_sort_column
 
     @property
-    def listing_items(self):
-        appgroup = self.model
-        group = appgroup.model
-        member_ids = group.keys()
-        # Always True if we list members only, otherwise will be set
-        # in the loop below
-        related = self.members_only
+    def principals(self):
+        return self.model.root['users']
+
+    @request_property
+    def related_ids(self):
         # XXX: so far only users as members of groups, for
         # group-in-group we need to prefix groups
-        if related:
-            users = group.users
-        else:
-            # XXX: speedup
-            users = group.root.users.values()
-        # reduce for local manager
-        if self.model.local_manager_consider_for_user:
-            local_uids = self.model.local_manager_target_uids
-            users = [u for u in users if u.name in local_uids]
-        attrlist = self.user_attrs
-        sort_attr = self.user_default_sort_column
-        filter_term = self.unquoted_param_value('filter')
-        can_change = self.request.has_permission(
+        return frozenset(self.model.model.member_ids)
+
+    @request_property
+    def can_change(self):
+        return self.request.has_permission(
             'manage_membership',
             self.model.parent
         )
-        ret = list()
-        for user in users:
-            attrs = user.attrs
-            # reduce by search term
-            if filter_term:
-                s_attrs = [attrs[attr] for attr in attrlist]
-                if not fnmatch.filter(s_attrs, filter_term):
-                    continue
-            uid = user.name
-            item_target = make_url(self.request, path=user.path[1:])
-            action_query = make_query(id=uid)
-            action_target = make_url(
-                self.request,
-                node=appgroup,
-                query=action_query
-            )
-            if not self.members_only:
-                related = uid in member_ids
-            actions = list()
-            if can_change:
-                action_id = 'add_item'
-                action_enabled = not bool(related)
-                action_title = _(
-                    'add_user_to_selected_group',
-                    default='Add user to selected group'
-                )
-                add_item_action = self.create_action(
-                    action_id,
-                    action_enabled,
-                    action_title,
-                    action_target
-                )
-                actions.append(add_item_action)
-                action_id = 'remove_item'
-                action_enabled = bool(related)
-                action_title = _(
-                    'remove_user_from_selected_group',
-                    default='Remove user from selected group'
-                )
-                remove_item_action = self.create_action(
-                    action_id,
-                    action_enabled,
-                    action_title,
-                    action_target
-                )
-                actions.append(remove_item_action)
-            vals = [self.extract_raw(attrs, attr) for attr in attrlist]
-            sort = self.extract_raw(attrs, sort_attr)
-            content = self.item_content(*vals)
-            current = False
-            item = self.create_item(
-                sort,
-                item_target,
-                content,
-                current,
-                actions
-            )
-            ret.append(item)
-        return ret
+
+    def listing_item_target(self, item):
+        return make_url(self.request, path=['users', item.key])
+
+    def listing_item_content(self, item):
+        attrs = item.attrs
+        vals = [self.extract_raw(attrs, attr) for attr in self.user_attrs]
+        return self.item_content(*vals)
+
+    def listing_item_current(self, item):
+        return False
+
+    def listing_item_actions(self, item):
+        actions = list()
+        if not self.can_change:
+            return actions
+        related = item.data['related']
+        action_query = make_query(id=item.key)
+        action_target = make_url(
+            self.request,
+            node=self.model,
+            query=action_query
+        )
+        action_id = 'add_item'
+        action_enabled = not bool(related)
+        action_title = _(
+            'add_user_to_selected_group',
+            default='Add user to selected group'
+        )
+        add_item_action = self.create_action(
+            action_id,
+            action_enabled,
+            action_title,
+            action_target
+        )
+        actions.append(add_item_action)
+        action_id = 'remove_item'
+        action_enabled = bool(related)
+        action_title = _(
+            'remove_user_from_selected_group',
+            default='Remove user from selected group'
+        )
+        remove_item_action = self.create_action(
+            action_id,
+            action_enabled,
+            action_title,
+            action_target
+        )
+        actions.append(remove_item_action)
+        return actions
 
 
 @tile(
@@ -147,8 +134,7 @@ class UsersListing(ColumnListing):
 class UsersOfGroupColumnListing(UsersListing):
     css = 'users'
     slot = 'rightlisting'
-    list_columns = ColumnListing.user_list_columns
-    members_only = True
+    related_only = True
     batchname = 'rightbatch'
     display_limit = True
     display_limit_checked = False
@@ -162,7 +148,6 @@ class UsersOfGroupColumnListing(UsersListing):
 class AllUsersColumnListing(UsersListing):
     css = 'users'
     slot = 'rightlisting'
-    list_columns = ColumnListing.user_list_columns
     batchname = 'rightbatch'
     display_limit = True
     display_limit_checked = True
@@ -184,7 +169,7 @@ class GroupForm(PrincipalForm):
 
     @property
     def form_attrmap(self):
-        return general_settings(self.model).attrs.groups_form_attrmap
+        return general_settings(self.model).snapshot.groups_form_attrmap
 
 
 @tile(name='addform', interface=Group, permission="add_group")
@@ -206,6 +191,7 @@ class GroupAddForm(GroupForm, Form):
         groups()
         self.request.environ['next_resource'] = group_id
         self.model.parent.invalidate()
+        principals_changed(groups=[group_id], action=PRINCIPAL_ADDED)
 
     def next(self, request):
         next_resource = self.request.environ.get('next_resource')
@@ -235,6 +221,8 @@ class GroupEditForm(GroupForm, Form):
                 continue
             attrs[attr_name] = data[attr_name].extracted
         self.model()
+        self.model.parent.invalidate(self.model.name)
+        principals_changed(groups=[self.model.name])
 
     def next(self, request):
         came_from = request.get('came_from')
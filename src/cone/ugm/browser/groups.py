@@ -64,6 +64,7 @@ class GroupsColumnListing(PrincipalsListing):
     list_columns = PrincipalsListing.group_list_columns
     listing_attrs = PrincipalsListing.group_attrs
     localmanager_ids = PrincipalsListing.group_localmanager_ids
+    search_index_enabled = PrincipalsListing.group_search_index_enabled
     sort_attr = PrincipalsListing.group_default_sort_column
     css = 'groups'
     batchname = 'leftbatch'
@@ -6,6 +6,8 @@ from cone.app.browser.utils import nodepath
 from cone.app.browser.utils import request_property
 from cone.app.browser.utils import safe_decode
 from cone.tile import Tile
+from cone.ugm.index import query_principal_attrs
+from cone.ugm.index import WildcardFilter
 from cone.ugm.utils import general_settings
 from pyramid.i18n import TranslationStringFactory
 from yafowil.utils import Tag
@@ -27,7 +29,6 @@ class ColumnListingBatch(Batch):
     def __init__(self, listing):
         self.listing = listing
         self.name = listing.batchname
-        self.items = listing.listing_items
         self.slicesize = listing.slicesize
 
     @property
@@ -38,7 +39,7 @@ class ColumnListingBatch(Batch):
     def vocab(self):
         ret = list()
         path = nodepath(self.model)
-        count = len(self.items)
+        count = self.listing.item_count
         pages = count // self.slicesize
         if count % self.slicesize != 0:
             pages += 1
@@ -53,6 +54,44 @@ class ColumnListingBatch(Batch):
         return ret
 
 
+class ListingItem(object):
+    """Lazy column listing item.
+
+    Only holds principal id, sort value, listing attributes and additional
+    item data. Target, content, current flag and actions get computed by the
+    listing when accessed, thus only for items which get rendered.
+    """
+    __slots__ = ('listing', 'key', 'sort_by', 'attrs', 'data', '_computed')
+    computed_keys = ('target', 'content', 'current', 'actions')
+
+    def __init__(self, listing, key, sort_by, attrs, data=None):
+        self.listing = listing
+        self.key = key
+        self.sort_by = sort_by
+        self.attrs = attrs
+        self.data = data if data is not None else dict()
+        self._computed = dict()
+
+    def __getitem__(self, name):
+        if name == 'sort_by':
+            return self.sort_by
+        computed = self._computed
+        try:
+            return computed[name]
+        except KeyError:
+            if name not in self.computed_keys:
+                raise KeyError(name)
+            factory = getattr(self.listing, 'listing_item_{}'.format(name))
+            value = computed[name] = factory(self)
+            return value
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+
 class ColumnListing(Tile):
     """Abstract column listing.
     """
@@ -165,6 +204,12 @@ class ColumnListing(Tile):
         end = start + self.slicesize
         return start, end
 
+    @property
+    def item_count(self):
+        """Total number of listing items. Used to compute the batch.
+        """
+        return len(self.listing_items)
+
     @property
     def items(self):
         start, end = self.slice
@@ -180,7 +225,8 @@ class ColumnListing(Tile):
 
     @property
     def listing_items(self):
-        """Return list of dicts like:
+        """Return list of ``ListingItem`` instances created with
+        ``create_listing_item`` or dicts like:
 
         {
             'target': u'http://example.com/foo',
@@ -217,6 +263,29 @@ class ColumnListing(Tile):
             'actions': actions,
         }
 
+    def create_listing_item(self, key, sort, attrs, **data):
+        """Create lazy listing item. See ``ListingItem``.
+        """
+        return ListingItem(self, key, sort, attrs, data)
+
+    def listing_item_target(self, item):
+        raise NotImplementedError(
+            'Abstract ``ColumnListing`` does not implement '
+            '``listing_item_target``'
+        )
+
+    def listing_item_content(self, item):
+        raise NotImplementedError(
+            'Abstract ``ColumnListing`` does not implement '
+            '``listing_item_content``'
+        )
+
+    def listing_item_current(self, item):
+        return self.current_id == item.key
+
+    def listing_item_actions(self, item):
+        return list()
+
     def create_action(self, aid, enabled, title, target):
         return {
             'id': aid,
@@ -239,12 +308,12 @@ class ColumnListing(Tile):
     @property
     def user_list_columns(self):
         settings = general_settings(self.model)
-        return settings.attrs.users_listing_columns
+        return settings.snapshot.users_listing_columns
 
     @property
     def user_attrs(self):
         settings = general_settings(self.model)
-        return settings.attrs.users_listing_columns.keys()
+        return settings.snapshot.users_listing_columns.keys()
 
     @property
     def user_localmanager_ids(self):
@@ -256,22 +325,27 @@ class ColumnListing(Tile):
     def user_default_sort_column(self):
         settings = general_settings(self.model)
         attrs = self.user_attrs
-        sort = settings.attrs.users_listing_default_column
+        sort = settings.snapshot.users_listing_default_column
         if sort not in attrs:
             return attrs[0]
         return sort
 
+    @property
+    def user_search_index_enabled(self):
+        settings = general_settings(self.model)
+        return settings.snapshot.users_listing_search_index
+
     # GROUPS RELATED
 
     @property
     def group_list_columns(self):
         settings = general_settings(self.model)
-        return settings.attrs.groups_listing_columns
+        return settings.snapshot.groups_listing_columns
 
     @property
     def group_attrs(self):
         settings = general_settings(self.model)
-        return settings.attrs.groups_listing_columns.keys()
+        return settings.snapshot.groups_listing_columns.keys()
 
     @property
     def group_localmanager_ids(self):
@@ -283,89 +357,341 @@ class ColumnListing(Tile):
     def group_default_sort_column(self):
         settings = general_settings(self.model)
         attrs = self.group_attrs
-        sort = settings.attrs.groups_listing_default_column
+        sort = settings.snapshot.groups_listing_default_column
         if sort not in attrs:
             return attrs[0]
         return sort
 
+    @property
+    def group_search_index_enabled(self):
+        settings = general_settings(self.model)
+        return settings.snapshot.groups_listing_search_index
+
     # XXX: end move
     ############################################################
 
 
 class PrincipalsListing(ColumnListing):
     """Column listing for principals.
+
+    Principals are sorted by the natural sort index of the sort attribute.
+    If the listing is not restricted by filter term or local manager, the
+    current batch page is read from the sort index directly, otherwise the
+    matching principal ids get sorted by the index. Listing attributes are
+    fetched for the principals of the current batch page only.
+
+    If ``search_index_enabled`` is True, the filter term is looked up in the
+    in-process search index of the listing attributes instead of querying
+    the backend.
     """
     delete_label = _('delete_principal', default='Delete Principal')
     delete_permission = 'delete_principal'  # inexistent permission
     listing_attrs = []
     localmanager_ids = None
+    search_index_enabled = False
     sort_attr = None
 
+    @property
+    def listing_criteria(self):
+        """Search criteria built from filter term or None.
+        """
+        filter_term = self.filter_term
+        if not filter_term:
+            return None
+        criteria = dict()
+        for attr in self.listing_attrs:
+            criteria[attr] = filter_term
+        return criteria
+
+    @property
+    def principals(self):
+        """Principals container application node.
+        """
+        return self.model
+
+    @property
+    def sort_index(self):
+        return self.principals.indexes.sort_index(self.sort_attr)
+
+    @property
+    def search_index(self):
+        return self.principals.indexes.search_index(self.listing_attrs)
+
+    def query_keys(self):
+        """Return ids of all principals matching the listing criteria.
+        """
+        if self.search_index_enabled:
+            return self.search_index.search(
+                self.principals.backend,
+                self.filter_term
+            )
+        return self.principals.backend.search(
+            criteria=self.listing_criteria,
+            or_search=True
+        )
+
+    def query_attrs(self, keys):
+        """Return dict containing listing attributes by principal id for
+        given keys.
+
+        See ``cone.ugm.index.query_principal_attrs``.
+        """
+        return query_principal_attrs(
+            self.principals.backend,
+            keys,
+            self.listing_attrs
+        )
+
+    @property
+    def localmanager_scope(self):
+        """Local manager group id and target group ids of authenticated user
+        if local manager restrictions apply, otherwise None.
+        """
+        if not self.model.local_manager_consider_for_user:
+            return None
+        state = self.model.local_manager_state
+        return (state.gid, tuple(sorted(state.target_gids)))
+
+    @request_property
+    def matching_keys(self):
+        """Set of principal ids matching filter term and local manager
+        restrictions or None if listing is not restricted.
+
+        Result is cached in the search cache of the principal indexes by
+        filter term, listing attributes and local manager scope.
+        """
+        localmanager_scope = self.localmanager_scope
+        if not self.filter_term and localmanager_scope is None:
+            return None
+        cache_key = (
+            self.filter_term,
+            tuple(self.listing_attrs),
+            localmanager_scope
+        )
+        cache = self.principals.indexes.search_cache
+        return cache.lookup(cache_key, self.query_matching_keys)
+
+    def query_matching_keys(self):
+        localmanager_ids = self.localmanager_ids
+        # if localmanager ids not none but empty, no access to any
+        # principals
+        if localmanager_ids is not None and not localmanager_ids:
+            return set()
+        keys = None
+        if self.listing_criteria:
+            keys = set(self.query_keys())
+        # reduce result by localmanager ids if not None
+        if localmanager_ids is not None:
+            if keys is None:
+                keys = set(localmanager_ids)
+            else:
+                keys = keys.intersection(localmanager_ids)
+        return frozenset(keys) if keys is not None else None
+
     @request_property
+    def sorted_matching_keys(self):
+        return self.sort_index.sort(
+            self.principals.backend,
+            self.matching_keys,
+            reverse=self.sort_order == 'desc'
+        )
+
+    def query_listing_keys(self, start=None, end=None):
+        """Sorted principal ids to display in range.
+        """
+        try:
+            if self.matching_keys is None:
+                return self.sort_index.range(
+                    self.principals.backend,
+                    start,
+                    end,
+                    reverse=self.sort_order == 'desc'
+                )
+            return self.sorted_matching_keys[start:end]
+        except Exception:
+            logger.exception('Failed to query listing keys')
+        return list()
+
+    @property
+    def listing_keys(self):
+        """Sorted list of all principal ids to display.
+        """
+        return self.query_listing_keys()
+
+    @property
+    def item_count(self):
+        try:
+            if self.matching_keys is None:
+                return self.sort_index.count(self.principals.backend)
+            return len(self.sorted_matching_keys)
+        except Exception:
+            logger.exception('Failed to count listing keys')
+        return 0
+
+    @property
+    def items(self):
+        start, end = self.slice
+        return self.create_listing_items(self.query_listing_keys(start, end))
+
+    @property
     def listing_items(self):
-        can_delete = self.request.has_permission(
-            self.delete_permission,
-            self.model
+        return self.create_listing_items(self.listing_keys)
+
+    @request_property
+    def can_delete(self):
+        return self.request.has_permission(self.delete_permission, self.model)
+
+    def create_listing_items(self, keys):
+        try:
+            ret = list()
+            principal_attrs = self.query_attrs(keys)
+            sort_attr = self.sort_attr
+            for key in keys:
+                attrs = principal_attrs.get(key)
+                if attrs is None:
+                    continue
+                sort = self.extract_raw(attrs, sort_attr)
+                ret.append(self.create_listing_item(key, sort, attrs))
+            return ret
+        except Exception:
+            logger.exception('Failed to query listing items')
+        return list()
+
+    def listing_item_target(self, item):
+        query = make_query(
+            pid=item.key,
+            came_from=make_url(self.request, node=self.model)
+        )
+        return make_url(self.request, node=self.model, query=query)
+
+    def listing_item_content(self, item):
+        attrs = item.attrs
+        vals = [self.extract_raw(attrs, attr) for attr in self.listing_attrs]
+        return self.item_content(*vals)
+
+    def listing_item_actions(self, item):
+        if not self.can_delete:
+            return list()
+        action_id = 'delete_item'
+        action_title = self.delete_label
+        action_target = make_url(
+            self.request,
+            node=self.model,
+            resource=item.key
+        )
+        delete_action = self.create_action(
+            action_id,
+            True,
+            action_title,
+            action_target
+        )
+        return [delete_action]
+
+
+class RelatedPrincipalsListing(PrincipalsListing):
+    """Column listing for principals related to the context principal.
+
+    Uses the sort index and batching of ``PrincipalsListing``. Whether a
+    principal is related is looked up in ``related_ids``. If a filter term
+    is given, listing attributes are filtered case insensitive by
+    ``WildcardFilter``, see ``query_filtered_keys``.
+    """
+    related_only = False
+    filter_lookup_limit = 100
+
+    @property
+    def principals(self):
+        raise NotImplementedError(
+            'Abstract ``RelatedPrincipalsListing`` does not implement '
+            '``principals``'
         )
+
+    @property
+    def related_ids(self):
+        raise NotImplementedError(
+            'Abstract ``RelatedPrincipalsListing`` does not implement '
+            '``related_ids``'
+        )
+
+    @request_property
+    def matching_keys(self):
+        keys = None
+        if self.related_only:
+            keys = set(self.related_ids)
+        localmanager_ids = self.localmanager_ids
+        if localmanager_ids is not None:
+            if keys is None:
+                keys = set(localmanager_ids)
+            else:
+                keys = keys.intersection(localmanager_ids)
+        if self.filter_term:
+            keys = self.query_filtered_keys(keys)
+        return keys
+
+    @request_property
+    def wildcard_filter(self):
+        return WildcardFilter(self.filter_term)
+
+    def query_filtered_keys(self, keys=None):
+        """Return set of principal ids matching filter term.
+
+        If ``keys`` is None all principals are considered. Up to
+        ``filter_lookup_limit`` keys get filtered by looking up their listing
+        attributes. Otherwise all principals matching the filter term are
+        computed with one projected search and cached in the search cache of
+        the principal indexes, thus paging through filtered results does not
+        query the backend again.
+        """
+        if keys is not None and len(keys) <= self.filter_lookup_limit:
+            return self.filter_keys(self.query_attrs(keys).items())
+        cache_key = (
+            'filter',
+            self.filter_term,
+            tuple(self.listing_attrs)
+        )
+        cache = self.principals.indexes.search_cache
+        matching = cache.lookup(cache_key, self.query_all_filtered_keys)
+        if keys is None:
+            return set(matching)
+        return matching.intersection(keys)
+
+    def query_all_filtered_keys(self):
+        attrlist = list(self.listing_attrs)
+        principal_attrs = self.principals.backend.search(attrlist=attrlist)
+        return frozenset(self.filter_keys(principal_attrs))
+
+    def filter_keys(self, principal_attrs):
+        """Return set of principal ids from ``(key, attrs)`` pairs where any
+        listing attribute matches the filter term.
+        """
+        attrlist = self.listing_attrs
+        rows = [
+            (key, [attrs.get(attr) for attr in attrlist])
+            for key, attrs in principal_attrs
+        ]
+        return set(self.wildcard_filter.filter(rows))
+
+    def create_listing_items(self, keys):
         try:
             ret = list()
-            localmanager_ids = self.localmanager_ids
-            # if localmanager ids not none but empty, no access to any
-            # principals
-            if localmanager_ids is not None and not localmanager_ids:
-                return ret
-            attrlist = self.listing_attrs
+            principal_attrs = self.query_attrs(keys)
+            related_ids = self.related_ids
             sort_attr = self.sort_attr
-            # build criteria from filter term
-            criteria = None
-            filter_term = self.filter_term
-            if filter_term:
-                criteria = dict()
-                for attr in attrlist:
-                    criteria[attr] = filter_term
-            principals = self.model.backend
-            result = principals.search(
-                criteria=criteria,
-                attrlist=attrlist,
-                or_search=True
-            )
-            for key, attrs in result:
-                # reduce result by localmanager ids if not None
-                if localmanager_ids is not None and key not in localmanager_ids:
+            for key in keys:
+                attrs = principal_attrs.get(key)
+                if attrs is None:
                     continue
-                actions = list()
-                if can_delete:
-                    action_id = 'delete_item'
-                    action_title = self.delete_label
-                    action_target = make_url(
-                        self.request,
-                        node=self.model,
-                        resource=key
-                    )
-                    delete_action = self.create_action(
-                        action_id,
-                        True,
-                        action_title,
-                        action_target
-                    )
-                    actions = [delete_action]
-                vals = [self.extract_raw(attrs, attr) for attr in attrlist]
                 sort = self.extract_raw(attrs, sort_attr)
-                query = make_query(
-                    pid=key,
-                    came_from=make_url(self.request, node=self.model)
-                )
-                target = make_url(self.request, node=self.model, query=query)
-                content = self.item_content(*vals)
-                current = self.current_id == key
-                ret.append(self.create_item(
+                ret.append(self.create_listing_item(
+                    key,
                     sort,
-                    target,
-                    content,
-                    current,
-                    actions
+                    attrs,
+                    related=key in related_ids
                 ))
             return ret
         except Exception:
             logger.exception('Failed to query listing items')
         return list()
+
+    def listing_item_current(self, item):
+        return False
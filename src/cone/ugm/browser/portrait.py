@@ -24,8 +24,8 @@ def portrait_image(model, request):
     on user.
     """
     response = Response()
-    settings = general_settings(model)
-    response.body = model.attrs[settings.attrs.users_portrait_attr]
+    settings = general_settings(model).snapshot
+    response.body = model.attrs[settings.users_portrait_attr]
     response.headers['Content-Type'] = 'image/jpeg'
     response.headers['Cache-Control'] = 'max-age=0'
     return response
@@ -38,8 +38,8 @@ class PortraitForm(Behavior):
     @default
     @property
     def portrait_support(self):
-        settings = general_settings(self.model)
-        return settings.attrs.users_portrait == 'True'
+        settings = general_settings(self.model).snapshot
+        return settings.users_portrait
 
     @plumb
     def prepare(_next, self):
@@ -55,11 +55,11 @@ class PortraitForm(Behavior):
             mode = 'edit'
         else:
             mode = 'display'
-        settings = general_settings(model)
-        image_attr = settings.attrs.users_portrait_attr
-        image_accept = settings.attrs.users_portrait_accept
-        image_width = int(settings.attrs.users_portrait_width)
-        image_height = int(settings.attrs.users_portrait_height)
+        settings = general_settings(model).snapshot
+        image_attr = settings.users_portrait_attr
+        image_accept = settings.users_portrait_accept
+        image_width = settings.users_portrait_width
+        image_height = settings.users_portrait_height
         image_data = model.attrs.get(image_attr)
         if image_data:
             image_value = {
@@ -97,8 +97,8 @@ class PortraitForm(Behavior):
                 not self.request.has_permission('edit_user', self.model.parent):
             _next(self, widget, data)
             return
-        settings = general_settings(self.model)
-        image_attr = settings.attrs.users_portrait_attr
+        settings = general_settings(self.model).snapshot
+        image_attr = settings.users_portrait_attr
         portrait = data.fetch('userform.portrait').extracted
         if portrait:
             if portrait['action'] in ['new', 'replace']:
@@ -110,3 +110,5 @@ class PortraitForm(Behavior):
             if portrait['action'] == 'delete':
                 del self.model.attrs[image_attr]
         _next(self, widget, data)
+        if portrait and self.action_resource in ['edit', 'overlayedit']:
+            self.model.parent.invalidate(self.model.name)
@@ -271,7 +271,7 @@ class LoginNameExtractor(object):
 
 @user_field('login')
 def login_name_field_factory(form, label, value):
-    settings = general_settings(form.model).attrs
+    settings = general_settings(form.model).snapshot
     login_attr = settings.users_login_name_attr
     if login_attr == 'login':
         factory = default_form_field_factory
@@ -1,6 +1,25 @@
+from collections import OrderedDict
+from cone.app import compat
+from cone.ugm.browser.actions import LM_TARGET_GID_IS_DEFAULT
+from cone.ugm.browser.actions import LM_TARGET_GID_NOT_ALLOWED
+from cone.ugm.browser.actions import LM_TARGET_UID_NOT_ALLOWED
+from cone.ugm.browser.actions import membership_violations
+from cone.ugm.browser.groups import GroupsColumnListing
+from cone.ugm.browser.users import UsersColumnListing
+from cone.ugm.index import query_principal_attrs
+from cone.ugm.model.groups import Groups
 from cone.ugm.model.users import Users
+from cone.ugm.settings import PRINCIPAL_ADDED
+from cone.ugm.settings import PRINCIPAL_DELETED
+from cone.ugm.settings import principals_changed
+from cone.ugm.unitofwork import unit_of_work
 from cone.ugm.utils import general_settings
+from pyramid.response import Response
 from pyramid.view import view_config
+import csv
+import io
+import itertools
+import json
 
 
 @view_config(
@@ -41,44 +60,220 @@ def remote_add_user(model, request):
 
         Restrictions - All values, whether single or multi valued, are passed
         as string or list of strings to the create function.
-    """
-    params = request.params
-    uid = params.get('id')
 
-    if not uid:
+    upsert
+        If ``1`` or ``true``, an existing user gets updated instead of
+        failing, see ``upsert_user``.
+    """
+    if request.params.get('upsert') in ['1', 'true', 'True']:
+        return upsert_user(model, request)
+    success, message = create_user(
+        model,
+        request.params,
+        user_attributes(model),
+        user_roles()
+    )
+    try:
+        if success:
+            model.backend.parent()
+            user_created(request.params.get('id'), request.params)
+        return {
+            'success': success,
+            'message': message,
+        }
+    except Exception as e:
         return {
             'success': False,
-            'message': u"No user ID given.",
+            'message': str(e),
         }
+    finally:
+        model.invalidate()
+
 
+def upsert_user(model, request):
+    """Create user or update existing user via remote service.
+
+    Request parameters are the same as for ``remote_add_user``. If the user
+    not exists yet, it gets created. Otherwise the changes of attributes,
+    groups and roles are computed by ``user_diff`` and only differing values
+    get written, with one persist call. For existing users, groups and roles
+    are only synchronized if given, the password is not changed at all.
+    Updating users requires ``edit_user`` permission on the user, membership
+    changes are checked against local manager restrictions and roles are only
+    changed with ``manage`` permission.
+
+    Returns a JSON response containing success state, a message and whether
+    anything changed::
+
+    {
+        success: true, // respective false
+        message: 'message',
+        changed: true // respective false
+    }
+    """
+    params = request.params
+    user_id = params.get('id')
     users = model.backend
-    if uid in users:
+    if not user_id or user_id not in users:
+        success, message = create_user(
+            model,
+            params,
+            user_attributes(model),
+            user_roles()
+        )
+        try:
+            if success:
+                users.parent()
+                user_created(user_id, params)
+            return {
+                'success': success,
+                'message': message,
+                'changed': success,
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'message': str(e),
+                'changed': False,
+            }
+        finally:
+            model.invalidate()
+
+    if not request.has_permission('edit_user', model[user_id]):
         return {
             'success': False,
-            'message': u"User with given ID already exists.",
+            'message': u"Editing user denied.",
+            'changed': False,
         }
+    user = users[user_id]
+    state = {
+        'attrs': user.attrs,
+        'groups': set(user.group_ids),
+        'roles': set(user.roles),
+    }
+    changes, messages = user_diff(
+        state,
+        params,
+        user_attributes(model),
+        user_roles(),
+        set(users.parent.groups.keys())
+    )
+    violations = membership_violations(
+        model,
+        [user_id],
+        changes.get('add_groups', [])
+    )
+    violations += membership_violations(
+        model,
+        [user_id],
+        changes.get('remove_groups', []),
+        remove=True
+    )
+    if violations:
+        return {
+            'success': False,
+            'message': membership_error_messages[violations[0][0]],
+            'changed': False,
+        }
+    if ('add_roles' in changes or 'remove_roles' in changes) \
+            and not request.has_permission('manage', model):
+        changes.pop('add_roles', None)
+        changes.pop('remove_roles', None)
+        messages.append(u"Changing roles denied.")
+    if changes:
+        uow = unit_of_work(model.root, request)
+        try:
+            apply_user_diff(model, user_id, changes, uow)
+            uow.flush()
+        except Exception as e:
+            uow.discard()
+            return {
+                'success': False,
+                'message': str(e),
+                'changed': False,
+            }
+        messages.append(u"Updated user with ID '%s'." % user_id)
+    else:
+        messages.append(u"User with ID '%s' unchanged." % user_id)
+    return {
+        'success': True,
+        'message': u' '.join(messages),
+        'changed': bool(changes),
+    }
 
-    password = params.get('password')
 
-    add_roles = params.get('roles', '')
-    add_roles = [val.strip() for val in add_roles.split(',') if val]
+def user_attributes(model):
+    """Return names of user attributes which can be set remotely.
+    """
+    settings = general_settings(model).snapshot
+    attrmap = settings.users_form_attrmap
+    exposed = settings.users_exposed_attributes
+    return attrmap.keys() + list(exposed)
+
+
+def user_roles():
+    """Return names of available roles.
+    """
+    from cone.app.security import DEFAULT_ROLES
+    return [role[0] for role in DEFAULT_ROLES]
+
+
+def valid_values(value):
+    """Check whether value is a string or a list of strings.
+    """
+    if isinstance(value, compat.STR_TYPE):
+        return True
+    if not isinstance(value, list):
+        return False
+    return all([isinstance(val, compat.STR_TYPE) for val in value])
+
 
-    add_groups = params.get('groups', '')
-    add_groups = [val.strip() for val in add_groups.split(',') if val]
+def split_values(value):
+    """Return list of values from comma separated string or list.
+    """
+    if not value:
+        return []
+    if not isinstance(value, list):
+        value = value.split(',')
+    return [val.strip() for val in value if val]
+
+
+def create_user(model, params, valid_attrs, available_roles):
+    """Create user from params as expected by ``remote_add_user``.
+
+    The UGM is not persisted here, except by setting the password, which is
+    persisted immediately by UGM backends. Returns a tuple containing success
+    state and message.
+    """
+    uid = params.get('id')
+    if not uid:
+        return False, u"No user ID given."
+    if not isinstance(uid, compat.STR_TYPE):
+        return False, u"Invalid user ID."
+
+    users = model.backend
+    if uid in users:
+        return False, u"User with given ID already exists."
+
+    password = params.get('password')
+    if password is not None and not isinstance(password, compat.STR_TYPE):
+        return False, u"Invalid password."
+    for name in ['roles', 'groups']:
+        value = params.get(name)
+        if value is not None and not valid_values(value):
+            return False, u"Invalid value for '%s'." % name
+    add_roles = split_values(params.get('roles', ''))
+    add_groups = split_values(params.get('groups', ''))
 
     attrs = dict()
     for key, val in params.items():
         if not key.startswith('attr.'):
             continue
+        if val is not None and not valid_values(val):
+            return False, u"Invalid value for '%s'." % key
         key = key[key.find('.') + 1:]
         attrs[key] = val
 
-    settings = general_settings(model)
-    attrmap = settings.attrs.users_form_attrmap
-    exposed = settings.attrs.users_exposed_attributes
-    if not exposed:
-        exposed = list()
-    valid_attrs = attrmap.keys() + exposed
     checked_attrs = dict()
     for key in valid_attrs:
         val = attrs.get(key)
@@ -90,8 +285,6 @@ def remote_add_user(model, request):
         user = users.create(uid, **checked_attrs)
         message = u""
 
-        from cone.app.security import DEFAULT_ROLES
-        available_roles = [role[0] for role in DEFAULT_ROLES]
         for role in add_roles:
             if role not in available_roles:
                 message += u"Role '%s' given but inexistent. " % role
@@ -105,25 +298,171 @@ def remote_add_user(model, request):
                 continue
             groups[group].add(uid)
 
-        users.parent()
-
         if password is not None:
             users.passwd(uid, None, password)
 
         message += u"Created user with ID '%s'." % uid
-        return {
-            'success': True,
-            'message': message,
-        }
+        return True, message
     except Exception as e:
-        return {
-            'success': False,
-            'message': str(e),
-        }
+        return False, str(e)
+
+
+def user_created(user_id, params):
+    """Notify other processes about user created from params.
+    """
+    principals_changed(users=[user_id], action=PRINCIPAL_ADDED)
+    principals_changed(groups=split_values(params.get('groups')))
+
+
+ADD_USERS_BATCH_SIZE = 100
+
+
+def read_ndjson(body_file):
+    """Iterate rows of NDJSON stream. Invalid rows are returned as None.
+    """
+    for line in body_file:
+        line = line.strip()
+        if not line:
+            continue
+        if not isinstance(line, compat.UNICODE_TYPE):
+            line = line.decode('utf-8')
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row if isinstance(row, dict) else None
+
+
+def read_csv(body_file):
+    """Iterate rows of CSV stream. First line contains the column names.
+    Empty values are skipped.
+    """
+    lines = body_file
+    if not compat.IS_PY2:
+        lines = (line.decode('utf-8') for line in body_file)
+    for row in csv.DictReader(lines):
+        yield dict([(key, val) for key, val in row.items() if key and val])
+
+
+def add_users(model, rows, batch_size):
+    """Create users from rows and persist them in batches.
+
+    Yields the results of each batch after it has been persisted. If
+    persisting fails, all users of the batch are reported as failed. Invalid
+    rows are reported as failed. If reading rows fails, the pending batch
+    gets persisted and reported before the failure is reported.
+    """
+    users = model.backend
+    valid_attrs = user_attributes(model)
+    available_roles = user_roles()
+    batch = list()
+    group_ids = set()
+
+    def commit(batch):
+        if not any(result['success'] for result in batch):
+            return batch
+        try:
+            users.parent()
+        except Exception as e:
+            model.invalidate()
+            for result in batch:
+                if result['success']:
+                    result['success'] = False
+                    result['message'] = str(e)
+            return batch
+        principals_changed(
+            users=[result['id'] for result in batch if result['success']],
+            action=PRINCIPAL_ADDED
+        )
+        principals_changed(groups=group_ids)
+        group_ids.clear()
+        return batch
+
+    rows = iter(rows)
+    number = 0
+    try:
+        while True:
+            number += 1
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except Exception as e:
+                batch.append({
+                    'row': number,
+                    'id': None,
+                    'success': False,
+                    'message': u"Reading rows failed: %s" % e,
+                })
+                break
+            if row is None:
+                uid = None
+                success, message = False, u"Invalid row."
+            else:
+                uid = row.get('id')
+                try:
+                    success, message = create_user(
+                        model,
+                        row,
+                        valid_attrs,
+                        available_roles
+                    )
+                except Exception as e:
+                    success, message = False, str(e)
+                if success:
+                    group_ids.update(split_values(row.get('groups')))
+            batch.append({
+                'row': number,
+                'id': uid,
+                'success': success,
+                'message': message,
+            })
+            if len(batch) >= batch_size:
+                for result in commit(batch):
+                    yield result
+                batch = list()
+        for result in commit(batch):
+            yield result
     finally:
         model.invalidate()
 
 
+@view_config(
+    name='remote_add_users',
+    context=Users,
+    permission='add_user')
+def remote_add_users(model, request):
+    """Add users from NDJSON or CSV stream via remote service.
+
+    The request body is read as stream. Rows are expected as CSV if content
+    type of the request is ``text/csv``, otherwise as NDJSON. Each row
+    contains the parameters expected by ``remote_add_user``, i.e. ``id``,
+    ``password``, ``roles``, ``groups`` and ``attr.*``. In NDJSON rows,
+    ``roles`` and ``groups`` might also be lists.
+
+    Users are persisted in batches of ``batch_size`` rows, which is read from
+    request parameters and defaults to ``ADD_USERS_BATCH_SIZE``.
+
+    Returns a NDJSON stream containing the result of each row::
+
+    {"row": 1, "id": "user_id", "success": true, "message": "message"}
+    """
+    try:
+        batch_size = max(int(request.params.get('batch_size')), 1)
+    except (TypeError, ValueError):
+        batch_size = ADD_USERS_BATCH_SIZE
+    if request.content_type == 'text/csv':
+        rows = read_csv(request.body_file)
+    else:
+        rows = read_ndjson(request.body_file)
+    results = add_users(model, rows, batch_size)
+    response = Response(content_type='application/x-ndjson')
+    response.app_iter = (
+        (json.dumps(result) + '\n').encode('utf-8') for result in results
+    )
+    return response
+
+
 @view_config(
     name='remote_delete_user',
     accept='application/json',
@@ -163,8 +502,11 @@ def remote_delete_user(model, request):
         }
 
     try:
+        group_ids = users[uid].group_ids
         del users[uid]
         users.parent()
+        principals_changed(users=[uid], action=PRINCIPAL_DELETED)
+        principals_changed(groups=group_ids)
 
         message = u"Deleted user with ID '%s'." % uid
         return {
@@ -178,3 +520,887 @@ def remote_delete_user(model, request):
         }
     finally:
         model.invalidate()
+
+
+@view_config(
+    name='remote_delete_users',
+    accept='application/json',
+    renderer='json',
+    context=Users,
+    permission='delete_user')
+def remote_delete_users(model, request):
+    """Remove many users at once via remote service.
+
+    Expects a JSON list of user ids as request body. Memberships of the users
+    get removed before the users are deleted. Only groups the deleted users
+    are member of get loaded. Users and groups are persisted at once.
+
+    Returns a JSON response containing success state, a message and the
+    results of the user ids in request order::
+
+    {
+        success: true, // respective false if any user id failed
+        message: 'message',
+        results: [{
+            id: 'user_id',
+            success: true,
+            message: 'message'
+        }]
+    }
+    """
+    try:
+        user_ids = request.json_body
+    except ValueError:
+        user_ids = None
+    if not isinstance(user_ids, list):
+        return {
+            'success': False,
+            'message': u"Expected list of user ids as request body.",
+        }
+
+    users = model.backend
+    consider_lm = model.local_manager_consider_for_user
+    results = list()
+    delete_ids = set()
+    for user_id in user_ids:
+        if not isinstance(user_id, compat.STR_TYPE) or not user_id:
+            success, message = False, u"Invalid user ID."
+        elif user_id in delete_ids:
+            success, message = False, u"User ID given multiple times."
+        elif user_id not in users:
+            success, message = False, u"User with given ID not exists."
+        elif consider_lm and user_id not in model.local_manager_target_uids:
+            success, message = False, u"Deleting user denied."
+        else:
+            delete_ids.add(user_id)
+            success = True
+            message = u"Deleted user with ID '%s'." % user_id
+        results.append({
+            'id': user_id,
+            'success': success,
+            'message': message,
+        })
+
+    uow = unit_of_work(model.root, request)
+    try:
+        if delete_ids:
+            groups = users.parent.groups
+            for user_id in delete_ids:
+                for group_id in users[user_id].group_ids:
+                    del groups[group_id][user_id]
+                    uow.membership_changed(user_id, group_id)
+                del users[user_id]
+                uow.user_deleted(user_id)
+            uow.flush()
+    except Exception as e:
+        uow.discard()
+        return {
+            'success': False,
+            'message': str(e),
+        }
+
+    failed = len(user_ids) - len(delete_ids)
+    if failed:
+        message = u"%i of %i users could not be deleted." % (
+            failed, len(user_ids)
+        )
+    else:
+        message = u"Deleted %i users." % len(user_ids)
+    return {
+        'success': not failed,
+        'message': message,
+        'results': results,
+    }
+
+
+def group_memberships(groups, user_ids):
+    """Return dict containing sets of group ids by user id for given user
+    ids.
+
+    Memberships are looked up in one pass over the member ids of all groups
+    instead of resolving the groups of each user.
+    """
+    user_ids = set(user_ids)
+    memberships = dict([(user_id, set()) for user_id in user_ids])
+    for group in groups.values():
+        for user_id in user_ids.intersection(group.member_ids):
+            memberships[user_id].add(group.name)
+    return memberships
+
+
+READ_STATES_LOOKUP_LIMIT = 100
+
+
+def read_user_states(model, user_ids, attrs, groups=True, roles=True):
+    """Return current state of users as dict by user id.
+
+    Only the given users get read. ``attrs`` are the attribute names to
+    read, memberships and roles are only read if ``groups`` respective
+    ``roles`` is set. Inexistent users are skipped.
+
+    Attributes are read with searches projected to ``attrs``. Up to
+    ``READ_STATES_LOOKUP_LIMIT`` users are looked up by ID one by one, larger
+    amounts are read with one projected search over all users.
+    Memberships are read with one reverse lookup over the groups instead of
+    resolving the groups of each user.
+    """
+    users = model.backend
+    user_ids = set(user_ids)
+    attrlist = ['id'] + sorted(attrs)
+
+    def projected(criteria):
+        for user_id, user_attrs in users.search(
+            criteria=criteria,
+            attrlist=attrlist
+        ):
+            if user_id not in user_ids:
+                continue
+            yield user_id, dict([
+                (attr, user_attrs[attr])
+                for attr in attrs if user_attrs.get(attr)
+            ])
+
+    if len(user_ids) > READ_STATES_LOOKUP_LIMIT:
+        found = projected(None)
+    else:
+        found = itertools.chain.from_iterable([
+            projected({'id': user_id}) for user_id in sorted(user_ids)
+        ])
+    states = dict()
+    for user_id, user_attrs in found:
+        states[user_id] = {'attrs': user_attrs}
+    if groups:
+        memberships = group_memberships(users.parent.groups, states)
+        for user_id, state in states.items():
+            state['groups'] = memberships[user_id]
+    if roles:
+        for user_id, state in states.items():
+            state['roles'] = set(users[user_id].roles)
+    return states
+
+
+def user_diff(state, row, valid_attrs, available_roles, group_ids):
+    """Return changes needed to bring user from current to desired state.
+
+    ``state`` is the current state of the user as returned by
+    ``read_user_states``. ``row`` is the desired state of the user with keys
+    as expected by ``remote_add_user``. Only attributes, groups and roles
+    contained in ``row`` are considered. Empty attribute values mean the
+    attribute should be unset.
+
+    Returns a tuple containing the changes dict and a list of messages about
+    ignored invalid values.
+    """
+    messages = list()
+    attrs = dict()
+    current_attrs = state['attrs']
+    for key, val in row.items():
+        if not key.startswith('attr.'):
+            continue
+        key = key[key.find('.') + 1:]
+        if key not in valid_attrs:
+            messages.append(u"Attribute '%s' given but not allowed." % key)
+            continue
+        if export_value(current_attrs.get(key)) != export_value(val):
+            attrs[key] = val
+    changes = {'attrs': attrs}
+    if 'groups' in row:
+        desired = set()
+        for group_id in split_values(row['groups']):
+            if group_id not in group_ids:
+                messages.append(
+                    u"Group '%s' given but inexistent." % group_id
+                )
+                continue
+            desired.add(group_id)
+        changes['add_groups'] = sorted(desired - state['groups'])
+        changes['remove_groups'] = sorted(state['groups'] - desired)
+    if 'roles' in row:
+        desired = set()
+        for role in split_values(row['roles']):
+            if role not in available_roles:
+                messages.append(u"Role '%s' given but inexistent." % role)
+                continue
+            desired.add(role)
+        changes['add_roles'] = sorted(desired - state['roles'])
+        changes['remove_roles'] = sorted(state['roles'] - desired)
+    changes = dict([(key, val) for key, val in changes.items() if val])
+    return changes, messages
+
+
+def apply_user_diff(model, user_id, changes, uow):
+    """Apply changes as returned by ``user_diff`` to user and record them on
+    unit of work.
+    """
+    users = model.backend
+    user = users[user_id]
+    user_attrs = user.attrs
+    for key, val in changes.get('attrs', {}).items():
+        if val:
+            user_attrs[key] = val
+        elif key in user_attrs:
+            del user_attrs[key]
+    for role in changes.get('add_roles', []):
+        user.add_role(role)
+    for role in changes.get('remove_roles', []):
+        user.remove_role(role)
+    if 'attrs' in changes or 'add_roles' in changes \
+            or 'remove_roles' in changes:
+        uow.user_changed(user_id)
+    groups = users.parent.groups
+    for group_id in changes.get('add_groups', []):
+        groups[group_id].add(user_id)
+        uow.membership_changed(user_id, group_id)
+    for group_id in changes.get('remove_groups', []):
+        del groups[group_id][user_id]
+        uow.membership_changed(user_id, group_id)
+
+
+@view_config(
+    name='remote_sync_users',
+    accept='application/json',
+    renderer='json',
+    context=Users,
+    permission='manage')
+def remote_sync_users(model, request):
+    """Synchronize existing users with desired state via remote service.
+
+    Expects a JSON list of objects as request body, each containing the
+    desired state of a user with keys as expected by ``remote_add_user``,
+    i.e. ``id``, ``attr.*``, ``groups`` and ``roles``. Only attributes,
+    groups and roles contained in an object are synchronized. The output of
+    ``remote_export_users`` can be used as input.
+
+    Current state of the users is read with ``read_user_states`` and the
+    minimal changes are computed. Rows containing values which are neither
+    strings nor lists of strings fail. If ``dry_run`` request parameter is set,
+    changes are only reported, otherwise they are applied and persisted at
+    once. If nothing changed, nothing gets written.
+
+    Returns a JSON response containing success state, a message and the
+    results of the users in request order::
+
+    {
+        success: true, // respective false if any user failed
+        message: 'message',
+        dry_run: false,
+        results: [{
+            id: 'user_id',
+            success: true,
+            changed: true,
+            changes: {
+                attrs: {name: 'value'},
+                add_groups: ['group_id'],
+                remove_groups: ['group_id'],
+                add_roles: ['role'],
+                remove_roles: ['role']
+            },
+            message: 'message'
+        }]
+    }
+    """
+    try:
+        rows = request.json_body
+    except ValueError:
+        rows = None
+    if not isinstance(rows, list):
+        return {
+            'success': False,
+            'message': u"Expected list of users as request body.",
+        }
+    dry_run = request.params.get('dry_run') in ['1', 'true', 'True']
+
+    valid_attrs = user_attributes(model)
+    available_roles = user_roles()
+    users = model.backend
+    group_ids = set(users.parent.groups.keys())
+
+    user_ids = set()
+    read_attrs = set()
+    read_groups = read_roles = False
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        user_id = row.get('id')
+        if isinstance(user_id, compat.STR_TYPE):
+            user_ids.add(user_id)
+        for key in row:
+            if key.startswith('attr.') and key[5:] in valid_attrs:
+                read_attrs.add(key[5:])
+        read_groups = read_groups or 'groups' in row
+        read_roles = read_roles or 'roles' in row
+    states = read_user_states(
+        model,
+        user_ids,
+        read_attrs,
+        groups=read_groups,
+        roles=read_roles
+    )
+
+    results = list()
+    diffs = list()
+    synced_ids = set()
+    for row in rows:
+        user_id = row.get('id') if isinstance(row, dict) else None
+        result = {
+            'id': user_id,
+            'success': False,
+            'changed': False,
+        }
+        results.append(result)
+        if not isinstance(user_id, compat.STR_TYPE) or not user_id:
+            result['message'] = u"Invalid user ID."
+            continue
+        if user_id in synced_ids:
+            result['message'] = u"User ID given multiple times."
+            continue
+        synced_ids.add(user_id)
+        invalid = [
+            key for key, val in sorted(row.items())
+            if (key in ['groups', 'roles'] or key.startswith('attr.'))
+            and val is not None and not valid_values(val)
+        ]
+        if invalid:
+            result['message'] = u"Invalid value for '%s'." % invalid[0]
+            continue
+        state = states.get(user_id)
+        if state is None:
+            result['message'] = u"User with given ID not exists."
+            continue
+        changes, messages = user_diff(
+            state,
+            row,
+            valid_attrs,
+            available_roles,
+            group_ids
+        )
+        if changes:
+            diffs.append((user_id, changes))
+            messages.append(u"Synchronized user with ID '%s'." % user_id)
+        else:
+            messages.append(u"User with ID '%s' unchanged." % user_id)
+        result.update({
+            'success': True,
+            'changed': bool(changes),
+            'changes': changes,
+            'message': u' '.join(messages),
+        })
+
+    if not dry_run and diffs:
+        uow = unit_of_work(model.root, request)
+        try:
+            for user_id, changes in diffs:
+                apply_user_diff(model, user_id, changes, uow)
+            uow.flush()
+        except Exception as e:
+            uow.discard()
+            return {
+                'success': False,
+                'message': str(e),
+            }
+
+    failed = len([result for result in results if not result['success']])
+    if failed:
+        message = u"%i of %i users could not be synchronized." % (
+            failed, len(rows)
+        )
+    else:
+        message = u"%i of %i users changed." % (len(diffs), len(rows))
+    return {
+        'success': not failed,
+        'message': message,
+        'dry_run': dry_run,
+        'results': results,
+    }
+
+
+membership_error_messages = {
+    LM_TARGET_GID_NOT_ALLOWED: u"Manage membership denied for target group.",
+    LM_TARGET_UID_NOT_ALLOWED: u"Manage membership denied for user.",
+    LM_TARGET_GID_IS_DEFAULT: u"Target group is default group of user.",
+}
+
+
+@view_config(
+    name='remote_membership',
+    accept='application/json',
+    renderer='json',
+    context=Users,
+    permission='manage_membership')
+@view_config(
+    name='remote_membership',
+    accept='application/json',
+    renderer='json',
+    context=Groups,
+    permission='manage_membership')
+def remote_membership(model, request):
+    """Add and remove memberships of many users and groups at once via remote
+    service.
+
+    Expects a JSON list of ``[user_id, group_id, action]`` items as request
+    body, where action is either ``add`` or ``remove``. Items get validated
+    with local manager restrictions in one pass, valid items get applied and
+    persisted at once.
+
+    Returns a JSON response containing success state, a message and the
+    results of the items in request order::
+
+    {
+        success: true, // respective false if any item failed
+        message: 'message',
+        results: [{
+            user: 'user_id',
+            group: 'group_id',
+            action: 'add',
+            success: true,
+            message: 'message'
+        }]
+    }
+    """
+    try:
+        items = request.json_body
+    except ValueError:
+        items = None
+    if not isinstance(items, list):
+        return {
+            'success': False,
+            'message': u"Expected list of memberships as request body.",
+        }
+
+    root = model.root
+    users = root['users'].backend
+    groups = root['groups'].backend
+    members = dict()
+    uow = unit_of_work(root, request)
+    results = list()
+
+    def result(user_id, group_id, action, success, message):
+        results.append({
+            'user': user_id,
+            'group': group_id,
+            'action': action,
+            'success': success,
+            'message': message,
+        })
+
+    try:
+        for item in items:
+            if not isinstance(item, list) or len(item) != 3:
+                result(None, None, None, False, u"Invalid membership item.")
+                continue
+            user_id, group_id, action = item
+            if not isinstance(user_id, compat.STR_TYPE) \
+                    or not isinstance(group_id, compat.STR_TYPE):
+                result(None, None, None, False, u"Invalid membership item.")
+                continue
+            if action not in ('add', 'remove'):
+                result(
+                    user_id, group_id, action, False,
+                    u"Invalid action '%s'." % action
+                )
+                continue
+            if user_id not in users:
+                result(
+                    user_id, group_id, action, False,
+                    u"User '%s' not exists." % user_id
+                )
+                continue
+            if group_id not in groups:
+                result(
+                    user_id, group_id, action, False,
+                    u"Group '%s' not exists." % group_id
+                )
+                continue
+            violations = membership_violations(
+                model,
+                [user_id],
+                [group_id],
+                remove=action == 'remove'
+            )
+            if violations:
+                result(
+                    user_id, group_id, action, False,
+                    membership_error_messages[violations[0][0]]
+                )
+                continue
+            member_ids = members.get(group_id)
+            if member_ids is None:
+                member_ids = set(groups[group_id].member_ids)
+                members[group_id] = member_ids
+            if action == 'add':
+                if user_id in member_ids:
+                    message = u"User '%s' already member of group '%s'."
+                else:
+                    groups[group_id].add(user_id)
+                    member_ids.add(user_id)
+                    uow.membership_changed(user_id, group_id)
+                    message = u"Added user '%s' to group '%s'."
+            else:
+                if user_id not in member_ids:
+                    message = u"User '%s' is no member of group '%s'."
+                else:
+                    del groups[group_id][user_id]
+                    member_ids.remove(user_id)
+                    uow.membership_changed(user_id, group_id)
+                    message = u"Removed user '%s' from group '%s'."
+            result(
+                user_id, group_id, action, True,
+                message % (user_id, group_id)
+            )
+        uow.flush()
+    except Exception as e:
+        uow.discard()
+        return {
+            'success': False,
+            'message': str(e),
+        }
+
+    failed = len([it for it in results if not it['success']])
+    if failed:
+        message = u"%i of %i membership changes failed." % (
+            failed, len(results)
+        )
+    else:
+        message = u"Applied %i membership changes." % len(results)
+    return {
+        'success': not failed,
+        'message': message,
+        'results': results,
+    }
+
+
+def export_value(value):
+    """Return attribute value as exported. Multi valued attributes are
+    exported as list, binary values are skipped.
+    """
+    if type(value) in compat.ITER_TYPES:
+        return [export_value(val) for val in value if val is not None]
+    if value is None or isinstance(value, bytes) and not compat.IS_PY2:
+        return u''
+    if isinstance(value, compat.STR_TYPE):
+        return value
+    return compat.UNICODE_TYPE(value)
+
+
+def csv_line(values):
+    """Return values as CSV line.
+    """
+    buffer = io.BytesIO() if compat.IS_PY2 else io.StringIO()
+    row = list()
+    for value in values:
+        if isinstance(value, list):
+            value = u','.join(value)
+        if compat.IS_PY2:
+            value = value.encode('utf-8')
+        row.append(value)
+    csv.writer(buffer).writerow(row)
+    line = buffer.getvalue()
+    return line if compat.IS_PY2 else line.encode('utf-8')
+
+
+EXPORT_CHUNK_SIZE = 500
+
+
+def export_principals(model, request, principal_ids, default_attrs,
+                      valid_attrs, related):
+    """Return response streaming principals as NDJSON or CSV.
+
+    ``principal_ids`` is an iterable of principal ids to export. ``related``
+    is a tuple containing the column name of related principal ids and a
+    factory. The factory gets called once when streaming starts and returns
+    a callable, which gets called with principal id and principal and
+    returns the related principal ids. Requested attributes get checked
+    against ``valid_attrs``, if no attributes requested, ``default_attrs``
+    are exported.
+
+    Principals are processed in chunks of ``EXPORT_CHUNK_SIZE``. Principal
+    nodes of a processed chunk get invalidated on the backend, thus backends
+    caching principal nodes do not grow while exporting.
+
+    Output format is CSV if ``format`` request parameter is ``csv``,
+    otherwise NDJSON. Columns are named like parameters of
+    ``remote_add_user``, thus exported users can be imported again via
+    ``remote_add_users``.
+    """
+    attrs = split_values(request.params.get('attrs', ''))
+    if attrs:
+        attrs = [
+            attr for i, attr in enumerate(attrs)
+            if attr in valid_attrs and attr not in attrs[:i]
+        ]
+    else:
+        attrs = default_attrs
+    related_name, related_factory = related
+    columns = ['id'] + ['attr.%s' % attr for attr in attrs]
+    columns += [related_name, 'roles']
+    backend = model.backend
+
+    def rows():
+        related_ids = related_factory()
+        remaining = iter(principal_ids)
+        while True:
+            chunk = list(itertools.islice(remaining, EXPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            for principal_id in chunk:
+                try:
+                    principal = backend[principal_id]
+                except KeyError:
+                    continue
+                principal_attrs = principal.attrs
+                values = [principal_id]
+                for attr in attrs:
+                    values.append(export_value(principal_attrs.get(attr)))
+                values.append(sorted(related_ids(principal_id, principal)))
+                values.append(sorted(principal.roles))
+                yield values
+            for principal_id in chunk:
+                backend.invalidate(principal_id)
+
+    if request.params.get('format') == 'csv':
+        content_type = 'text/csv'
+
+        def lines():
+            yield csv_line(columns)
+            for values in rows():
+                yield csv_line(values)
+    else:
+        content_type = 'application/x-ndjson'
+
+        def lines():
+            for values in rows():
+                row = json.dumps(OrderedDict(zip(columns, values)))
+                yield (row + '\n').encode('utf-8')
+
+    response = Response(content_type=content_type)
+    response.app_iter = lines()
+    return response
+
+
+@view_config(
+    name='remote_export_users',
+    context=Users,
+    permission='view')
+def remote_export_users(model, request):
+    """Export users as NDJSON or CSV stream via remote service.
+
+    Request parameters:
+
+    attrs
+        Comma separated user attributes to export. Defaults to the listing
+        columns. Only listing columns, form and exposed attributes are
+        exported.
+
+    format
+        ``csv`` or ``ndjson``. Defaults to ``ndjson``.
+
+    Users are exported ordered by id. Local manager restrictions are
+    respected the same way as in users listing.
+    """
+    settings = general_settings(model).snapshot
+    default_attrs = [
+        attr for attr in settings.users_listing_columns.keys()
+        if attr != 'id'
+    ]
+    valid_attrs = default_attrs + user_attributes(model)
+    backend = model.backend
+    user_ids = model.indexes.sort_index('id').range(backend)
+    if model.local_manager_consider_for_user:
+        lm_uids = model.local_manager_target_uids
+        user_ids = [uid for uid in user_ids if uid in lm_uids]
+
+    def related_factory():
+        memberships = group_memberships(backend.parent.groups, user_ids)
+        return lambda user_id, user: memberships[user_id]
+
+    return export_principals(
+        model,
+        request,
+        user_ids,
+        default_attrs,
+        valid_attrs,
+        ('groups', related_factory)
+    )
+
+
+@view_config(
+    name='remote_export_groups',
+    context=Groups,
+    permission='view')
+def remote_export_groups(model, request):
+    """Export groups as NDJSON or CSV stream via remote service.
+
+    Request parameters are the same as for ``remote_export_users``. Only
+    listing columns and form attributes are exported.
+
+    Groups are exported ordered by id. Local manager restrictions are
+    respected the same way as in groups listing.
+    """
+    settings = general_settings(model).snapshot
+    default_attrs = [
+        attr for attr in settings.groups_listing_columns.keys()
+        if attr != 'id'
+    ]
+    valid_attrs = default_attrs + settings.groups_form_attrmap.keys()
+    backend = model.backend
+    group_ids = model.indexes.sort_index('id').range(backend)
+    if model.local_manager_consider_for_user:
+        lm_gids = model.local_manager_target_gids
+        group_ids = [gid for gid in group_ids if gid in lm_gids]
+    return export_principals(
+        model,
+        request,
+        group_ids,
+        default_attrs,
+        valid_attrs,
+        ('members', lambda: lambda group_id, group: group.member_ids)
+    )
+
+
+class UsersSearchListing(UsersColumnListing):
+    """Users listing used by ``remote_search``.
+
+    Sort attribute is set on instance.
+    """
+    sort_attr = None
+
+
+class GroupsSearchListing(GroupsColumnListing):
+    """Groups listing used by ``remote_search``.
+
+    Sort attribute is set on instance.
+    """
+    sort_attr = None
+
+
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 1000
+
+
+@view_config(
+    name='remote_search',
+    accept='application/json',
+    renderer='json',
+    context=Users,
+    permission='view')
+@view_config(
+    name='remote_search',
+    accept='application/json',
+    renderer='json',
+    context=Groups,
+    permission='view')
+def remote_search(model, request):
+    """Search principals via remote service.
+
+    Uses the principals listing for searching, thus the listing filter,
+    sort indexes, search index and cached search results are reused and
+    local manager restrictions are respected the same way as in listings.
+    Attributes of the principals in range are fetched by searches projected
+    to the requested attributes.
+
+    Request parameters:
+
+    filter
+        Filter term. Gets matched against the listing columns the same way
+        as in listings.
+
+    attrlist
+        Comma separated attributes to return. Defaults to the listing
+        columns. Only listing columns and form attributes, for users
+        additionally the exposed attributes, are allowed.
+
+    sort
+        Attribute to sort by. Must be one of the listing columns. Defaults
+        to the default listing column.
+
+    order
+        ``asc`` or ``desc``. Defaults to ``asc``.
+
+    offset
+        Number of principals to skip. Defaults to 0.
+
+    limit
+        Maximum number of principals to return. Defaults to 50, at most
+        1000 principals are returned.
+
+    Returns a JSON response containing success state, the total number of
+    matching principals and the principals in range::
+
+    {
+        success: true,
+        total: 120,
+        results: [{
+            id: 'principal_id',
+            attr_name: 'value'
+        }]
+    }
+    """
+    settings = general_settings(model).snapshot
+    if isinstance(model, Users):
+        listing = UsersSearchListing()
+        columns = settings.users_listing_columns.keys()
+        valid_attrs = columns + user_attributes(model)
+    else:
+        listing = GroupsSearchListing()
+        columns = settings.groups_listing_columns.keys()
+        valid_attrs = columns + settings.groups_form_attrmap.keys()
+    listing.model = model
+    listing.request = request
+    params = request.params
+
+    attrlist = split_values(params.get('attrlist', ''))
+    if not attrlist:
+        attrlist = columns
+    for attr in attrlist:
+        if attr not in valid_attrs:
+            return {
+                'success': False,
+                'message': u"Attribute '%s' not allowed." % attr,
+            }
+    attrlist = [attr for attr in attrlist if attr != 'id']
+
+    sort_attr = params.get('sort')
+    if not sort_attr:
+        sort_attr = listing.user_default_sort_column \
+            if isinstance(model, Users) \
+            else listing.group_default_sort_column
+    if sort_attr not in columns:
+        return {
+            'success': False,
+            'message': u"Sorting by '%s' not allowed." % sort_attr,
+        }
+    listing.sort_attr = sort_attr
+
+    if params.get('order', 'asc') not in ['asc', 'desc']:
+        return {
+            'success': False,
+            'message': u"Order must be 'asc' or 'desc'.",
+        }
+    try:
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        offset = limit = -1
+    if offset < 0 or limit < 0:
+        return {
+            'success': False,
+            'message': u"Offset and limit must be positive integers.",
+        }
+    limit = min(limit, SEARCH_MAX_LIMIT)
+
+    keys = listing.query_listing_keys(offset, offset + limit)
+    principal_attrs = query_principal_attrs(model.backend, keys, attrlist)
+    results = list()
+    for key in keys:
+        attrs = principal_attrs.get(key)
+        if attrs is None:
+            continue
+        result = OrderedDict([('id', key)])
+        for attr in attrlist:
+            result[attr] = export_value(attrs.get(attr))
+        results.append(result)
+    return {
+        'success': True,
+        'total': listing.item_count,
+        'results': results,
+    }
@@ -20,8 +20,8 @@ class PrincipalRolesForm(Behavior):
     @default
     @property
     def roles_enabled(self):
-        settings = general_settings(self.model).attrs
-        return settings.roles_principal_roles_enabled == 'True'
+        settings = general_settings(self.model).snapshot
+        return settings.roles_principal_roles_enabled
 
     @plumb
     def prepare(_next, self):
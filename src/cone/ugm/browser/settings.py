@@ -2,10 +2,12 @@ from cone.app.browser.form import Form
 from cone.app.browser.form import YAMLForm
 from cone.app.browser.layout import ProtectedContentTile
 from cone.app.browser.settings import SettingsBehavior
-from cone.app.ugm import ugm_backend
 from cone.tile import tile
 from cone.ugm.settings import GeneralSettings
 from cone.ugm.settings import LocalManagerSettings
+from cone.ugm.settings import reload_flags
+from cone.ugm.settings import reload_ugm
+from cone.ugm.settings import settings_generation
 from plumber import plumbing
 from pyramid.i18n import TranslationStringFactory
 from pyramid.view import view_config
@@ -60,6 +62,7 @@ class GeneralSettingsForm(Form):
     def save(self, widget, data):
         # XXX: user data.write(model)
         model = self.model
+        previous = model.snapshot
         for attr_name in [
             'users_account_expiration',
             'users_expires_attr',
@@ -78,16 +81,26 @@ class GeneralSettingsForm(Form):
             'users_form_attrmap',
             'users_listing_columns',
             'users_listing_default_column',
+            'users_listing_search_index',
             'groups_form_attrmap',
             'groups_listing_columns',
             'groups_listing_default_column',
+            'groups_listing_search_index',
             'roles_principal_roles_enabled'
         ]:
             val = data.fetch('ugm_settings.%s' % attr_name).extracted
             setattr(model.attrs, attr_name, val)
-        model()
-        model.invalidate()
-        ugm_backend.initialize()
+        try:
+            model()
+        except Exception:
+            # drop unsaved changes, snapshot still contains persisted settings
+            model.invalidate()
+            raise
+        # only reload parts of UGM affected by changed settings
+        flags = reload_flags(previous.changes(model.snapshot))
+        reload_ugm(model.root, flags)
+        # notify other processes
+        settings_generation.bump(flags)
 
 
 @tile(
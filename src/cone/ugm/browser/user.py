@@ -5,6 +5,7 @@ from cone.app.browser.authoring import ContentEditForm
 from cone.app.browser.form import Form
 from cone.app.browser.utils import make_query
 from cone.app.browser.utils import make_url
+from cone.app.browser.utils import request_property
 from cone.app.ugm import ugm_backend
 from cone.tile import Tile
 from cone.tile import tile
@@ -13,18 +14,20 @@ from cone.ugm.browser.authoring import EditFormFiddle
 from cone.ugm.browser.autoincrement import AutoIncrementForm
 from cone.ugm.browser.expires import ExpirationForm
 from cone.ugm.browser.listing import ColumnListing
+from cone.ugm.browser.listing import RelatedPrincipalsListing
 from cone.ugm.browser.portrait import PortraitForm
 from cone.ugm.browser.principal import PrincipalForm
 from cone.ugm.browser.principal import user_field
 from cone.ugm.browser.roles import PrincipalRolesForm
 from cone.ugm.model.user import User
+from cone.ugm.settings import PRINCIPAL_ADDED
+from cone.ugm.settings import principals_changed
 from cone.ugm.utils import general_settings
 from odict import odict
 from plumber import plumbing
 from pyramid.i18n import TranslationStringFactory
 from webob.exc import HTTPFound
 from yafowil.base import UNSET
-import fnmatch
 import itertools
 
 
@@ -53,90 +56,76 @@ class UserRightColumn(Tile):
     pass
 
 
-class GroupsListing(ColumnListing):
-    related_only = False
+class GroupsListing(RelatedPrincipalsListing):
+    list_columns = ColumnListing.group_list_columns
+    listing_attrs = ColumnListing.group_attrs
+    localmanager_ids = ColumnListing.group_localmanager_ids
+    sort_attr = ColumnListing.group_default_sort_column
 
     @property
-    def listing_items(self):
-        appuser = self.model
-        user = appuser.model
-        groups = user.groups
-        related_ids = [g.name for g in groups]
-        # Always True if we list members only, otherwise will be set
-        # in the loop below
-        related = self.related_only
-        if not related:
-            groups = self.model.root['groups'].backend.values()
-        # reduce for local manager
-        if self.model.local_manager_consider_for_user:
-            local_gids = self.model.local_manager_target_gids
-            groups = [g for g in groups if g.name in local_gids]
-        attrlist = self.group_attrs
-        sort_attr = self.group_default_sort_column
-        filter_term = self.unquoted_param_value('filter')
-        can_change = self.request.has_permission(
+    def principals(self):
+        return self.model.root['groups']
+
+    @request_property
+    def related_ids(self):
+        return frozenset(self.model.model.group_ids)
+
+    @request_property
+    def can_change(self):
+        return self.request.has_permission(
             'manage_membership',
             self.model.parent
         )
-        ret = list()
-        for group in groups:
-            attrs = group.attrs
-            # reduce by search term
-            if filter_term:
-                s_attrs = [attrs[attr] for attr in attrlist]
-                if not fnmatch.filter(s_attrs, filter_term):
-                    continue
-            gid = group.name
-            item_target = make_url(self.request, path=group.path[1:])
-            action_query = make_query(id=gid)
-            action_target = make_url(
-                self.request,
-                node=appuser,
-                query=action_query
-            )
-            if not self.related_only:
-                related = gid in related_ids
-            actions = list()
-            if can_change:
-                action_id = 'add_item'
-                action_enabled = not bool(related)
-                action_title = _(
-                    'add_user_to_selected_group',
-                    default='Add user to selected group'
-                )
-                add_item_action = self.create_action(
-                    action_id,
-                    action_enabled,
-                    action_title,
-                    action_target
-                )
-                actions.append(add_item_action)
-                action_id = 'remove_item'
-                action_enabled = bool(related)
-                action_title = _(
-                    'remove_user_from_selected_group',
-                    default='Remove user from selected group'
-                )
-                remove_item_action = self.create_action(
-                    action_id,
-                    action_enabled,
-                    action_title,
-                    action_target
-                )
-                actions.append(remove_item_action)
-            vals = [self.extract_raw(attrs, attr) for attr in attrlist]
-            sort = self.extract_raw(attrs, sort_attr)
-            content = self.item_content(*vals)
-            current = False
-            item = self.create_item(
-                sort,
-                item_target,
-                content,
-                current,
-                actions
-            )
-            ret.append(item)
-        return ret
+
+    def listing_item_target(self, item):
+        return make_url(self.request, path=['groups', item.key])
+
+    def listing_item_content(self, item):
+        attrs = item.attrs
+        vals = [self.extract_raw(attrs, attr) for attr in self.group_attrs]
+        return self.item_content(*vals)
+
+    def listing_item_current(self, item):
+        return False
+
+    def listing_item_actions(self, item):
+        actions = list()
+        if not self.can_change:
+            return actions
+        related = item.data['related']
+        action_query = make_query(id=item.key)
+        action_target = make_url(
+            self.request,
+            node=self.model,
+            query=action_query
+        )
+        action_id = 'add_item'
+        action_enabled = not bool(related)
+        action_title = _(
+            'add_user_to_selected_group',
+            default='Add user to selected group'
+        )
+        add_item_action = self.create_action(
+            action_id,
+            action_enabled,
+            action_title,
+            action_target
+        )
+        actions.append(add_item_action)
+        action_id = 'remove_item'
+        action_enabled = bool(related)
+        action_title = _(
+            'remove_user_from_selected_group',
+            default='Remove user from selected group'
+        )
+        remove_item_action = self.create_action(
+            action_id,
+            action_enabled,
+            action_title,
+            action_target
+        )
+        actions.append(remove_item_action)
+        return actions
 
 
 @tile(
@@ -146,7 +135,6 @@ class GroupsListing(ColumnListing):
     permission='view')
 class GroupsOfUserColumnListing(GroupsListing):
     slot = 'rightlisting'
-    list_columns = ColumnListing.group_list_columns
     css = 'groups'
     related_only = True
     batchname = 'rightbatch'
@@ -161,7 +149,6 @@ class GroupsOfUserColumnListing(GroupsListing):
     permission='view')
 class AllGroupsColumnListing(GroupsListing):
     slot = 'rightlisting'
-    list_columns = ColumnListing.group_list_columns
     css = 'groups'
     batchname = 'rightbatch'
     display_limit = True
@@ -186,7 +173,7 @@ class UserForm(PrincipalForm):
 
     @property
     def form_attrmap(self):
-        return general_settings(self.model).attrs.users_form_attrmap
+        return general_settings(self.model).snapshot.users_form_attrmap
 
 
 @tile(name='addform', interface=User, permission='add_user')
@@ -213,20 +200,25 @@ class UserAddForm(UserForm, Form):
         users = ugm_backend.ugm.users
         user_id = extracted.pop('id')
         password = extracted.pop('password')
-        login_name = general_settings(self.model).attrs.users_login_name_attr
+        settings = general_settings(self.model).snapshot
+        login_name = settings.users_login_name_attr
         if login_name:
             extracted[login_name] = extracted.pop('login')
         users.create(user_id, **extracted)
         users()
+        group_ids = list()
         if self.model.local_manager_consider_for_user:
             groups = ugm_backend.ugm.groups
-            for gid in self.model.local_manager_default_gids:
+            group_ids = self.model.local_manager_default_gids
+            for gid in group_ids:
                 groups[gid].add(user_id)
             groups()
         self.request.environ['next_resource'] = user_id
         if password is not UNSET:
             users.passwd(user_id, None, password)
         self.model.parent.invalidate()
+        principals_changed(users=[user_id], action=PRINCIPAL_ADDED)
+        principals_changed(groups=group_ids)
 
     def next(self, request):
         next_resource = self.request.environ.get('next_resource')
@@ -265,6 +257,8 @@ class UserEditForm(UserForm, Form):
         if password is not UNSET:
             user_id = self.model.name
             ugm_backend.ugm.users.passwd(user_id, None, password)
+        self.model.parent.invalidate(self.model.name)
+        principals_changed(users=[self.model.name])
 
     def next(self, request):
         came_from = request.get('came_from')
@@ -64,6 +64,7 @@ class UsersColumnListing(PrincipalsListing):
     list_columns = PrincipalsListing.user_list_columns
     listing_attrs = PrincipalsListing.user_attrs
     localmanager_ids = PrincipalsListing.user_localmanager_ids
+    search_index_enabled = PrincipalsListing.user_search_index_enabled
     sort_attr = PrincipalsListing.user_default_sort_column
     css = 'users'
     batchname = 'leftbatch'
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+import threading
+
+
+_marker = object()
+
+
+class LRUCache(object):
+    """Bounded least recently used cache.
+
+    Counts cache hits and misses of ``lookup``.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, _marker)
+            if value is _marker:
+                return default
+            # re-insert to mark as most recently used
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            data = self._data
+            data.pop(key, None)
+            data[key] = value
+            while len(data) > self.maxsize:
+                data.popitem(last=False)
+
+    def lookup(self, key, factory):
+        """Return cached value for key. If not cached yet, value gets
+        created by calling ``factory`` and cached.
+        """
+        value = self.get(key, _marker)
+        if value is not _marker:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = factory()
+        self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
@@ -0,0 +1,398 @@
+from bisect import bisect_left
+from bisect import insort
+from cone.app import compat
+from cone.ugm.cache import LRUCache
+import fnmatch
+import natsort
+import re
+import threading
+
+
+def attr_value(attrs, name):
+    """Return single value of principal attribute.
+
+    If attribute is multi valued, the first value is returned.
+    """
+    raw = attrs.get(name)
+    if type(raw) in compat.ITER_TYPES:
+        return raw[0]
+    return raw and raw or ''
+
+
+def query_principal_attrs(principals, principal_ids, attrs):
+    """Return dict containing attributes by principal id for given principal
+    ids.
+
+    Each principal is looked up by an ID search projected to ``attrs``, thus
+    neither whole principal nodes nor member lists of groups get loaded.
+    Inexistent principals are skipped.
+    """
+    attrs = list(attrs)
+    attrlist = attrs if 'id' in attrs else ['id'] + attrs
+    ret = dict()
+    for principal_id in principal_ids:
+        for key, principal_attrs in principals.search(
+            criteria={'id': principal_id},
+            attrlist=attrlist
+        ):
+            if key != principal_id:
+                continue
+            ret[key] = dict([
+                (attr, principal_attrs.get(attr, '')) for attr in attrs
+            ])
+    return ret
+
+
+def normalize(value):
+    """Normalize value for case insensitive comparison the same way
+    ``natsort.ns.IC`` does.
+    """
+    return value.lower() if compat.IS_PY2 else value.casefold()
+
+
+class WildcardFilter(object):
+    """Case insensitive wildcard filter.
+
+    The filter term uses ``fnmatch`` syntax and gets compiled once on filter
+    creation. Attribute values might be multi valued, in which case it's
+    sufficient if one of the values matches.
+    """
+
+    def __init__(self, term):
+        self.term = term
+        self._match = re.compile(fnmatch.translate(normalize(term))).match
+
+    def match_value(self, value):
+        """Check whether single or multi valued attribute value matches.
+        """
+        if not value:
+            return False
+        if type(value) in compat.ITER_TYPES:
+            return any(self.match_value(it) for it in value)
+        if not isinstance(value, compat.STR_TYPE):
+            return False
+        return self._match(normalize(value)) is not None
+
+    def match(self, values):
+        """Check whether any of given attribute values matches.
+        """
+        match_value = self.match_value
+        for value in values:
+            if match_value(value):
+                return True
+        return False
+
+    def filter(self, rows):
+        """Return keys of ``(key, values)`` rows where any of values
+        matches.
+        """
+        match = self.match
+        return [key for key, values in rows if match(values)]
+
+
+class SortIndex(object):
+    """Natural sort index for a principal attribute.
+
+    Holds ``(sort_key, principal_id)`` tuples ordered by the natural sort key
+    of the attribute value. Sort keys are computed the same way as
+    ``natsort.natsorted(..., alg=natsort.ns.IC)`` does.
+
+    The index is built on first access and updated incrementally for
+    principals passed to ``invalidate``.
+    """
+    sort_key = staticmethod(natsort.natsort_keygen(alg=natsort.ns.IC))
+
+    def __init__(self, attr):
+        self.attr = attr
+        self._entries = None
+        self._keys = dict()
+        self._pending = set()
+        self._lock = threading.RLock()
+
+    def invalidate(self, principal_id=None):
+        """Invalidate index.
+
+        If ``principal_id`` given, the index entry of this principal gets
+        updated on next access, otherwise the whole index gets rebuilt.
+        """
+        with self._lock:
+            if principal_id is None:
+                self._entries = None
+                self._keys = dict()
+                self._pending = set()
+            elif self._entries is not None:
+                self._pending.add(principal_id)
+
+    def count(self, principals):
+        """Number of indexed principals.
+        """
+        with self._lock:
+            return len(self._load(principals))
+
+    def range(self, principals, start=None, end=None, reverse=False):
+        """Return ordered principal ids in range.
+        """
+        with self._lock:
+            entries = self._load(principals)
+            if reverse:
+                count = len(entries)
+                start = 0 if start is None else start
+                end = count if end is None else end
+                start, end = max(count - end, 0), max(count - start, 0)
+                return [entry[1] for entry in reversed(entries[start:end])]
+            return [entry[1] for entry in entries[start:end]]
+
+    def sort(self, principals, principal_ids, reverse=False):
+        """Return given principal ids in index order.
+
+        Principal ids not contained in the index are skipped.
+        """
+        with self._lock:
+            self._load(principals)
+            keys = self._keys
+            entries = [
+                (keys[principal_id], principal_id)
+                for principal_id in principal_ids if principal_id in keys
+            ]
+        return [entry[1] for entry in sorted(entries, reverse=reverse)]
+
+    def _load(self, principals):
+        if self._entries is None:
+            self._build(principals)
+        elif self._pending:
+            self._update(principals)
+        return self._entries
+
+    def _build(self, principals):
+        attr = self.attr
+        sort_key = self.sort_key
+        keys = self._keys = dict()
+        for principal_id, attrs in principals.search(attrlist=[attr]):
+            keys[principal_id] = sort_key(attr_value(attrs, attr))
+        self._entries = sorted([(v, k) for k, v in keys.items()])
+        self._pending = set()
+
+    def _update(self, principals):
+        attr = self.attr
+        entries = self._entries
+        keys = self._keys
+        for principal_id in self._pending:
+            sort_key = keys.pop(principal_id, None)
+            if sort_key is not None:
+                del entries[bisect_left(entries, (sort_key, principal_id))]
+            principal = principals.get(principal_id)
+            if principal is None:
+                continue
+            if attr == 'id':
+                value = principal_id
+            else:
+                value = attr_value(principal.attrs, attr)
+            sort_key = keys[principal_id] = self.sort_key(value)
+            insort(entries, (sort_key, principal_id))
+        self._pending = set()
+
+
+class SearchIndex(object):
+    """Trigram index for substring search on principal attributes.
+
+    Search terms are matched the same way the UGM backends do, i.e. ``*``
+    matches all principals, ``term*``, ``*term`` and ``*term*`` match prefix,
+    suffix respective substring, and otherwise the value must match exactly.
+    Asterisks inside the term are treated as wildcards as in LDAP substring
+    filters. Matching is done case insensitive and OR-wise over the indexed
+    attributes.
+
+    Candidate principals are looked up by the trigrams of the term fragments
+    and verified against the indexed values afterwards. Like ``SortIndex``,
+    the index is built on first access and updated incrementally for
+    principals passed to ``invalidate``.
+    """
+    gram_size = 3
+
+    def __init__(self, attrs):
+        self.attrs = tuple(attrs)
+        self._values = None
+        self._grams = dict()
+        self._pending = set()
+        self._lock = threading.RLock()
+
+    def invalidate(self, principal_id=None):
+        """Invalidate index.
+
+        If ``principal_id`` given, the index entry of this principal gets
+        updated on next access, otherwise the whole index gets rebuilt.
+        """
+        with self._lock:
+            if principal_id is None:
+                self._values = None
+                self._grams = dict()
+                self._pending = set()
+            elif self._values is not None:
+                self._pending.add(principal_id)
+
+    def count(self, principals):
+        """Number of indexed principals.
+        """
+        with self._lock:
+            return len(self._load(principals))
+
+    def search(self, principals, term):
+        """Return set of principal ids matching search term.
+        """
+        with self._lock:
+            values = self._load(principals)
+            if term == '*':
+                return set(values)
+            term = normalize(term)
+            fragments = [it for it in term.split('*') if it]
+            if not fragments:
+                return set()
+            postings = list()
+            for fragment in fragments:
+                for gram in self.term_grams(fragment):
+                    ids = self._grams.get(gram)
+                    if not ids:
+                        return set()
+                    postings.append(ids)
+            if postings:
+                postings = sorted(postings, key=len)
+                candidates = postings[0].intersection(*postings[1:])
+            else:
+                candidates = values
+            match = self.term_matcher(term)
+            return set([
+                principal_id for principal_id in candidates
+                if any(match(value) for value in values[principal_id])
+            ])
+
+    def term_grams(self, value):
+        """Return set of trigrams contained in value.
+        """
+        size = self.gram_size
+        return set([value[i:i + size] for i in range(len(value) - size + 1)])
+
+    def term_matcher(self, term):
+        """Return match function for search term.
+        """
+        term = normalize(term)
+        pattern = '.*'.join([re.escape(it) for it in term.split('*')])
+        return re.compile(pattern + r'\Z', re.S).match
+
+    def _load(self, principals):
+        if self._values is None:
+            self._build(principals)
+        elif self._pending:
+            self._update(principals)
+        return self._values
+
+    def _principal_values(self, attrs):
+        values = list()
+        for attr in self.attrs:
+            raw = attrs.get(attr)
+            if not raw:
+                continue
+            if type(raw) not in compat.ITER_TYPES:
+                raw = [raw]
+            for value in raw:
+                if isinstance(value, compat.STR_TYPE):
+                    values.append(normalize(value))
+        return tuple(values)
+
+    def _add(self, principal_id, values):
+        self._values[principal_id] = values
+        grams = self._grams
+        for value in values:
+            for gram in self.term_grams(value):
+                ids = grams.get(gram)
+                if ids is None:
+                    ids = grams[gram] = set()
+                ids.add(principal_id)
+
+    def _remove(self, principal_id):
+        values = self._values.pop(principal_id, None)
+        if values is None:
+            return
+        grams = self._grams
+        for value in values:
+            for gram in self.term_grams(value):
+                ids = grams.get(gram)
+                if ids is None:
+                    continue
+                ids.discard(principal_id)
+                if not ids:
+                    del grams[gram]
+
+    def _build(self, principals):
+        self._values = dict()
+        self._grams = dict()
+        attrlist = list(self.attrs)
+        for principal_id, attrs in principals.search(attrlist=attrlist):
+            self._add(principal_id, self._principal_values(attrs))
+        self._pending = set()
+
+    def _update(self, principals):
+        for principal_id in self._pending:
+            self._remove(principal_id)
+            principal = principals.get(principal_id)
+            if principal is None:
+                continue
+            attrs = dict(principal.attrs)
+            attrs['id'] = principal_id
+            self._add(principal_id, self._principal_values(attrs))
+        self._pending = set()
+
+
+class PrincipalIndexes(object):
+    """Listing indexes of a principals container.
+
+    Sort indexes get created lazily by attribute name, search indexes by
+    attribute names. Additionally holds a cache for listing search results.
+    """
+    search_cache_size = 128
+
+    def __init__(self):
+        self._sort_indexes = dict()
+        self._search_indexes = dict()
+        self._lock = threading.Lock()
+        self.search_cache = LRUCache(maxsize=self.search_cache_size)
+
+    def sort_index(self, attr):
+        """Return ``SortIndex`` for attribute.
+        """
+        with self._lock:
+            index = self._sort_indexes.get(attr)
+            if index is None:
+                index = self._sort_indexes[attr] = SortIndex(attr)
+            return index
+
+    def search_index(self, attrs):
+        """Return ``SearchIndex`` for attributes.
+        """
+        attrs = tuple(attrs)
+        with self._lock:
+            index = self._search_indexes.get(attrs)
+            if index is None:
+                index = self._search_indexes[attrs] = SearchIndex(attrs)
+            return index
+
+    def invalidate(self, principal_id=None):
+        """Invalidate indexes.
+
+        If ``principal_id`` given, index entries of this principal get
+        updated on next access, otherwise all indexes get dropped. Cached
+        search results get dropped in any case.
+        """
+        self.search_cache.clear()
+        with self._lock:
+            if principal_id is None:
+                self._sort_indexes = dict()
+                self._search_indexes = dict()
+                return
+            for index in self._sort_indexes.values():
+                index.invalidate(principal_id)
+            for index in self._search_indexes.values():
+                index.invalidate(principal_id)
+
+
+users_indexes = PrincipalIndexes()
+groups_indexes = PrincipalIndexes()
@@ -4,6 +4,7 @@ from cone.ugm.utils import localmanager_settings
 from lxml import etree
 from node.behaviors import DictStorage
 from node.behaviors import Nodify
+from node.utils import instance_property
 from plumber import Behavior
 from plumber import default
 from plumber import finalize
@@ -12,16 +13,22 @@ from plumber import plumbing
 from pyramid.security import Allow
 from pyramid.threadlocal import get_current_request
 import os
+import threading
+import time
 
 
 class LocalManagerConfig(DictStorage):
     """Local Management configuration storage.
+
+    Rules are compiled into set based forward and reverse indexes when the
+    configuration gets loaded or saved.
     """
 
     @finalize
     def load(self):
         path = self.file_path
         if not path or not os.path.exists(path):
+            self.compile()
             return
         with open(path, 'r') as handle:
             tree = etree.parse(handle)
@@ -34,6 +41,7 @@ class LocalManagerConfig(DictStorage):
                         new_rule[tag_name] = list()
                         for group in prop.getchildren():
                             new_rule[tag_name].append(group.text)
+        self.compile()
 
     @finalize
     def __call__(self):
@@ -47,6 +55,44 @@ class LocalManagerConfig(DictStorage):
                     item.text = gid
         with open(self.file_path, 'wb') as handle:
             handle.write(etree.tostring(root, pretty_print=True))
+        self.compile()
+        local_manager_index.invalidate()
+
+    @finalize
+    def compile(self):
+        """Compile rules into forward and reverse indexes.
+        """
+        targets = dict()
+        defaults = dict()
+        managers = dict()
+        for adm_gid, rule in self.storage.items():
+            target_gids = targets[adm_gid] = frozenset(rule.get('target', []))
+            defaults[adm_gid] = frozenset(rule.get('default', []))
+            for gid in target_gids:
+                managers.setdefault(gid, set()).add(adm_gid)
+        self._target_index = targets
+        self._default_index = defaults
+        self._manager_index = dict([
+            (gid, frozenset(adm_gids)) for gid, adm_gids in managers.items()
+        ])
+
+    @finalize
+    def target_gids(self, adm_gid):
+        """Return frozenset of group ids managed by local manager group.
+        """
+        return self._target_index.get(adm_gid, frozenset())
+
+    @finalize
+    def default_gids(self, adm_gid):
+        """Return frozenset of default group ids of local manager group.
+        """
+        return self._default_index.get(adm_gid, frozenset())
+
+    @finalize
+    def manager_gids(self, gid):
+        """Return frozenset of local manager group ids managing group.
+        """
+        return self._manager_index.get(gid, frozenset())
 
 
 @plumbing(Nodify, LocalManagerConfig)
@@ -57,6 +103,185 @@ class LocalManagerConfigAttributes(object):
         self.load()
 
 
+class LocalManagerIndex(object):
+    """Process wide index of user ids managed by local manager groups.
+
+    Maps local manager group ids to frozensets of managed user ids, computed
+    from the target group ids of the local manager rule and the member ids of
+    the target groups. Member ids are cached by group id and dropped via
+    ``invalidate`` when group memberships change.
+
+    Membership changes made by other processes are propagated via the
+    principal change log, see ``cone.ugm.settings.principals_changed``. As
+    the index is used for authorization, it additionally gets dropped after
+    ``max_age`` seconds, which limits the lifetime of stale entries if the
+    change log file is not available.
+    """
+    max_age = 60
+
+    def __init__(self):
+        self._members = dict()
+        self._managed = dict()
+        self._created = time.time()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.time()
+        if now - self._created > self.max_age:
+            self._members = dict()
+            self._managed = dict()
+            self._created = now
+
+    def managed_uids(self, groups, adm_gid, target_gids):
+        """Return frozenset of user ids managed by local manager group.
+
+        ``groups`` is the groups backend, ``target_gids`` the target group
+        ids of the local manager rule.
+        """
+        cache_key = (adm_gid, tuple(sorted(target_gids)))
+        with self._lock:
+            self._expire()
+            managed = self._managed.get(cache_key)
+            if managed is not None:
+                return managed
+            members = self._members
+            managed_uids = set()
+            for gid in cache_key[1]:
+                member_ids = members.get(gid)
+                if member_ids is None:
+                    group = groups.get(gid)
+                    member_ids = frozenset(group.member_ids if group else [])
+                    members[gid] = member_ids
+                managed_uids.update(member_ids)
+            managed = self._managed[cache_key] = frozenset(managed_uids)
+            return managed
+
+    def invalidate(self, gid=None):
+        """Invalidate index.
+
+        If ``gid`` given, cached member ids of this group and managed user
+        ids of all local manager groups targeting it get dropped, otherwise
+        the whole index gets dropped.
+        """
+        with self._lock:
+            if gid is None:
+                self._members = dict()
+                self._managed = dict()
+                self._created = time.time()
+                return
+            self._members.pop(gid, None)
+            for cache_key in list(self._managed):
+                if gid in cache_key[1]:
+                    del self._managed[cache_key]
+
+
+local_manager_index = LocalManagerIndex()
+
+
+class LocalManagerState(object):
+    """Local manager state of the authenticated member.
+
+    Values are computed lazily once per instance. Instances are cached on the
+    request, see ``local_manager_state``.
+    """
+
+    def __init__(self, root, request):
+        self.root = root
+        self.request = request
+
+    @instance_property
+    def gid(self):
+        settings = localmanager_settings(self.root)
+        user = security.authenticated_user(self.request)
+        if not user:
+            return None
+        gids = user.group_ids
+        adm_gids = list()
+        for gid in gids:
+            rule = settings.attrs.get(gid)
+            if rule:
+                adm_gids.append(gid)
+        if len(adm_gids) == 0:
+            return None
+        if len(adm_gids) > 1:
+            msg = (
+                u"Authenticated member defined in local manager "
+                u"groups %s but only one management group allowed for "
+                u"each user. Please contact System Administrator in "
+                u"order to fix this problem."
+            )
+            exc = msg % ', '.join(["'%s'" % gid for gid in sorted(adm_gids)])
+            raise Exception(exc)
+        return adm_gids[0]
+
+    @instance_property
+    def rule(self):
+        adm_gid = self.gid
+        if not adm_gid:
+            return None
+        settings = localmanager_settings(self.root)
+        return settings.attrs[adm_gid]
+
+    @instance_property
+    def default_gids(self):
+        rule = self.rule
+        if not rule:
+            return list()
+        return rule['default']
+
+    @instance_property
+    def target_gids(self):
+        rule = self.rule
+        if not rule:
+            return list()
+        return rule['target']
+
+    @instance_property
+    def default_gid_set(self):
+        return frozenset(self.default_gids)
+
+    @instance_property
+    def target_gid_set(self):
+        return frozenset(self.target_gids)
+
+    @instance_property
+    def target_uids(self):
+        adm_gid = self.gid
+        if not adm_gid:
+            return frozenset()
+        return local_manager_index.managed_uids(
+            self.root['groups'].backend,
+            adm_gid,
+            self.target_gids
+        )
+
+
+LOCAL_MANAGER_STATE_KEY = 'cone.ugm.local_manager_state'
+
+
+def local_manager_state(root, request=None):
+    """Return ``LocalManagerState`` for authenticated member.
+
+    State is cached on the request by authenticated user id.
+    """
+    if request is None:
+        request = get_current_request()
+    states = request.environ.setdefault(LOCAL_MANAGER_STATE_KEY, dict())
+    userid = request.authenticated_userid
+    state = states.get(userid)
+    if state is None:
+        state = states[userid] = LocalManagerState(root, request)
+    return state
+
+
+def invalidate_local_manager_state(request=None):
+    """Drop local manager state cached on the request.
+    """
+    if request is None:
+        request = get_current_request()
+    request.environ.pop(LOCAL_MANAGER_STATE_KEY, None)
+
+
 class LocalManager(Behavior):
     """Behavior providing local manager information for authenticated user.
     """
@@ -66,8 +291,8 @@ class LocalManager(Behavior):
     def local_management_enabled(self):
         """Flag whether local management is enabled.
         """
-        settings = general_settings(self.root)
-        return settings.attrs.users_local_management_enabled == 'True'
+        settings = general_settings(self.root).snapshot
+        return settings.users_local_management_enabled
 
     @finalize
     @property
@@ -85,6 +310,20 @@ class LocalManager(Behavior):
             return False
         return True
 
+    @finalize
+    @property
+    def local_manager_config(self):
+        """Local manager configuration.
+        """
+        return localmanager_settings(self.root).attrs
+
+    @finalize
+    @property
+    def local_manager_state(self):
+        """``LocalManagerState`` of current authenticated member.
+        """
+        return local_manager_state(self.root)
+
     @finalize
     @property
     def local_manager_gid(self):
@@ -93,82 +332,44 @@ class LocalManager(Behavior):
         Currently a user can be assigned only to one local manager group. If
         more than one local manager group is configured, an error is raised.
         """
-        settings = localmanager_settings(self.root)
-        user = security.authenticated_user(get_current_request())
-        if not user:
-            return None
-        gids = user.group_ids
-        adm_gids = list()
-        for gid in gids:
-            rule = settings.attrs.get(gid)
-            if rule:
-                adm_gids.append(gid)
-        if len(adm_gids) == 0:
-            return None
-        if len(adm_gids) > 1:
-            msg = (
-                u"Authenticated member defined in local manager "
-                u"groups %s but only one management group allowed for "
-                u"each user. Please contact System Administrator in "
-                u"order to fix this problem."
-            )
-            exc = msg % ', '.join(["'%s'" % gid for gid in sorted(adm_gids)])
-            raise Exception(exc)
-        return adm_gids[0]
+        return self.local_manager_state.gid
 
     @finalize
     @property
     def local_manager_rule(self):
         """Return rule for local manager.
         """
-        adm_gid = self.local_manager_gid
-        if not adm_gid:
-            return None
-        settings = localmanager_settings(self.root)
-        return settings.attrs[adm_gid]
+        return self.local_manager_state.rule
 
     @finalize
     @property
     def local_manager_default_gids(self):
         """Return default group id's for local manager.
         """
-        rule = self.local_manager_rule
-        if not rule:
-            return list()
-        return rule['default']
+        return self.local_manager_state.default_gids
 
     @finalize
     @property
     def local_manager_target_gids(self):
         """Target group id's for local manager.
         """
-        rule = self.local_manager_rule
-        if not rule:
-            return list()
-        return rule['target']
+        return self.local_manager_state.target_gids
 
     @finalize
     @property
     def local_manager_target_uids(self):
         """Target uid's for local manager.
         """
-        groups = self.root['groups'].backend
-        managed_uids = set()
-        for gid in self.local_manager_target_gids:
-            group = groups.get(gid)
-            if group:
-                managed_uids.update(group.member_ids)
-        return list(managed_uids)
+        return self.local_manager_state.target_uids
 
     @finalize
     def local_manager_is_default(self, adm_gid, gid):
         """Check whether gid is default group for local manager group.
         """
-        settings = localmanager_settings(self.root)
-        rule = settings.attrs[adm_gid]
-        if gid not in rule['target']:
+        config = self.local_manager_config
+        if adm_gid not in config.manager_gids(gid):
             raise Exception(u"group '%s' not managed by '%s'" % (gid, adm_gid))
-        return gid in rule['default']
+        return gid in config.default_gids(adm_gid)
 
 
 class LocalManagerACL(LocalManager):
@@ -195,7 +396,8 @@ class LocalManagerUsersACL(LocalManagerACL):
     @finalize
     @property
     def local_manager_acl(self):
-        if not self.local_manager_target_gids:
+        config = self.local_manager_config
+        if not config.target_gids(self.local_manager_gid):
             return []
         permissions = [
             'view', 'add', 'add_user', 'edit', 'edit_user',
@@ -233,7 +435,8 @@ class LocalManagerGroupsACL(LocalManagerACL):
     @finalize
     @property
     def local_manager_acl(self):
-        if not self.local_manager_target_gids:
+        config = self.local_manager_config
+        if not config.target_gids(self.local_manager_gid):
             return []
         permissions = ['view', 'manage_membership']
         return [(
@@ -248,7 +451,8 @@ class LocalManagerGroupACL(LocalManagerACL):
     @finalize
     @property
     def local_manager_acl(self):
-        if self.name not in self.local_manager_target_gids:
+        manager_gids = self.local_manager_config.manager_gids(self.name)
+        if self.local_manager_gid not in manager_gids:
             return []
         permissions = ['view', 'manage_membership']
         return [(
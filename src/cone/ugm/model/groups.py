@@ -4,6 +4,8 @@ from cone.app.model import node_info
 from cone.app.model import Properties
 from cone.app.ugm import ugm_backend
 from cone.ugm.browser.utils import unquote_slash
+from cone.ugm.index import groups_indexes
+from cone.ugm.localmanager import local_manager_index
 from cone.ugm.localmanager import LocalManagerGroupsACL
 from cone.ugm.model.group import Group
 from node.behaviors import Nodify
@@ -52,8 +54,14 @@ class Groups(object):
     def backend(self):
         return ugm_backend.ugm.groups
 
+    @property
+    def indexes(self):
+        return groups_indexes
+
     @locktree
     def invalidate(self, key=None):
+        self.indexes.invalidate(key)
+        local_manager_index.invalidate(key)
         if key is None:
             self.backend.parent.invalidate('groups')
             return
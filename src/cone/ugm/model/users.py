@@ -4,6 +4,8 @@ from cone.app.model import node_info
 from cone.app.model import Properties
 from cone.app.ugm import ugm_backend
 from cone.ugm.browser.utils import unquote_slash
+from cone.ugm.index import users_indexes
+from cone.ugm.localmanager import local_manager_index
 from cone.ugm.localmanager import LocalManagerUsersACL
 from cone.ugm.model.user import User
 from node.behaviors import Nodify
@@ -52,9 +54,16 @@ class Users(object):
     def backend(self):
         return ugm_backend.ugm.users
 
+    @property
+    def indexes(self):
+        return users_indexes
+
     @locktree
     def invalidate(self, key=None):
+        self.indexes.invalidate(key)
         if key is None:
+            # user deletion might have changed group memberships
+            local_manager_index.invalidate()
             self.backend.parent.invalidate('users')
             return
         self.backend.invalidate(key)
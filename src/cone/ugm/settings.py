@@ -1,47 +1,720 @@
+from cone.app import compat
+from cone.app import get_root
 from cone.app.model import BaseNode
 from cone.app.model import Metadata
 from cone.app.model import Properties
 from cone.app.model import XMLProperties
+from cone.app.ugm import ugm_backend
+from cone.ugm.localmanager import local_manager_index
 from cone.ugm.localmanager import LocalManagerConfigAttributes
 from cone.ugm.utils import general_settings
 from node.utils import instance_property
 from pyramid.i18n import TranslationStringFactory
+import copy
+import logging
+import mmap
 import os
+import struct
+import threading
 
 
+try:  # pragma: no cover
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+logger = logging.getLogger('cone.ugm')
 _ = TranslationStringFactory('cone.ugm')
 
 
 ugm_cfg = Properties()
 ugm_cfg.ugm_settings = ''
 ugm_cfg.lm_settings = ''
+ugm_cfg.generation_file = ''
+ugm_cfg.changes_file = ''
+ugm_cfg.autoincrement_file = ''
 
 # XXX: move cone.ugm.model.factory_defaults here
 
 
+class SettingsSnapshot(object):
+    """Immutable snapshot of settings values.
+
+    Settings are available as attributes. Not existing settings are None.
+    """
+
+    def __init__(self, data):
+        for name, value in data.items():
+            object.__setattr__(self, name, copy.copy(value))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Settings snapshot is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Settings snapshot is immutable')
+
+
+class ColumnMap(object):
+    """Immutable ordered mapping, e.g. of attribute names to labels.
+    """
+    __slots__ = ('_keys', '_data')
+
+    def __init__(self, items=()):
+        if hasattr(items, 'items'):
+            items = items.items()
+        items = [(key, value) for key, value in items]
+        object.__setattr__(self, '_keys', tuple([it[0] for it in items]))
+        object.__setattr__(self, '_data', dict(items))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Column map is immutable')
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __eq__(self, other):
+        if isinstance(other, ColumnMap):
+            return self.items() == other.items()
+        if hasattr(other, 'items'):
+            return dict(self.items()) == dict(other.items())
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return '<ColumnMap {}>'.format(self.items())
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [self._data[key] for key in self._keys]
+
+    def items(self):
+        return [(key, self._data[key]) for key in self._keys]
+
+
+def as_text(value, default):
+    if value is None:
+        return default
+    return compat.UNICODE_TYPE(value)
+
+
+def as_bool(value, default):
+    if value is True or value is False:
+        return value
+    if value in (None, ''):
+        return default
+    return value == 'True'
+
+
+def as_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def as_tuple(value, default):
+    if not value:
+        return default
+    if type(value) not in compat.ITER_TYPES:
+        return (value,)
+    return tuple(value)
+
+
+def as_column_map(value, default):
+    if not value:
+        return default
+    return ColumnMap(value)
+
+
+class GeneralSettingsSnapshot(object):
+    """Typed and immutable snapshot of general UGM settings.
+
+    Values are converted and validated by ``schema`` once on creation. Each
+    schema entry consists of setting name, converter and default value.
+    """
+    schema = (
+        ('users_exposed_attributes', as_tuple, ()),
+        ('users_account_expiration', as_bool, False),
+        ('users_expires_attr', as_text, u'shadowExpire'),
+        ('users_expires_unit', as_int, 0),
+        ('user_id_autoincrement', as_bool, False),
+        ('user_id_autoincrement_prefix', as_text, u''),
+        ('user_id_autoincrement_start', as_int, 0),
+        ('users_portrait', as_bool, False),
+        ('users_portrait_attr', as_text, u'portrait'),
+        ('users_portrait_accept', as_text, u'image/jpeg'),
+        ('users_portrait_width', as_int, 50),
+        ('users_portrait_height', as_int, 50),
+        ('users_local_management_enabled', as_bool, False),
+        ('users_login_name_attr', as_text, u''),
+        ('users_form_attrmap', as_column_map, ColumnMap()),
+        ('users_listing_columns', as_column_map, ColumnMap([
+            ('id', u'User ID')
+        ])),
+        ('users_listing_default_column', as_text, u'id'),
+        ('users_listing_search_index', as_bool, False),
+        ('groups_form_attrmap', as_column_map, ColumnMap()),
+        ('groups_listing_columns', as_column_map, ColumnMap([
+            ('id', u'Group ID')
+        ])),
+        ('groups_listing_default_column', as_text, u'id'),
+        ('groups_listing_search_index', as_bool, False),
+        ('roles_principal_roles_enabled', as_bool, False),
+    )
+    __slots__ = tuple([it[0] for it in schema])
+
+    def __init__(self, data):
+        for name, converter, default in self.schema:
+            value = converter(data.get(name), default)
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Settings snapshot is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Settings snapshot is immutable')
+
+    def changes(self, other):
+        """Return names of settings differing in other snapshot.
+        """
+        return [
+            name for name in self.__slots__
+            if getattr(self, name) != getattr(other, name)
+        ]
+
+
+# Flags defining which parts of UGM need to be reloaded after settings change
+RELOAD_SETTINGS = 0
+RELOAD_USERS = 1
+RELOAD_GROUPS = 2
+RELOAD_USERS_LISTING = 4
+RELOAD_GROUPS_LISTING = 8
+RELOAD_BACKEND = 16
+RELOAD_LOCAL_MANAGER = 32
+RELOAD_ALL = 63
+
+# Settings not contained here are presentation only. Settings read by the
+# UGM backend factories on initialization reinitialize the backend, settings
+# affecting principal attributes reload the related principals container,
+# search index flags drop cached listing search results.
+settings_reload_flags = {
+    'users_account_expiration': RELOAD_BACKEND,
+    'users_expires_attr': RELOAD_BACKEND,
+    'users_expires_unit': RELOAD_BACKEND,
+    'users_exposed_attributes': RELOAD_BACKEND,
+    'users_portrait_attr': RELOAD_USERS,
+    'users_login_name_attr': RELOAD_USERS,
+    'users_form_attrmap': RELOAD_USERS,
+    'users_listing_search_index': RELOAD_USERS_LISTING,
+    'groups_form_attrmap': RELOAD_GROUPS,
+    'groups_listing_search_index': RELOAD_GROUPS_LISTING,
+}
+
+
+def reload_flags(names):
+    """Return reload flags for changed settings names.
+
+    Unknown settings reload everything.
+    """
+    flags = RELOAD_SETTINGS
+    known = GeneralSettingsSnapshot.__slots__
+    for name in names:
+        if name not in known:
+            return RELOAD_ALL
+        flags |= settings_reload_flags.get(name, RELOAD_SETTINGS)
+    return flags
+
+
+class SettingsCache(object):
+    """Process wide cache of settings snapshots.
+
+    Settings files are parsed once and snapshots are created once per parsed
+    or written settings. Files are not checked for modification on access,
+    settings changed by other processes get invalidated by
+    ``check_settings_generation``.
+    """
+
+    def __init__(self):
+        self._entries = dict()
+        self._lock = threading.Lock()
+
+    def _entry(self, path, properties=None):
+        entry = self._entries.get(path)
+        if entry is None or properties is not None:
+            if properties is None:
+                properties = XMLProperties(path)
+            data = dict([
+                (name, copy.deepcopy(properties[name]))
+                for name in properties.keys()
+            ])
+            entry = self._entries[path] = {
+                'data': data,
+                'snapshots': dict()
+            }
+        return entry
+
+    def snapshot(self, path, factory=SettingsSnapshot):
+        """Return snapshot for path created by ``factory``.
+        """
+        with self._lock:
+            entry = self._entry(path)
+            snapshots = entry['snapshots']
+            snapshot = snapshots.get(factory)
+            if snapshot is None:
+                snapshot = snapshots[factory] = factory(entry['data'])
+            return snapshot
+
+    def written(self, path, properties):
+        """Notify cache that ``properties`` have been written to path.
+
+        Cached snapshots get replaced by snapshots of written properties.
+        """
+        with self._lock:
+            self._entry(path, properties=properties)
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries = dict()
+            else:
+                self._entries.pop(path, None)
+
+
+settings_cache = SettingsCache()
+
+
+class MappedLog(object):
+    """Log of recent changes shared between processes.
+
+    The log is stored in a memory mapped file defined by ``path``. The file
+    starts with the current generation as unsigned 64 bit integer, followed
+    by ``slots`` records in ``record_format``. The first value of a record is
+    the generation it belongs to, the record of a generation is stored in
+    slot ``generation % slots``.
+
+    Processes remember the last seen generation and read the records of the
+    generations missed since then.
+
+    If the file cannot be created or mapped, e.g. because the directory is
+    read only, the error is logged once and propagation is disabled for this
+    file.
+    """
+    header_format = '<Q'
+    record_format = '<Q'
+    slots = 1
+
+    def __init__(self):
+        self.seen = None
+        self._path = None
+        self._mmap = None
+        self._failed_path = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        raise NotImplementedError(
+            'Abstract ``MappedLog`` does not implement ``path``'
+        )
+
+    @property
+    def size(self):
+        header_size = struct.calcsize(self.header_format)
+        return header_size + struct.calcsize(self.record_format) * self.slots
+
+    def _map(self):
+        path = self.path
+        if not path:
+            self._close()
+            return None
+        if path == self._failed_path:
+            return None
+        if path != self._path:
+            self._close()
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    if os.fstat(fd).st_size < self.size:
+                        os.ftruncate(fd, self.size)
+                    self._mmap = mmap.mmap(fd, self.size)
+                finally:
+                    os.close(fd)
+            except (EnvironmentError, ValueError) as e:
+                logger.error((
+                    'Cannot map {}, changes are not propagated between '
+                    'processes: {}'
+                ).format(path, e))
+                self._failed_path = path
+                return None
+            self._path = path
+            self.seen = None
+        return self._mmap
+
+    def _close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._path = self._mmap = None
+
+    def _offset(self, generation):
+        header_size = struct.calcsize(self.header_format)
+        record_size = struct.calcsize(self.record_format)
+        return header_size + record_size * (generation % self.slots)
+
+    def current(self):
+        """Return current generation or None if no file defined.
+        """
+        with self._lock:
+            mapped = self._map()
+            if mapped is None:
+                return None
+            return struct.unpack_from(self.header_format, mapped)[0]
+
+    def append(self, records):
+        """Append records and return the new generation.
+
+        ``records`` are tuples of record values without generation. Each
+        record gets its own generation. The calling process does not consider
+        its own records as missed, unless records of other processes have
+        been missed since last ``read``.
+        """
+        records = list(records)
+        if not records:
+            return None
+        with self._lock:
+            mapped = self._map()
+            if mapped is None:
+                return None
+            with open(self._path, 'rb') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    previous = generation = struct.unpack_from(
+                        self.header_format,
+                        mapped
+                    )[0]
+                    for record in records:
+                        generation += 1
+                        struct.pack_into(
+                            self.record_format,
+                            mapped,
+                            self._offset(generation),
+                            generation,
+                            *record
+                        )
+                    struct.pack_into(self.header_format, mapped, 0, generation)
+                    mapped.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+            if self.seen is None or self.seen == previous:
+                self.seen = generation
+            return generation
+
+    def read(self):
+        """Return records missed since last read.
+
+        Returns None if nothing changed, otherwise a tuple containing the
+        list of missed records without generation and a flag whether the
+        list is complete. The list is incomplete if missed records have
+        already been overwritten by later ones. The first read of a process
+        only remembers the current generation.
+        """
+        with self._lock:
+            mapped = self._map()
+            if mapped is None:
+                return None
+            generation = struct.unpack_from(self.header_format, mapped)[0]
+            seen = self.seen
+            self.seen = generation
+            if seen is None or generation == seen:
+                return None
+            records = list()
+            if generation - seen > self.slots or generation < seen:
+                return records, False
+            for missed in range(seen + 1, generation + 1):
+                record = struct.unpack_from(
+                    self.record_format,
+                    mapped,
+                    self._offset(missed)
+                )
+                if record[0] != missed:
+                    # slot already reused by a later generation
+                    return records, False
+                records.append(record[1:])
+            return records, True
+
+
+class SettingsGeneration(MappedLog):
+    """Settings generation counter shared between processes.
+
+    Each settings change appends the reload flags it requires to the log
+    stored in ``ugm_cfg.generation_file``. Worker processes check the log on
+    each request and reload the parts of UGM affected by the changes missed
+    since last check.
+    """
+    record_format = '<QQ'
+    slots = 64
+
+    @property
+    def path(self):
+        return ugm_cfg.generation_file
+
+    def bump(self, flags=RELOAD_ALL):
+        """Append reload flags and return the new generation.
+
+        The calling process has already reloaded and does not consider the
+        new generation changed.
+        """
+        return self.append([(flags,)])
+
+    def check(self):
+        """Check whether generation changed since last check.
+
+        Return None if unchanged, otherwise the combined reload flags of all
+        changes since last check. Everything gets reloaded only if the log
+        does not contain all missed changes anymore. The first check of a
+        process only remembers the current generation.
+        """
+        changes = self.read()
+        if changes is None:
+            return None
+        records, complete = changes
+        if not complete:
+            return RELOAD_ALL
+        flags = RELOAD_SETTINGS
+        for record in records:
+            flags |= record[0]
+        return flags
+
+
+settings_generation = SettingsGeneration()
+
+
+# Kinds and actions of principal changes
+PRINCIPAL_USER = 1
+PRINCIPAL_GROUP = 2
+PRINCIPAL_CHANGED = 0
+PRINCIPAL_ADDED = 1
+PRINCIPAL_DELETED = 2
+
+
+class PrincipalChanges(MappedLog):
+    """Log of persisted changes of users and groups shared between processes.
+
+    Records contain kind, action and id of changed principals and are stored
+    in ``ugm_cfg.changes_file``. Principal ids longer than ``id_size`` bytes
+    are recorded without id, which causes the whole container to be reloaded
+    by other processes.
+    """
+    id_size = 116
+    record_format = '<QBBH{}s'.format(id_size)
+    slots = 1024
+
+    @property
+    def path(self):
+        return ugm_cfg.changes_file
+
+    def publish(self, users=(), groups=(), action=PRINCIPAL_CHANGED):
+        """Append changes of users and groups by id and return the new
+        generation.
+        """
+        records = list()
+        for kind, principal_ids in [
+            (PRINCIPAL_USER, users),
+            (PRINCIPAL_GROUP, groups)
+        ]:
+            for principal_id in principal_ids:
+                value = principal_id
+                if isinstance(value, compat.UNICODE_TYPE):
+                    value = value.encode('utf-8')
+                if len(value) > self.id_size:
+                    value = b''
+                records.append((kind, action, len(value), value))
+        return self.append(records)
+
+    def check(self):
+        """Check whether principals changed since last check.
+
+        Return None if unchanged, otherwise a tuple containing a list of
+        ``(kind, action, principal_id)`` tuples and a flag whether the list
+        is complete. ``principal_id`` is None if it was too long to be
+        recorded.
+        """
+        changes = self.read()
+        if changes is None:
+            return None
+        records, complete = changes
+        changed = list()
+        for kind, action, length, value in records:
+            principal_id = None
+            if length:
+                principal_id = value[:length].decode('utf-8')
+            changed.append((kind, action, principal_id))
+        return changed, complete
+
+
+principal_changes = PrincipalChanges()
+
+
+def principals_changed(users=(), groups=(), action=PRINCIPAL_CHANGED):
+    """Notify other processes about persisted changes of principals.
+
+    ``users`` and ``groups`` are the ids of changed principals, ``action`` is
+    one of ``PRINCIPAL_CHANGED``, ``PRINCIPAL_ADDED`` or
+    ``PRINCIPAL_DELETED``. Other processes only reload the changed principals
+    on next request, see ``check_principal_changes``.
+    """
+    principal_changes.publish(users=users, groups=groups, action=action)
+
+
+def reload_ugm(root, flags=RELOAD_ALL):
+    """Reload parts of UGM defined by reload flags.
+
+    The UGM backend only gets reinitialized with ``RELOAD_BACKEND``. Indexes
+    and caches of principal containers not affected are kept. Local manager
+    rules, the local manager index and cached listing search results, which
+    depend on local manager rules, get reloaded with ``RELOAD_LOCAL_MANAGER``.
+    """
+    if flags & RELOAD_BACKEND:
+        ugm_backend.initialize()
+    if flags & RELOAD_LOCAL_MANAGER:
+        root['settings'].invalidate('ugm_localmanager')
+        local_manager_index.invalidate()
+        flags |= RELOAD_USERS_LISTING | RELOAD_GROUPS_LISTING
+    for name, reload, reload_listing in [
+        ('users', RELOAD_USERS, RELOAD_USERS_LISTING),
+        ('groups', RELOAD_GROUPS, RELOAD_GROUPS_LISTING)
+    ]:
+        if flags & (RELOAD_BACKEND | reload):
+            root[name].invalidate()
+        elif flags & reload_listing:
+            root[name].indexes.search_cache.clear()
+
+
+def check_settings_generation(event):
+    """``NewRequest`` subscriber reloading UGM if settings have been changed
+    by another process.
+    """
+    flags = settings_generation.check()
+    if flags is None:
+        return
+    root = get_root()
+    root['settings']['ugm_general'].invalidate()
+    reload_ugm(root, flags)
+
+
+def reload_principals(root, changes, complete=True):
+    """Reload principals changed by another process.
+
+    ``changes`` is a list of ``(kind, action, principal_id)`` tuples. Changed
+    principals get invalidated by id, thus listing indexes are updated
+    incrementally. If principals have been added or deleted, the backend
+    container additionally gets reloaded. The whole principals container is
+    only invalidated if changes are incomplete or contain principals without
+    id.
+    """
+    containers = [
+        (PRINCIPAL_USER, root['users']),
+        (PRINCIPAL_GROUP, root['groups'])
+    ]
+    for kind, container in containers:
+        principal_ids = set()
+        keys_changed = False
+        reset = not complete
+        for change_kind, action, principal_id in changes:
+            if change_kind != kind:
+                continue
+            if principal_id is None:
+                reset = True
+                break
+            principal_ids.add(principal_id)
+            keys_changed = keys_changed or action != PRINCIPAL_CHANGED
+        if reset:
+            container.invalidate()
+            continue
+        for principal_id in principal_ids:
+            container.invalidate(principal_id)
+        if keys_changed:
+            container.backend.parent.invalidate(container.name)
+
+
+def check_principal_changes(event):
+    """``NewRequest`` subscriber reloading principals changed by another
+    process.
+    """
+    changes = principal_changes.check()
+    if changes is None:
+        return
+    changed, complete = changes
+    reload_principals(get_root(), changed, complete=complete)
+
+
 class UGMSettings(BaseNode):
     config_file = None
+    snapshot_factory = SettingsSnapshot
 
     def __call__(self):
-        self.attrs()
+        attrs = self.attrs
+        attrs()
+        settings_cache.written(self.config_file, attrs)
 
     @instance_property
     def attrs(self):
+        """``XMLProperties`` of settings file used for editing.
+
+        Properties are private to the settings node. Changes are not visible
+        in ``snapshot`` until they get written by calling the settings node.
+        """
+        return XMLProperties(self._existing_config_file())
+
+    @property
+    def snapshot(self):
+        """Immutable snapshot of persisted settings created by
+        ``snapshot_factory``.
+        """
+        return settings_cache.snapshot(
+            self._existing_config_file(),
+            factory=self.snapshot_factory
+        )
+
+    def _existing_config_file(self):
         config_file = self.config_file
         if not os.path.isfile(config_file):
             msg = 'Configuration file {} not exists.'.format(config_file)
             raise ValueError(msg)
-        return XMLProperties(config_file)
+        return config_file
 
     def invalidate(self, attrs=[]):
-        attrs.append('attrs')
-        for attr in attrs:
+        settings_cache.invalidate(self.config_file)
+        for attr in ['attrs'] + list(attrs):
             _attr = '_{}'.format(attr)
             if hasattr(self, _attr):
                 delattr(self, _attr)
 
 
 class GeneralSettings(UGMSettings):
+    snapshot_factory = GeneralSettingsSnapshot
 
     @property
     def config_file(self):
@@ -80,8 +753,14 @@ class LocalManagerSettings(BaseNode):
 
     @property
     def enabled(self):
-        settings = general_settings(self.root)
-        return settings.attrs.users_local_management_enabled == 'True'
+        settings = general_settings(self.root).snapshot
+        return settings.users_local_management_enabled
 
     def __call__(self):
         self.attrs()
+        # cached listing search results depend on local manager rules
+        root = self.root
+        root['users'].indexes.search_cache.clear()
+        root['groups'].indexes.search_cache.clear()
+        # notify other processes
+        settings_generation.bump(RELOAD_LOCAL_MANAGER)
@@ -148,6 +148,12 @@ class UGMLayer(Security):
             'ugm.backend': 'file',
             'ugm.config': ugm_config,
             'ugm.localmanager_config': localmanager_config,
+            'ugm.generation_file': os.path.join(self.ugm_dir, 'generation'),
+            'ugm.changes_file': os.path.join(self.ugm_dir, 'changes'),
+            'ugm.autoincrement_file': os.path.join(
+                self.ugm_dir,
+                'autoincrement'
+            ),
             'ugm.users_file': ugm_users_file,
             'ugm.groups_file': ugm_groups_file,
             'ugm.roles_file': ugm_roles_file,
@@ -3,9 +3,13 @@ import unittest
 
 
 def test_suite():
+    from cone.ugm.tests import test_autoincrement
+    from cone.ugm.tests import test_cache
+    from cone.ugm.tests import test_index
     from cone.ugm.tests import test_layout
     from cone.ugm.tests import test_localmanager
     from cone.ugm.tests import test_settings
+    from cone.ugm.tests import test_unitofwork
     from cone.ugm.tests import test_utils
 
     from cone.ugm.tests import test_model_group
@@ -18,6 +22,7 @@ def test_suite():
     from cone.ugm.tests import test_browser_expires
     from cone.ugm.tests import test_browser_group
     from cone.ugm.tests import test_browser_groups
+    from cone.ugm.tests import test_browser_listing
     from cone.ugm.tests import test_browser_portrait
     from cone.ugm.tests import test_browser_principal
     from cone.ugm.tests import test_browser_remote
@@ -30,9 +35,13 @@ def test_suite():
 
     suite = unittest.TestSuite()
 
+    suite.addTest(unittest.findTestCases(test_autoincrement))
+    suite.addTest(unittest.findTestCases(test_cache))
+    suite.addTest(unittest.findTestCases(test_index))
     suite.addTest(unittest.findTestCases(test_layout))
     suite.addTest(unittest.findTestCases(test_localmanager))
     suite.addTest(unittest.findTestCases(test_settings))
+    suite.addTest(unittest.findTestCases(test_unitofwork))
     suite.addTest(unittest.findTestCases(test_utils))
 
     suite.addTest(unittest.findTestCases(test_model_group))
@@ -45,6 +54,7 @@ def test_suite():
     suite.addTest(unittest.findTestCases(test_browser_expires))
     suite.addTest(unittest.findTestCases(test_browser_group))
     suite.addTest(unittest.findTestCases(test_browser_groups))
+    suite.addTest(unittest.findTestCases(test_browser_listing))
     suite.addTest(unittest.findTestCases(test_browser_portrait))
     suite.addTest(unittest.findTestCases(test_browser_principal))
     suite.addTest(unittest.findTestCases(test_browser_remote))
@@ -0,0 +1,94 @@
+from cone.app import get_root
+from cone.ugm import testing
+from cone.ugm.autoincrement import AutoIncrementSequence
+from cone.ugm.autoincrement import highest_principal_number
+from cone.ugm.settings import ugm_cfg
+from node.tests import NodeTestCase
+import json
+import os
+
+
+class TestAutoIncrement(NodeTestCase):
+    layer = testing.ugm_layer
+
+    @testing.principals(
+        users={
+            '100': {},
+            '102': {},
+            'uid7': {},
+            'manager': {},
+        })
+    def test_highest_principal_number(self):
+        users = get_root()['users'].backend
+        self.assertEqual(highest_principal_number(users, ''), 102)
+        self.assertEqual(highest_principal_number(users, 'uid'), 7)
+        self.assertEqual(highest_principal_number(users, 'x'), None)
+
+    @testing.temp_directory
+    def test_AutoIncrementSequence(self, tempdir):
+        autoincrement_file = ugm_cfg.autoincrement_file
+        seeded = list()
+
+        def seed(highest):
+            def seed():
+                seeded.append(highest)
+                return highest
+            return seed
+
+        try:
+            # Without state file, sequence gets seeded on each allocation
+            ugm_cfg.autoincrement_file = ''
+            sequence = AutoIncrementSequence()
+            self.assertEqual(sequence.allocate('', 100, seed(None)), 100)
+            self.assertEqual(sequence.allocate('', 100, seed(120)), 121)
+            self.assertEqual(seeded, [None, 120])
+
+            # Sequence gets seeded once per prefix
+            path = os.path.join(tempdir, 'autoincrement')
+            ugm_cfg.autoincrement_file = path
+            del seeded[:]
+            self.assertEqual(sequence.allocate('', 100, seed(120)), 121)
+            self.assertEqual(sequence.allocate('', 100, seed(120)), 122)
+            self.assertEqual(sequence.allocate('uid', 0, seed(None)), 0)
+            self.assertEqual(sequence.allocate('uid', 0, seed(None)), 1)
+            self.assertEqual(seeded, [120, None])
+            with open(path) as f:
+                self.assertEqual(json.load(f), {'': 123, 'uid': 2})
+
+            # State is shared via state file
+            other = AutoIncrementSequence()
+            self.assertEqual(other.allocate('', 100, seed(120)), 123)
+            self.assertEqual(sequence.allocate('', 100, seed(120)), 124)
+
+            # Start is the lowest number returned
+            self.assertEqual(sequence.allocate('uid', 10, seed(None)), 10)
+
+            # Numbers already in use get skipped
+            self.assertEqual(sequence.allocate(
+                '',
+                100,
+                seed(120),
+                exists=lambda number: number in [125, 126]
+            ), 127)
+            self.assertEqual(sequence.allocate('', 100, seed(120)), 128)
+
+            # Unreadable state file gets seeded again
+            with open(path, 'w') as f:
+                f.write('{')
+            del seeded[:]
+            self.assertEqual(sequence.allocate('', 100, seed(140)), 141)
+            self.assertEqual(seeded, [140])
+
+            # Sequence gets seeded on each allocation if state file cannot
+            # be used
+            ugm_cfg.autoincrement_file = os.path.join(
+                tempdir,
+                'inexistent',
+                'autoincrement'
+            )
+            del seeded[:]
+            self.assertEqual(sequence.allocate('', 100, seed(150)), 151)
+            self.assertEqual(sequence.allocate('', 100, seed(151)), 152)
+            self.assertEqual(seeded, [150, 151])
+        finally:
+            ugm_cfg.autoincrement_file = autoincrement_file
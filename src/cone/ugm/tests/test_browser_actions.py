@@ -2,8 +2,17 @@ from cone.app import compat
 from cone.app import get_root
 from cone.tile.tests import TileTestCase
 from cone.ugm import testing
+from cone.ugm.browser.actions import LM_TARGET_GID_IS_DEFAULT
+from cone.ugm.browser.actions import LM_TARGET_GID_NOT_ALLOWED
+from cone.ugm.browser.actions import LM_TARGET_UID_NOT_ALLOWED
+from cone.ugm.browser.actions import ManageMembershipError
+from cone.ugm.browser.actions import membership_violations
+from cone.ugm.browser.actions import validate_add_users_to_groups
+from cone.ugm.browser.actions import validate_remove_users_from_groups
+from cone.ugm.utils import general_settings
 from pyramid.exceptions import HTTPForbidden
 from pyramid.view import render_view_to_response
+from webob.multidict import MultiDict
 import json
 
 
@@ -286,3 +295,124 @@ class TestBrowserActions(TileTestCase):
         self.assertTrue(json_res['message'].find("'group_1'") > -1)
 
         self.assertEqual(groups.keys(), [])
+
+    @testing.principals(
+        users={
+            'local_manager_1': {},
+            'managed_user_1': {},
+            'managed_user_2': {},
+            'manager': {},
+        },
+        groups={
+            'admin_group_1': {},
+            'managed_group_0': {},
+            'managed_group_1': {},
+            'managed_group_2': {},
+        },
+        membership={
+            'admin_group_1': ['local_manager_1'],
+            'managed_group_1': ['managed_user_1'],
+        },
+        roles={
+            'local_manager_1': ['editor'],
+            'manager': ['manager'],
+        })
+    def test_membership_violations(self):
+        root = get_root()
+        users = root['users']
+        settings = general_settings(root)
+        settings.attrs.users_local_management_enabled = 'True'
+        settings()
+        try:
+            # Local management not considered
+            with self.layer.authenticated('manager'):
+                self.assertEqual(membership_violations(
+                    users,
+                    ['managed_user_2'],
+                    ['managed_group_2'],
+                    remove=True
+                ), [])
+
+            user_ids = ['managed_user_1', 'managed_user_2', 'manager']
+            group_ids = [
+                'managed_group_0',
+                'managed_group_1',
+                'managed_group_2'
+            ]
+            with self.layer.authenticated('local_manager_1'):
+                # All violations are collected
+                self.assertEqual(
+                    membership_violations(users, user_ids, group_ids),
+                    [
+                        (LM_TARGET_GID_NOT_ALLOWED, 'managed_group_2'),
+                        (LM_TARGET_UID_NOT_ALLOWED, 'managed_user_2'),
+                        (LM_TARGET_UID_NOT_ALLOWED, 'manager'),
+                    ]
+                )
+                self.assertEqual(
+                    membership_violations(
+                        users,
+                        ['managed_user_1'],
+                        group_ids,
+                        remove=True
+                    ),
+                    [
+                        (LM_TARGET_GID_NOT_ALLOWED, 'managed_group_2'),
+                        (LM_TARGET_GID_IS_DEFAULT, 'managed_group_1'),
+                    ]
+                )
+
+                # Validators raise on violations
+                validate_add_users_to_groups(
+                    users,
+                    ['managed_user_1'],
+                    ['managed_group_0', 'managed_group_1']
+                )
+                err = self.expectError(
+                    ManageMembershipError,
+                    validate_add_users_to_groups,
+                    users,
+                    user_ids,
+                    group_ids
+                )
+                self.assertEqual(err.reason, LM_TARGET_GID_NOT_ALLOWED)
+                self.assertEqual(err.data, 'managed_group_2')
+                self.assertEqual(len(err.violations), 3)
+                self.assertEqual(
+                    err.data_for(LM_TARGET_UID_NOT_ALLOWED),
+                    ['managed_user_2', 'manager']
+                )
+
+                validate_remove_users_from_groups(
+                    users,
+                    ['managed_user_1'],
+                    ['managed_group_0']
+                )
+                err = self.expectError(
+                    ManageMembershipError,
+                    validate_remove_users_from_groups,
+                    users,
+                    ['managed_user_1'],
+                    ['managed_group_1']
+                )
+                self.assertEqual(err.reason, LM_TARGET_GID_IS_DEFAULT)
+                self.assertEqual(err.violations, [
+                    (LM_TARGET_GID_IS_DEFAULT, 'managed_group_1')
+                ])
+
+                # Actions report all violating ids
+                group = root['groups']['managed_group_0']
+                request = self.layer.new_request(type='json')
+                request.params = MultiDict([('id[]', uid) for uid in user_ids])
+                res = render_view_to_response(group, request, name='add_item')
+                self.assertEqual(json.loads(res.text), {
+                    'message': (
+                        "Failed adding user 'managed_user_2, manager' to "
+                        "group 'managed_group_0'. Manage membership denied "
+                        "for user."
+                    ),
+                    'success': False
+                })
+        finally:
+            settings.attrs.users_local_management_enabled = 'False'
+            settings()
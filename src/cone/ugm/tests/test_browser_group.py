@@ -2,6 +2,8 @@ from cone.app import get_root
 from cone.tile import render_tile
 from cone.tile.tests import TileTestCase
 from cone.ugm import testing
+from cone.ugm.browser.group import AllUsersColumnListing
+from cone.ugm.browser.group import UsersOfGroupColumnListing
 from cone.ugm.model.group import Group
 from pyramid.httpexceptions import HTTPForbidden
 from webob.exc import HTTPFound
@@ -164,6 +166,88 @@ class TestBrowserGroup(TileTestCase):
         )
         self.assertTrue(res.find(expected) > -1)
 
+    @testing.principals(
+        users=dict([
+            ('user_{}'.format(i), {'email': 'user_{}@example.com'.format(i)})
+            for i in range(1, 11)
+        ] + [('manager', {})]),
+        groups={
+            'group_1': {}
+        },
+        membership={
+            'group_1': ['user_2', 'user_10']
+        },
+        roles={
+            'manager': ['manager']
+        })
+    def test_UsersListing(self):
+        group = get_root()['groups']['group_1']
+
+        def users_listing(factory, **params):
+            listing = factory()
+            listing.model = group
+            listing.request = self.layer.new_request()
+            listing.request.params.update(params)
+            return listing
+
+        with self.layer.authenticated('manager'):
+            # All users, attributes are only fetched for current batch page
+            listing = users_listing(AllUsersColumnListing)
+            queried = list()
+            query_attrs = listing.query_attrs
+
+            def counting_query_attrs(keys):
+                queried.extend(keys)
+                return query_attrs(keys)
+
+            listing.query_attrs = counting_query_attrs
+            self.assertEqual(listing.item_count, 11)
+            items = listing.items
+            self.assertEqual(len(items), 8)
+            self.assertEqual(queried, [
+                'manager', 'user_1', 'user_2', 'user_3', 'user_4', 'user_5',
+                'user_6', 'user_7'
+            ])
+            self.assertEqual(
+                [item.data['related'] for item in items[:3]],
+                [False, False, True]
+            )
+            actions = items[2]['actions']
+            self.assertEqual(
+                [(a['id'], a['enabled']) for a in actions],
+                [('add_item', False), ('remove_item', True)]
+            )
+            self.assertFalse(items[2]['current'])
+
+            listing = users_listing(AllUsersColumnListing, b_page='1')
+            self.assertEqual(
+                [item.key for item in listing.items],
+                ['user_8', 'user_9', 'user_10']
+            )
+
+            # Filter all users
+            listing = users_listing(AllUsersColumnListing, filter='user_1*')
+            self.assertEqual(listing.listing_keys, ['user_1', 'user_10'])
+
+            # Filter is case insensitive
+            listing = users_listing(AllUsersColumnListing, filter='*@EXAMPLE*')
+            self.assertEqual(listing.item_count, 10)
+
+            # Members only
+            listing = users_listing(UsersOfGroupColumnListing)
+            self.assertEqual(listing.listing_keys, ['user_2', 'user_10'])
+            self.assertEqual(
+                [item.data['related'] for item in listing.items],
+                [True, True]
+            )
+
+            listing = users_listing(
+                UsersOfGroupColumnListing,
+                filter='user_1*',
+                order='desc'
+            )
+            self.assertEqual(listing.listing_keys, ['user_10'])
+
     @testing.principals(
         users={
             'manager': {}
@@ -246,3 +330,13 @@ class TestBrowserGroup(TileTestCase):
         self.assertEqual(res, '')
 
         self.assertEqual(group.attrs['groupname'], 'Groupname Changed')
+
+        # listing indexes are updated
+        sort_index = groups.indexes.sort_index('groupname')
+        self.assertEqual(sort_index.range(groups.backend), ['group_1'])
+        groups.indexes.search_cache.set('group*', frozenset(['group_1']))
+        request.params['groupform.groupname'] = 'Other'
+        with self.layer.authenticated('manager'):
+            render_tile(group, request, 'edit')
+        self.assertEqual(len(groups.indexes.search_cache), 0)
+        self.assertEqual(sort_index._pending, set(['group_1']))
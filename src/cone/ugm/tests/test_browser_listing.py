@@ -0,0 +1,247 @@
+from cone.app import get_root
+from cone.tile.tests import TileTestCase
+from cone.ugm import testing
+from cone.ugm.browser.groups import GroupsColumnListing
+from cone.ugm.browser.listing import ColumnListing
+from cone.ugm.browser.listing import ListingItem
+from cone.ugm.browser.users import UsersColumnListing
+from cone.ugm.localmanager import LocalManagerConfigAttributes
+from cone.ugm.settings import check_settings_generation
+from cone.ugm.settings import RELOAD_LOCAL_MANAGER
+from cone.ugm.settings import SettingsGeneration
+from cone.ugm.settings import ugm_cfg
+from cone.ugm.utils import general_settings
+from cone.ugm.utils import localmanager_settings
+
+
+def users_listing(layer, **params):
+    request = layer.new_request()
+    request.params.update(params)
+    listing = UsersColumnListing()
+    listing.model = get_root()['users']
+    listing.request = request
+    return listing
+
+
+def groups_listing(layer, **params):
+    request = layer.new_request()
+    request.params.update(params)
+    listing = GroupsColumnListing()
+    listing.model = get_root()['groups']
+    listing.request = request
+    return listing
+
+
+class TestBrowserListing(TileTestCase):
+    layer = testing.ugm_layer
+
+    def test_ListingItem(self):
+        class Listing(ColumnListing):
+            computed = list()
+
+            def listing_item_target(self, item):
+                self.computed.append('target')
+                return 'http://example.com/{}'.format(item.key)
+
+            def listing_item_content(self, item):
+                self.computed.append('content')
+                return item.attrs['name']
+
+        listing = Listing()
+        item = listing.create_listing_item('a', 'A', {'name': 'Name'}, x=1)
+        self.assertTrue(isinstance(item, ListingItem))
+        self.assertEqual(item.key, 'a')
+        self.assertEqual(item.data, {'x': 1})
+        self.assertEqual(item['sort_by'], 'A')
+        self.assertEqual(listing.computed, [])
+
+        self.assertEqual(item['target'], 'http://example.com/a')
+        self.assertEqual(item['target'], 'http://example.com/a')
+        self.assertEqual(listing.computed, ['target'])
+
+        self.assertEqual(item['content'], 'Name')
+        self.assertEqual(item['current'], False)
+        self.assertEqual(item['actions'], [])
+        self.assertEqual(listing.computed, ['target', 'content'])
+
+        self.expectError(KeyError, lambda: item['inexistent'])
+        self.assertEqual(item.get('inexistent', 'default'), 'default')
+
+    @testing.principals(
+        users=dict([
+            ('user_{}'.format(i), {'email': 'user_{}@example.com'.format(i)})
+            for i in range(1, 11)
+        ] + [('manager', {})]),
+        roles={
+            'manager': ['manager']
+        })
+    def test_PrincipalsListing(self):
+        with self.layer.authenticated('manager'):
+            listing = users_listing(self.layer)
+            self.assertEqual(listing.item_count, 11)
+            self.assertEqual(listing.listing_keys, [
+                'manager', 'user_1', 'user_2', 'user_3', 'user_4', 'user_5',
+                'user_6', 'user_7', 'user_8', 'user_9', 'user_10'
+            ])
+
+            # Attributes are only fetched for the current batch page
+            queried = list()
+            query_attrs = listing.query_attrs
+
+            def counting_query_attrs(keys):
+                queried.extend(keys)
+                return query_attrs(keys)
+
+            listing.query_attrs = counting_query_attrs
+            items = listing.items
+            self.assertEqual(len(items), 8)
+            self.assertEqual(queried, listing.listing_keys[:8])
+            self.assertEqual(items[1]['sort_by'], 'user_1')
+            self.assertTrue(items[1]['content'].find(
+                'user_1@example.com'
+            ) > -1)
+
+            # Batch vocabulary is computed from item count
+            batch = listing.batch
+            batch.model = listing.model
+            batch.request = listing.request
+            vocab = batch.vocab
+            self.assertEqual([page['page'] for page in vocab], ['1', '2'])
+
+            # Second page, descending order
+            listing = users_listing(self.layer, b_page='1', order='desc')
+            self.assertEqual(
+                [item['sort_by'] for item in listing.items],
+                ['user_2', 'user_1', 'manager']
+            )
+
+            # Filter listing
+            listing = users_listing(self.layer, filter='user_1*')
+            self.assertEqual(listing.listing_keys, ['user_1', 'user_10'])
+            self.assertEqual(listing.item_count, 2)
+
+            # Filter results are cached across requests
+            cache = listing.model.indexes.search_cache
+            cache.clear()
+
+            queried = list()
+
+            def counting_query_keys(listing):
+                query_keys = listing.query_keys
+
+                def wrapped():
+                    queried.append(listing.filter_term)
+                    return query_keys()
+                listing.query_keys = wrapped
+                return listing
+
+            listing = counting_query_keys(
+                users_listing(self.layer, filter='user_1*')
+            )
+            self.assertEqual(listing.item_count, 2)
+            listing = counting_query_keys(
+                users_listing(self.layer, filter='user_1*', b_page='1')
+            )
+            self.assertEqual(listing.items, [])
+            self.assertEqual(queried, ['user_1*'])
+            self.assertEqual(len(cache), 1)
+
+            # Cache gets invalidated if principals change
+            listing.model.invalidate('user_1')
+            self.assertEqual(len(cache), 0)
+
+    @testing.invalidate_settings
+    @testing.principals(
+        users={
+            'user_1': {'email': 'user_1@example.com'},
+            'user_2': {'email': 'user_2@example.org'},
+            'manager': {},
+        },
+        roles={
+            'manager': ['manager']
+        })
+    def test_PrincipalsListing_search_index(self):
+        settings = get_root()['settings']['ugm_general']
+        settings.attrs.users_listing_search_index = 'True'
+        settings()
+        try:
+            with self.layer.authenticated('manager'):
+                listing = users_listing(self.layer, filter='*EXAMPLE.org')
+                self.assertTrue(listing.search_index_enabled)
+                self.assertEqual(listing.search_index.attrs, ('id', 'email'))
+                self.assertEqual(listing.listing_keys, ['user_2'])
+
+                # Backend search is case sensitive
+                settings.attrs.users_listing_search_index = 'False'
+                settings()
+                listing = users_listing(self.layer, filter='*EXAMPLE.org')
+                listing.model.indexes.search_cache.clear()
+                self.assertFalse(listing.search_index_enabled)
+                self.assertEqual(listing.listing_keys, [])
+        finally:
+            settings.attrs.users_listing_search_index = 'False'
+            settings()
+
+    @testing.principals(
+        users={
+            'local_manager_1': {},
+            'managed_user_1': {},
+            'managed_user_2': {},
+        },
+        groups={
+            'admin_group_1': {},
+            'managed_group_0': {},
+            'managed_group_1': {},
+            'managed_group_2': {},
+        },
+        membership={
+            'admin_group_1': ['local_manager_1'],
+            'managed_group_1': ['managed_user_1'],
+            'managed_group_2': ['managed_user_2'],
+        },
+        roles={
+            'local_manager_1': ['editor'],
+        })
+    def test_PrincipalsListing_local_manager(self):
+        root = get_root()
+        settings = general_settings(root)
+        settings.attrs.users_local_management_enabled = 'True'
+        settings()
+        lm_settings = localmanager_settings(root)
+        rule = lm_settings.attrs['admin_group_1']
+        try:
+            with self.layer.authenticated('local_manager_1'):
+                listing = users_listing(self.layer, filter='managed*')
+                self.assertEqual(listing.listing_keys, ['managed_user_1'])
+                listing = groups_listing(self.layer, filter='managed*')
+                self.assertEqual(
+                    listing.listing_keys,
+                    ['managed_group_0', 'managed_group_1']
+                )
+
+                # Changed local manager rules are considered
+                lm_settings.attrs['admin_group_1'] = {
+                    'target': ['managed_group_2'],
+                    'default': ['managed_group_2'],
+                }
+                lm_settings()
+                listing = users_listing(self.layer, filter='managed*')
+                self.assertEqual(listing.listing_keys, ['managed_user_2'])
+                listing = groups_listing(self.layer, filter='managed*')
+                self.assertEqual(listing.listing_keys, ['managed_group_2'])
+
+                # Rules changed by other processes get reloaded
+                check_settings_generation(None)
+                other = LocalManagerConfigAttributes(ugm_cfg.lm_settings)
+                other['admin_group_1'] = rule
+                other()
+                SettingsGeneration().bump(RELOAD_LOCAL_MANAGER)
+                check_settings_generation(None)
+                listing = users_listing(self.layer, filter='managed*')
+                self.assertEqual(listing.listing_keys, ['managed_user_1'])
+        finally:
+            lm_settings = localmanager_settings(root)
+            lm_settings.attrs['admin_group_1'] = rule
+            lm_settings()
+            settings.attrs.users_local_management_enabled = 'False'
+            settings()
@@ -359,7 +359,7 @@ class TestBrowserPrincipal(TileTestCase):
         form.request = self.layer.new_request()
 
         settings = general_settings(users)
-        settings.attrs.users_login_name_attr = ''
+        self.assertEqual(settings.snapshot.users_login_name_attr, '')
 
         widget = factory(form, 'Login Name', UNSET)
         self.assertEqual(widget.getter, UNSET)
@@ -376,15 +376,21 @@ class TestBrowserPrincipal(TileTestCase):
         ))
         self.assertEqual(widget.mode, 'skip')
 
-        settings.attrs.users_login_name_attr = 'login'
-        widget = factory(form, 'Login Name', UNSET)
-        self.assertEqual(widget.mode, 'edit')
-
-        settings.attrs.users_login_name_attr = 'mail'
-        widget = factory(form, 'Login Name', UNSET)
-        self.assertEqual(widget.blueprints, [
-            'field', 'label', 'error', 'email', '*login'
-        ])
+        try:
+            settings.attrs.users_login_name_attr = 'login'
+            settings()
+            widget = factory(form, 'Login Name', UNSET)
+            self.assertEqual(widget.mode, 'edit')
+
+            settings.attrs.users_login_name_attr = 'mail'
+            settings()
+            widget = factory(form, 'Login Name', UNSET)
+            self.assertEqual(widget.blueprints, [
+                'field', 'label', 'error', 'email', '*login'
+            ])
+        finally:
+            settings.attrs.users_login_name_attr = ''
+            settings()
 
     def test_password_field_factory(self):
         factory = user_field.factory('password')
@@ -1,6 +1,10 @@
 from cone.app import get_root
 from cone.tile.tests import TileTestCase
 from cone.ugm import testing
+from cone.ugm.browser import remote
+from cone.ugm.unitofwork import UNIT_OF_WORK_KEY
+from cone.ugm.utils import general_settings
+from io import BytesIO
 from pyramid.httpexceptions import HTTPForbidden
 from pyramid.view import render_view_to_response
 import json
@@ -131,6 +135,369 @@ class TestBrowserRemote(TileTestCase):
         self.assertEqual(sorted(user.model.roles), ['editor', 'viewer'])
         self.assertTrue(user.model.authenticate('secret'))
 
+    @testing.principals(
+        users={
+            'editor': {},
+            'manager': {},
+            'user_1': {'fullname': 'User 1'},
+        },
+        groups={
+            'group_1': {},
+            'group_2': {},
+        },
+        membership={
+            'group_1': ['user_1'],
+        },
+        roles={
+            'editor': ['editor'],
+            'manager': ['manager'],
+        })
+    def test_add_user_upsert(self):
+        root = get_root()
+        users = root['users']
+        groups = root['groups']
+
+        def upsert(**params):
+            request = self.layer.new_request(type='json')
+            request.params['upsert'] = '1'
+            request.params.update(params)
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_add_user'
+            )
+            return json.loads(res.text)
+
+        with self.layer.authenticated('manager'):
+            # Inexistent user gets created
+            self.assertEqual(upsert(
+                id='user_2',
+                password='secret',
+                groups='group_1'
+            ), {
+                'success': True,
+                'message': "Created user with ID 'user_2'.",
+                'changed': True
+            })
+            self.assertEqual(users['user_2'].model.group_ids, ['group_1'])
+
+            # Existing user gets updated
+            self.assertEqual(upsert(**{
+                'id': 'user_1',
+                'password': 'changed',
+                'attr.fullname': 'User One',
+                'attr.email': 'user_1@example.com',
+                'groups': 'group_2,inexistent',
+                'roles': 'editor',
+            }), {
+                'success': True,
+                'message': (
+                    "Group 'inexistent' given but inexistent. "
+                    "Updated user with ID 'user_1'."
+                ),
+                'changed': True
+            })
+            users.invalidate()
+            groups.invalidate()
+            user = users['user_1']
+            self.assertEqual(user.attrs['fullname'], 'User One')
+            self.assertEqual(user.attrs['email'], 'user_1@example.com')
+            self.assertEqual(user.model.group_ids, ['group_2'])
+            self.assertEqual(user.model.roles, ['editor'])
+            self.assertFalse(user.model.authenticate('changed'))
+
+            # Repeated calls are no-ops
+            request = self.layer.new_request(type='json')
+            request.params.update({
+                'upsert': 'true',
+                'id': 'user_1',
+                'attr.fullname': 'User One',
+                'groups': 'group_2',
+                'roles': 'editor',
+            })
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_add_user'
+            )
+            self.assertEqual(json.loads(res.text), {
+                'success': True,
+                'message': "User with ID 'user_1' unchanged.",
+                'changed': False
+            })
+            self.assertFalse(UNIT_OF_WORK_KEY in request.environ)
+
+        # Need add permission
+        with self.layer.authenticated('editor'):
+            self.expectError(
+                HTTPForbidden,
+                upsert,
+                id='user_1'
+            )
+
+    @testing.principals(
+        users={
+            'local_manager_1': {},
+            'managed_user_1': {},
+            'managed_user_2': {},
+        },
+        groups={
+            'admin_group_1': {},
+            'managed_group_0': {},
+            'managed_group_1': {},
+            'managed_group_2': {},
+        },
+        membership={
+            'admin_group_1': ['local_manager_1'],
+            'managed_group_1': ['managed_user_1'],
+        },
+        roles={
+            'local_manager_1': ['editor'],
+        })
+    def test_add_user_upsert_local_manager(self):
+        root = get_root()
+        users = root['users']
+        groups = root['groups']
+        settings = general_settings(root)
+        settings.attrs.users_local_management_enabled = 'True'
+        settings()
+
+        def upsert(**params):
+            request = self.layer.new_request(type='json')
+            request.params['upsert'] = '1'
+            request.params.update(params)
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_add_user'
+            )
+            return json.loads(res.text)
+
+        try:
+            with self.layer.authenticated('local_manager_1'):
+                # Users not managed by local manager cannot be changed
+                self.assertEqual(upsert(**{
+                    'id': 'managed_user_2',
+                    'attr.fullname': 'Managed User 2',
+                }), {
+                    'success': False,
+                    'message': 'Editing user denied.',
+                    'changed': False
+                })
+
+                # Users cannot be added to groups not managed
+                self.assertEqual(upsert(**{
+                    'id': 'managed_user_1',
+                    'groups': 'managed_group_1,managed_group_2',
+                }), {
+                    'success': False,
+                    'message': 'Manage membership denied for target group.',
+                    'changed': False
+                })
+
+                # Users cannot be removed from default group
+                self.assertEqual(upsert(**{
+                    'id': 'managed_user_1',
+                    'groups': 'managed_group_0',
+                }), {
+                    'success': False,
+                    'message': 'Target group is default group of user.',
+                    'changed': False
+                })
+                groups.invalidate()
+                self.assertEqual(
+                    users['managed_user_1'].model.group_ids,
+                    ['managed_group_1']
+                )
+
+                # Roles cannot be granted
+                self.assertEqual(upsert(**{
+                    'id': 'managed_user_1',
+                    'attr.fullname': 'Managed User 1',
+                    'groups': 'managed_group_0,managed_group_1',
+                    'roles': 'manager',
+                }), {
+                    'success': True,
+                    'message': (
+                        "Changing roles denied. "
+                        "Updated user with ID 'managed_user_1'."
+                    ),
+                    'changed': True
+                })
+                users.invalidate()
+                groups.invalidate()
+                user = users['managed_user_1']
+                self.assertEqual(user.attrs['fullname'], 'Managed User 1')
+                self.assertEqual(
+                    sorted(user.model.group_ids),
+                    ['managed_group_0', 'managed_group_1']
+                )
+                self.assertEqual(user.model.roles, [])
+        finally:
+            settings.attrs.users_local_management_enabled = 'False'
+            settings()
+
+    @testing.principals(
+        users={
+            'viewer': {},
+            'manager': {},
+            'user_1': {}
+        },
+        groups={
+            'group_1': {},
+        },
+        roles={
+            'viewer': ['viewer'],
+            'manager': ['manager'],
+        })
+    def test_add_users(self):
+        root = get_root()
+        users = root['users']
+
+        def add_users(body, content_type='application/x-ndjson', **params):
+            request = self.layer.new_request()
+            request.content_type = content_type
+            request.body_file = BytesIO(body)
+            request.params.update(params)
+            with self.layer.authenticated('manager'):
+                res = render_view_to_response(
+                    users,
+                    request,
+                    name='remote_add_users'
+                )
+            self.assertEqual(res.content_type, 'application/x-ndjson')
+            return [json.loads(line) for line in res.app_iter]
+
+        request = self.layer.new_request()
+        with self.layer.authenticated('viewer'):
+            self.expectError(
+                HTTPForbidden,
+                render_view_to_response,
+                users,
+                request,
+                name='remote_add_users'
+            )
+
+        # NDJSON stream
+        body = b'\n'.join([
+            json.dumps({
+                'id': 'user_2',
+                'password': 'secret',
+                'roles': ['editor', 'inexistent'],
+                'groups': 'group_1',
+                'attr.fullname': 'User 2',
+            }).encode('utf-8'),
+            b'',
+            json.dumps({'id': 'user_1'}).encode('utf-8'),
+            b'{invalid',
+            json.dumps({'id': 'user_3'}).encode('utf-8'),
+            json.dumps({'id': 'user_3'}).encode('utf-8'),
+        ])
+        self.assertEqual(add_users(body, batch_size='2'), [{
+            'row': 1,
+            'id': 'user_2',
+            'success': True,
+            'message': (
+                "Role 'inexistent' given but inexistent. "
+                "Created user with ID 'user_2'."
+            )
+        }, {
+            'row': 2,
+            'id': 'user_1',
+            'success': False,
+            'message': 'User with given ID already exists.'
+        }, {
+            'row': 3,
+            'id': None,
+            'success': False,
+            'message': 'Invalid row.'
+        }, {
+            'row': 4,
+            'id': 'user_3',
+            'success': True,
+            'message': "Created user with ID 'user_3'."
+        }, {
+            'row': 5,
+            'id': 'user_3',
+            'success': False,
+            'message': 'User with given ID already exists.'
+        }])
+
+        user = users['user_2']
+        self.assertEqual(user.attrs['fullname'], 'User 2')
+        self.assertEqual(user.model.roles, ['editor'])
+        self.assertEqual(user.model.group_ids, ['group_1'])
+        self.assertTrue(user.model.authenticate('secret'))
+        self.assertTrue('user_3' in users)
+
+        # CSV stream
+        body = b'\n'.join([
+            b'id,password,groups,attr.fullname',
+            b'user_4,,group_1,User 4',
+            b'user_5,secret,,"Five, User"',
+            b',,,',
+        ])
+        self.assertEqual(add_users(body, content_type='text/csv'), [{
+            'row': 1,
+            'id': 'user_4',
+            'success': True,
+            'message': "Created user with ID 'user_4'."
+        }, {
+            'row': 2,
+            'id': 'user_5',
+            'success': True,
+            'message': "Created user with ID 'user_5'."
+        }, {
+            'row': 3,
+            'id': None,
+            'success': False,
+            'message': 'No user ID given.'
+        }])
+        self.assertEqual(users['user_4'].model.group_ids, ['group_1'])
+        self.assertEqual(users['user_5'].attrs['fullname'], 'Five, User')
+        self.assertTrue(users['user_5'].model.authenticate('secret'))
+
+        # Rows with invalid value types are reported as failed
+        body = b'\n'.join([json.dumps(row).encode('utf-8') for row in [
+            {'id': ['user_6']},
+            {'id': 'user_6', 'roles': 5},
+            {'id': 'user_6', 'groups': {}},
+            {'id': 'user_6', 'groups': ['group_1', 1]},
+            {'id': 'user_6', 'password': 1},
+            {'id': 'user_6', 'attr.fullname': {'first': 'User'}},
+            {'id': 'user_6'},
+        ]])
+        self.assertEqual(
+            [(res['success'], res['message']) for res in add_users(body)],
+            [
+                (False, 'Invalid user ID.'),
+                (False, "Invalid value for 'roles'."),
+                (False, "Invalid value for 'groups'."),
+                (False, "Invalid value for 'groups'."),
+                (False, 'Invalid password.'),
+                (False, "Invalid value for 'attr.fullname'."),
+                (True, "Created user with ID 'user_6'."),
+            ]
+        )
+        self.assertTrue('user_6' in users)
+
+        # Pending rows get persisted if reading the stream fails
+        body = b'\n'.join([
+            b'id,attr.fullname',
+            b'user_7,User 7',
+            b'user_8,User \xff',
+        ])
+        self.assertEqual(
+            [(res['row'], res['success']) for res in add_users(
+                body,
+                content_type='text/csv'
+            )],
+            [(1, True), (2, False)]
+        )
+        users.invalidate()
+        self.assertEqual(users['user_7'].attrs['fullname'], 'User 7')
+        self.assertFalse('user_8' in users)
+
     @testing.principals(
         users={
             'viewer': {},
@@ -182,3 +549,805 @@ class TestBrowserRemote(TileTestCase):
             'message': "Deleted user with ID 'user_1\'.",
             'success': True
         })
+
+    @testing.principals(
+        users={
+            'viewer': {},
+            'editor': {},
+            'user_1': {},
+            'user_2': {},
+        },
+        groups={
+            'group_1': {},
+            'group_2': {},
+        },
+        membership={
+            'group_2': ['user_1'],
+        },
+        roles={
+            'viewer': ['viewer'],
+            'editor': ['editor'],
+        })
+    def test_membership(self):
+        root = get_root()
+        users = root['users']
+        groups = root['groups']
+
+        request = self.layer.new_request(type='json')
+        with self.layer.authenticated('viewer'):
+            self.expectError(
+                HTTPForbidden,
+                render_view_to_response,
+                users,
+                request,
+                name='remote_membership'
+            )
+
+        # Invalid request body
+        request.json_body = {}
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_membership'
+            )
+        self.assertEqual(json.loads(res.text), {
+            'message': 'Expected list of memberships as request body.',
+            'success': False
+        })
+
+        # Memberships get validated, applied and persisted at once
+        request.json_body = [
+            ['user_1', 'group_1', 'add'],
+            ['user_2', 'group_1', 'add'],
+            ['user_1', 'group_2', 'remove'],
+            ['user_2', 'group_2', 'remove'],
+            ['user_1', 'group_1', 'add'],
+            ['user_3', 'group_1', 'add'],
+            ['user_1', 'group_3', 'add'],
+            ['user_1', 'group_1', 'invalid'],
+            ['user_1'],
+            [['user_1'], 'group_1', 'add'],
+            ['user_1', {'id': 'group_1'}, 'remove'],
+        ]
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                groups,
+                request,
+                name='remote_membership'
+            )
+        res = json.loads(res.text)
+        self.assertFalse(res['success'])
+        self.assertEqual(res['message'], '6 of 11 membership changes failed.')
+        self.assertEqual(
+            [(it['success'], it['message']) for it in res['results']],
+            [
+                (True, "Added user 'user_1' to group 'group_1'."),
+                (True, "Added user 'user_2' to group 'group_1'."),
+                (True, "Removed user 'user_1' from group 'group_2'."),
+                (True, "User 'user_2' is no member of group 'group_2'."),
+                (True, "User 'user_1' already member of group 'group_1'."),
+                (False, "User 'user_3' not exists."),
+                (False, "Group 'group_3' not exists."),
+                (False, "Invalid action 'invalid'."),
+                (False, "Invalid membership item."),
+                (False, "Invalid membership item."),
+                (False, "Invalid membership item."),
+            ]
+        )
+        self.assertEqual(res['results'][0], {
+            'user': 'user_1',
+            'group': 'group_1',
+            'action': 'add',
+            'success': True,
+            'message': "Added user 'user_1' to group 'group_1'."
+        })
+
+        groups.invalidate()
+        self.assertEqual(
+            sorted(groups['group_1'].model.member_ids),
+            ['user_1', 'user_2']
+        )
+        self.assertEqual(groups['group_2'].model.member_ids, [])
+        self.assertEqual(users['user_1'].model.group_ids, ['group_1'])
+
+        # All succeeded
+        request.json_body = [
+            ['user_1', 'group_1', 'remove'],
+            ['user_2', 'group_2', 'add'],
+        ]
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_membership'
+            )
+        res = json.loads(res.text)
+        self.assertTrue(res['success'])
+        self.assertEqual(res['message'], 'Applied 2 membership changes.')
+        self.assertEqual(groups['group_1'].model.member_ids, ['user_2'])
+        self.assertEqual(groups['group_2'].model.member_ids, ['user_2'])
+
+    @testing.principals(
+        users={
+            'viewer': {},
+            'manager': {},
+            'user_1': {},
+            'user_2': {},
+            'user_3': {},
+        },
+        groups={
+            'group_1': {},
+            'group_2': {},
+        },
+        membership={
+            'group_1': ['user_1', 'user_2', 'user_3'],
+            'group_2': ['user_1', 'manager'],
+        },
+        roles={
+            'viewer': ['viewer'],
+            'manager': ['manager'],
+            'user_1': ['editor'],
+        })
+    def test_delete_users(self):
+        root = get_root()
+        users = root['users']
+        groups = root['groups']
+
+        request = self.layer.new_request(type='json')
+        with self.layer.authenticated('viewer'):
+            self.expectError(
+                HTTPForbidden,
+                render_view_to_response,
+                users,
+                request,
+                name='remote_delete_users'
+            )
+
+        # Invalid request body
+        request.json_body = {}
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_delete_users'
+            )
+        self.assertEqual(json.loads(res.text), {
+            'message': 'Expected list of user ids as request body.',
+            'success': False
+        })
+
+        # Delete users and their memberships at once
+        request.json_body = ['user_1', 'user_2', 'user_1', 'inexistent', '']
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_delete_users'
+            )
+        self.assertEqual(json.loads(res.text), {
+            'message': '3 of 5 users could not be deleted.',
+            'success': False,
+            'results': [{
+                'id': 'user_1',
+                'message': "Deleted user with ID 'user_1'.",
+                'success': True
+            }, {
+                'id': 'user_2',
+                'message': "Deleted user with ID 'user_2'.",
+                'success': True
+            }, {
+                'id': 'user_1',
+                'message': 'User ID given multiple times.',
+                'success': False
+            }, {
+                'id': 'inexistent',
+                'message': 'User with given ID not exists.',
+                'success': False
+            }, {
+                'id': '',
+                'message': 'Invalid user ID.',
+                'success': False
+            }]
+        })
+        self.assertEqual(
+            sorted(users.keys()),
+            ['manager', 'user_3', 'viewer']
+        )
+        self.assertEqual(groups['group_1'].model.member_ids, ['user_3'])
+        self.assertEqual(groups['group_2'].model.member_ids, ['manager'])
+
+        # Changes are persisted
+        users.invalidate()
+        groups.invalidate()
+        self.assertFalse('user_1' in users)
+        self.assertEqual(groups['group_1'].model.member_ids, ['user_3'])
+
+        # Users without memberships
+        request.json_body = ['viewer']
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_delete_users'
+            )
+        self.assertEqual(json.loads(res.text)['message'], 'Deleted 1 users.')
+        self.assertEqual(sorted(users.keys()), ['manager', 'user_3'])
+
+    @testing.principals(
+        users={
+            'viewer': {},
+            'editor': {},
+            'user_1': {'fullname': 'User 1', 'email': 'user_1@example.com'},
+            'user_2': {'fullname': 'User, 2'},
+        },
+        groups={
+            'group_1': {'groupname': 'Group 1'},
+            'group_2': {},
+        },
+        membership={
+            'group_1': ['user_1', 'user_2'],
+            'group_2': ['user_1'],
+        },
+        roles={
+            'viewer': ['viewer'],
+            'editor': ['editor'],
+            'user_1': ['editor'],
+        })
+    def test_export_users(self):
+        users = get_root()['users']
+
+        request = self.layer.new_request()
+        with self.layer.authenticated('viewer'):
+            self.expectError(
+                HTTPForbidden,
+                render_view_to_response,
+                users,
+                request,
+                name='remote_export_users'
+            )
+
+        # NDJSON export with listing columns by default
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_export_users'
+            )
+        self.assertEqual(res.content_type, 'application/x-ndjson')
+        rows = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual([row['id'] for row in rows], [
+            'editor', 'user_1', 'user_2', 'viewer'
+        ])
+        self.assertEqual(rows[1], {
+            'id': 'user_1',
+            'attr.email': 'user_1@example.com',
+            'groups': ['group_1', 'group_2'],
+            'roles': ['editor']
+        })
+        self.assertEqual(rows[2]['groups'], ['group_1'])
+        self.assertEqual(rows[2]['roles'], [])
+
+        # Attribute projection, unknown attributes are ignored
+        request = self.layer.new_request()
+        request.params['attrs'] = 'fullname,password,email'
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_export_users'
+            )
+        rows = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual(sorted(rows[1].keys()), [
+            'attr.email', 'attr.fullname', 'groups', 'id', 'roles'
+        ])
+
+        # CSV export
+        request = self.layer.new_request()
+        request.params['attrs'] = 'fullname'
+        request.params['format'] = 'csv'
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_export_users'
+            )
+        self.assertEqual(res.content_type, 'text/csv')
+        self.assertEqual(res.body.decode('utf-8').splitlines(), [
+            'id,attr.fullname,groups,roles',
+            'editor,,,editor',
+            'user_1,User 1,"group_1,group_2",editor',
+            'user_2,"User, 2",group_1,',
+            'viewer,,,viewer'
+        ])
+
+        # Principal nodes get invalidated on backend after each chunk
+        invalidated = list()
+        backend = users.backend
+        invalidate = backend.invalidate
+
+        def recording_invalidate(key=None):
+            invalidated.append(key)
+            return invalidate(key)
+
+        chunk_size = remote.EXPORT_CHUNK_SIZE
+        remote.EXPORT_CHUNK_SIZE = 3
+        backend.invalidate = recording_invalidate
+        try:
+            request = self.layer.new_request()
+            with self.layer.authenticated('editor'):
+                res = render_view_to_response(
+                    users,
+                    request,
+                    name='remote_export_users'
+                )
+            lines = res.app_iter
+            self.assertEqual(json.loads(next(lines))['id'], 'editor')
+            self.assertEqual(invalidated, [])
+            rows = [json.loads(line) for line in lines]
+        finally:
+            remote.EXPORT_CHUNK_SIZE = chunk_size
+            del backend.invalidate
+        self.assertEqual([row['id'] for row in rows], [
+            'user_1', 'user_2', 'viewer'
+        ])
+        self.assertEqual(rows[0]['groups'], ['group_1', 'group_2'])
+        self.assertEqual(invalidated, [
+            'editor', 'user_1', 'user_2', 'viewer'
+        ])
+
+    @testing.principals(
+        users={
+            'editor': {},
+            'user_1': {},
+            'user_2': {},
+        },
+        groups={
+            'group_1': {'groupname': 'Group 1'},
+            'group_2': {},
+        },
+        membership={
+            'group_1': ['user_1', 'user_2'],
+        },
+        roles={
+            'editor': ['editor'],
+        })
+    def test_export_groups(self):
+        groups = get_root()['groups']
+        groups['group_2'].model.add_role('editor')
+        groups.backend.parent()
+
+        request = self.layer.new_request()
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                groups,
+                request,
+                name='remote_export_groups'
+            )
+        rows = [json.loads(line) for line in res.body.splitlines()]
+        self.assertEqual(rows, [{
+            'id': 'group_1',
+            'attr.groupname': 'Group 1',
+            'members': ['user_1', 'user_2'],
+            'roles': []
+        }, {
+            'id': 'group_2',
+            'attr.groupname': '',
+            'members': [],
+            'roles': ['editor']
+        }])
+
+        request = self.layer.new_request()
+        request.params['format'] = 'csv'
+        with self.layer.authenticated('editor'):
+            res = render_view_to_response(
+                groups,
+                request,
+                name='remote_export_groups'
+            )
+        self.assertEqual(res.body.decode('utf-8').splitlines(), [
+            'id,attr.groupname,members,roles',
+            'group_1,Group 1,"user_1,user_2",',
+            'group_2,,,editor'
+        ])
+
+    @testing.principals(
+        users={
+            'local_manager_1': {},
+            'managed_user_1': {},
+            'managed_user_2': {},
+        },
+        groups={
+            'admin_group_1': {},
+            'managed_group_0': {},
+            'managed_group_1': {},
+            'managed_group_2': {},
+        },
+        membership={
+            'admin_group_1': ['local_manager_1'],
+            'managed_group_1': ['managed_user_1'],
+        },
+        roles={
+            'local_manager_1': ['editor'],
+        })
+    def test_export_local_manager(self):
+        root = get_root()
+        settings = general_settings(root)
+        settings.attrs.users_local_management_enabled = 'True'
+        settings()
+        try:
+            with self.layer.authenticated('local_manager_1'):
+                res = render_view_to_response(
+                    root['users'],
+                    self.layer.new_request(),
+                    name='remote_export_users'
+                )
+                rows = [json.loads(line) for line in res.body.splitlines()]
+                self.assertEqual(
+                    [row['id'] for row in rows],
+                    ['managed_user_1']
+                )
+                res = render_view_to_response(
+                    root['groups'],
+                    self.layer.new_request(),
+                    name='remote_export_groups'
+                )
+                rows = [json.loads(line) for line in res.body.splitlines()]
+                self.assertEqual(
+                    [row['id'] for row in rows],
+                    ['managed_group_0', 'managed_group_1']
+                )
+        finally:
+            settings.attrs.users_local_management_enabled = 'False'
+            settings()
+
+    @testing.principals(
+        users={
+            'manager': {},
+            'user_1': {'fullname': 'User 1', 'email': 'user_1@example.com'},
+            'user_2': {'fullname': 'User 2'},
+        },
+        groups={
+            'group_1': {},
+            'group_2': {},
+        },
+        membership={
+            'group_1': ['user_1', 'user_2'],
+        },
+        roles={
+            'manager': ['manager'],
+            'user_1': ['editor'],
+        })
+    def test_sync_users(self):
+        root = get_root()
+        users = root['users']
+        groups = root['groups']
+
+        request = self.layer.new_request(type='json')
+        request.json_body = []
+        with self.layer.authenticated('user_1'):
+            self.expectError(
+                HTTPForbidden,
+                render_view_to_response,
+                users,
+                request,
+                name='remote_sync_users'
+            )
+
+        # Invalid request body
+        request.json_body = {}
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_sync_users'
+            )
+        self.assertEqual(json.loads(res.text), {
+            'message': 'Expected list of users as request body.',
+            'success': False
+        })
+
+        # Dry run reports changes without applying them
+        desired = [{
+            'id': 'user_1',
+            'attr.fullname': 'User 1',
+            'attr.email': '',
+            'groups': ['group_2'],
+            'roles': ['editor', 'admin'],
+        }, {
+            'id': 'user_2',
+            'attr.fullname': 'User 2',
+            'attr.password': 'secret',
+            'groups': 'group_1,inexistent',
+        }, {
+            'id': 'inexistent',
+        }, {
+            'id': 'user_1',
+        }]
+        request = self.layer.new_request(type='json')
+        request.params['dry_run'] = '1'
+        request.json_body = desired
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_sync_users'
+            )
+        self.assertEqual(json.loads(res.text), {
+            'success': False,
+            'message': '2 of 4 users could not be synchronized.',
+            'dry_run': True,
+            'results': [{
+                'id': 'user_1',
+                'success': True,
+                'changed': True,
+                'changes': {
+                    'attrs': {'email': ''},
+                    'add_groups': ['group_2'],
+                    'remove_groups': ['group_1'],
+                    'add_roles': ['admin']
+                },
+                'message': "Synchronized user with ID 'user_1'."
+            }, {
+                'id': 'user_2',
+                'success': True,
+                'changed': False,
+                'changes': {},
+                'message': (
+                    "Attribute 'password' given but not allowed. "
+                    "Group 'inexistent' given but inexistent. "
+                    "User with ID 'user_2' unchanged."
+                )
+            }, {
+                'id': 'inexistent',
+                'success': False,
+                'changed': False,
+                'message': 'User with given ID not exists.'
+            }, {
+                'id': 'user_1',
+                'success': False,
+                'changed': False,
+                'message': 'User ID given multiple times.'
+            }]
+        })
+        self.assertFalse(UNIT_OF_WORK_KEY in request.environ)
+        user = users['user_1'].model
+        self.assertEqual(user.attrs['email'], 'user_1@example.com')
+        self.assertEqual(user.roles, ['editor'])
+
+        # Apply changes
+        request = self.layer.new_request(type='json')
+        request.json_body = desired[:2]
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_sync_users'
+            )
+        res = json.loads(res.text)
+        self.assertEqual(res['message'], '1 of 2 users changed.')
+        self.assertFalse(res['dry_run'])
+
+        users.invalidate()
+        groups.invalidate()
+        user = users['user_1'].model
+        self.assertFalse('email' in user.attrs)
+        self.assertEqual(user.attrs['fullname'], 'User 1')
+        self.assertEqual(sorted(user.roles), ['admin', 'editor'])
+        self.assertEqual(groups['group_1'].model.member_ids, ['user_2'])
+        self.assertEqual(groups['group_2'].model.member_ids, ['user_1'])
+
+        # Nothing changed, nothing gets written
+        request = self.layer.new_request(type='json')
+        request.json_body = desired[:2]
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_sync_users'
+            )
+        res = json.loads(res.text)
+        self.assertEqual(res['message'], '0 of 2 users changed.')
+        self.assertTrue(res['success'])
+        self.assertFalse(UNIT_OF_WORK_KEY in request.environ)
+
+        # Invalid value types fail per row
+        request = self.layer.new_request(type='json')
+        request.json_body = [
+            {'id': 'user_1', 'groups': 5},
+            {'id': 'user_2', 'attr.fullname': {}},
+        ]
+        with self.layer.authenticated('manager'):
+            res = render_view_to_response(
+                users,
+                request,
+                name='remote_sync_users'
+            )
+        res = json.loads(res.text)
+        self.assertEqual(
+            res['message'],
+            '2 of 2 users could not be synchronized.'
+        )
+        self.assertEqual(
+            [result['message'] for result in res['results']],
+            [
+                "Invalid value for 'groups'.",
+                "Invalid value for 'attr.fullname'."
+            ]
+        )
+
+        # Lookup by ID and projected search over all users read same state
+        user_ids = ['user_1', 'user_2', 'inexistent']
+        attrs = ['fullname', 'email']
+        states = remote.read_user_states(users, user_ids, attrs)
+        self.assertEqual(states, {
+            'user_1': {
+                'attrs': {'fullname': 'User 1'},
+                'groups': {'group_2'},
+                'roles': {'admin', 'editor'}
+            },
+            'user_2': {
+                'attrs': {'fullname': 'User 2'},
+                'groups': {'group_1'},
+                'roles': set()
+            }
+        })
+        limit = remote.READ_STATES_LOOKUP_LIMIT
+        remote.READ_STATES_LOOKUP_LIMIT = 0
+        try:
+            self.assertEqual(
+                remote.read_user_states(users, user_ids, attrs),
+                states
+            )
+        finally:
+            remote.READ_STATES_LOOKUP_LIMIT = limit
+
+    @testing.principals(
+        users=dict([
+            ('user_{}'.format(i), {
+                'fullname': 'User {}'.format(i),
+                'email': 'user_{}@example.com'.format(i)
+            }) for i in range(1, 11)
+        ] + [('viewer', {}), ('editor', {})]),
+        groups={
+            'group_1': {'groupname': 'Group 1'},
+            'group_2': {'groupname': 'Group 2'},
+        },
+        roles={
+            'viewer': ['viewer'],
+            'editor': ['editor'],
+        })
+    def test_search(self):
+        root = get_root()
+        users = root['users']
+        groups = root['groups']
+
+        def search(model, **params):
+            request = self.layer.new_request(type='json')
+            request.params.update(params)
+            res = render_view_to_response(
+                model,
+                request,
+                name='remote_search'
+            )
+            return json.loads(res.text)
+
+        with self.layer.authenticated('viewer'):
+            self.expectError(
+                HTTPForbidden,
+                render_view_to_response,
+                users,
+                self.layer.new_request(type='json'),
+                name='remote_search'
+            )
+
+        with self.layer.authenticated('editor'):
+            # Listing columns by default
+            res = search(users, limit='3')
+            self.assertEqual(res, {
+                'success': True,
+                'total': 12,
+                'results': [{
+                    'id': 'editor',
+                    'email': ''
+                }, {
+                    'id': 'user_1',
+                    'email': 'user_1@example.com'
+                }, {
+                    'id': 'user_2',
+                    'email': 'user_2@example.com'
+                }]
+            })
+
+            # Filter, projection, sorting and paging
+            res = search(
+                users,
+                filter='user_1*',
+                attrlist='fullname',
+                order='desc',
+                offset='1',
+                limit='5'
+            )
+            self.assertEqual(res, {
+                'success': True,
+                'total': 2,
+                'results': [{
+                    'id': 'user_1',
+                    'fullname': 'User 1'
+                }]
+            })
+
+            # Filter results are cached in listing search cache
+            cache = users.indexes.search_cache
+            self.assertTrue(('user_1*', ('id', 'email'), None) in cache)
+
+            res = search(users, sort='email', order='desc', limit='2')
+            self.assertEqual(
+                [it['id'] for it in res['results']],
+                ['user_10', 'user_9']
+            )
+
+            # Attributes are fetched by projected searches
+            queried = list()
+            backend = users.backend
+            backend_search = backend.search
+
+            def recording_search(**kw):
+                queried.append(kw)
+                return backend_search(**kw)
+
+            backend.search = recording_search
+            try:
+                res = search(users, attrlist='fullname', limit='2')
+            finally:
+                del backend.search
+            self.assertEqual(res['results'], [{
+                'id': 'editor',
+                'fullname': ''
+            }, {
+                'id': 'user_1',
+                'fullname': 'User 1'
+            }])
+            self.assertEqual(queried, [{
+                'criteria': {'id': 'editor'},
+                'attrlist': ['id', 'fullname']
+            }, {
+                'criteria': {'id': 'user_1'},
+                'attrlist': ['id', 'fullname']
+            }])
+
+            # Groups
+            res = search(groups, attrlist='id,groupname')
+            self.assertEqual(res, {
+                'success': True,
+                'total': 2,
+                'results': [{
+                    'id': 'group_1',
+                    'groupname': 'Group 1'
+                }, {
+                    'id': 'group_2',
+                    'groupname': 'Group 2'
+                }]
+            })
+
+            # Invalid parameters
+            self.assertEqual(search(users, attrlist='password'), {
+                'success': False,
+                'message': "Attribute 'password' not allowed."
+            })
+            self.assertEqual(search(users, sort='fullname'), {
+                'success': False,
+                'message': "Sorting by 'fullname' not allowed."
+            })
+            self.assertEqual(search(users, order='up'), {
+                'success': False,
+                'message': "Order must be 'asc' or 'desc'."
+            })
+            self.assertEqual(search(users, offset='-1'), {
+                'success': False,
+                'message': 'Offset and limit must be positive integers.'
+            })
+            self.assertEqual(search(users, limit='x'), {
+                'success': False,
+                'message': 'Offset and limit must be positive integers.'
+            })
@@ -48,10 +48,12 @@ class TestBrowserSettings(TileTestCase):
             'users_form_attrmap',
             'users_listing_columns',
             'users_listing_default_column',
+            'users_listing_search_index',
             'groups_heading',
             'groups_form_attrmap',
             'groups_listing_columns',
             'groups_listing_default_column',
+            'groups_listing_search_index',
             'roles_heading',
             'roles_principal_roles_enabled',
             'save'
@@ -2,7 +2,12 @@ from cone.app import get_root
 from cone.tile import render_tile
 from cone.tile.tests import TileTestCase
 from cone.ugm import testing
+from cone.ugm.browser.user import AllGroupsColumnListing
+from cone.ugm.browser.user import GroupsOfUserColumnListing
 from cone.ugm.model.user import User
+from cone.ugm.settings import PRINCIPAL_CHANGED
+from cone.ugm.settings import PRINCIPAL_USER
+from cone.ugm.settings import PrincipalChanges
 from pyramid.httpexceptions import HTTPForbidden
 from webob.exc import HTTPFound
 
@@ -159,6 +164,109 @@ class TestBrowserUser(TileTestCase):
         )
         self.assertTrue(res.find(expected) > -1)
 
+    @testing.principals(
+        users={
+            'manager': {},
+            'user_1': {}
+        },
+        groups=dict([
+            ('group_{}'.format(i), {'groupname': 'Group {}'.format(i)})
+            for i in range(1, 11)
+        ]),
+        membership={
+            'group_2': ['user_1'],
+            'group_10': ['user_1']
+        },
+        roles={
+            'manager': ['manager']
+        })
+    def test_GroupsListing(self):
+        user = get_root()['users']['user_1']
+
+        def groups_listing(factory, **params):
+            listing = factory()
+            listing.model = user
+            listing.request = self.layer.new_request()
+            listing.request.params.update(params)
+            return listing
+
+        with self.layer.authenticated('manager'):
+            # All groups, attributes are fetched for current batch page only
+            listing = groups_listing(AllGroupsColumnListing)
+            self.assertEqual(listing.related_ids, frozenset([
+                'group_2', 'group_10'
+            ]))
+            self.assertEqual(listing.item_count, 10)
+            self.assertEqual(listing.query_attrs(['group_1', 'inexistent']), {
+                'group_1': {'id': 'group_1', 'groupname': 'Group 1'}
+            })
+            items = listing.items
+            self.assertEqual(len(items), 8)
+            self.assertEqual(
+                [item.data['related'] for item in items[:3]],
+                [False, True, False]
+            )
+            self.assertTrue(items[0]['content'].find('Group 1') > -1)
+
+            listing = groups_listing(AllGroupsColumnListing, b_page='1')
+            self.assertEqual(
+                [item.key for item in listing.items],
+                ['group_9', 'group_10']
+            )
+
+            # Filter all groups
+            listing = groups_listing(AllGroupsColumnListing, filter='Group 1*')
+            self.assertEqual(listing.listing_keys, ['group_1', 'group_10'])
+
+            # Related groups only
+            listing = groups_listing(GroupsOfUserColumnListing)
+            self.assertEqual(listing.listing_keys, ['group_2', 'group_10'])
+            self.assertEqual(
+                [item.data['related'] for item in listing.items],
+                [True, True]
+            )
+
+            # Filter related groups by looking up related groups only
+            queried = list()
+            backend = user.root['groups'].backend
+            search = backend.search
+
+            def counting_search(**kw):
+                queried.append(kw)
+                return search(**kw)
+
+            backend.search = counting_search
+            try:
+                listing = groups_listing(
+                    GroupsOfUserColumnListing,
+                    filter='Group 1*'
+                )
+                self.assertEqual(listing.matching_keys, set(['group_10']))
+                self.assertEqual(sorted([
+                    kw['criteria']['id'] for kw in queried
+                ]), ['group_10', 'group_2'])
+                self.assertEqual(
+                    queried[0]['attrlist'],
+                    ['id', 'groupname']
+                )
+
+                # Filtering all groups is done with one projected search
+                # and cached for subsequent requests
+                del queried[:]
+                listing = groups_listing(
+                    AllGroupsColumnListing,
+                    filter='Group 2'
+                )
+                self.assertEqual(listing.matching_keys, set(['group_2']))
+                listing = groups_listing(
+                    AllGroupsColumnListing,
+                    filter='Group 2'
+                )
+                self.assertEqual(listing.matching_keys, set(['group_2']))
+                self.assertEqual(queried, [{'attrlist': ['id', 'groupname']}])
+            finally:
+                del backend.search
+
     @testing.principals(
         users={
             'manager': {}
@@ -248,3 +356,49 @@ class TestBrowserUser(TileTestCase):
 
         self.assertEqual(user.attrs['fullname'], 'Susi Musterfrau')
         self.assertEqual(user.attrs['email'], 'susi.musterfrau@example.com')
+
+    @testing.principals(
+        users={
+            'manager': {},
+            'user_1': {'fullname': 'Zed', 'email': 'zed@example.com'},
+            'user_2': {'fullname': 'Bob', 'email': 'bob@example.com'},
+        },
+        roles={
+            'manager': ['manager']
+        })
+    def test_edit_user_invalidates_indexes(self):
+        root = get_root()
+        users = root['users']
+        backend = users.backend
+        sort_index = users.indexes.sort_index('email')
+        search_index = users.indexes.search_index(['id', 'email'])
+        self.assertEqual(sort_index.range(backend), [
+            'manager', 'user_2', 'user_1'
+        ])
+        self.assertEqual(search_index.search(backend, 'zed*'), set([
+            'user_1'
+        ]))
+        users.indexes.search_cache.set('zed*', frozenset(['user_1']))
+
+        # other processes get notified about the change
+        other = PrincipalChanges()
+        other.check()
+
+        request = self.layer.new_request()
+        request.params['userform.password'] = '_NOCHANGE_'
+        request.params['userform.fullname'] = 'Zed'
+        request.params['userform.email'] = 'aaron@example.com'
+        request.params['userform.principal_roles'] = []
+        request.params['action.userform.save'] = '1'
+        with self.layer.authenticated('manager'):
+            render_tile(users['user_1'], request, 'edit')
+
+        self.assertEqual(sort_index.range(backend), [
+            'manager', 'user_1', 'user_2'
+        ])
+        self.assertEqual(search_index.search(backend, 'zed*'), set())
+        self.assertEqual(len(users.indexes.search_cache), 0)
+        self.assertEqual(other.check(), (
+            [(PRINCIPAL_USER, PRINCIPAL_CHANGED, 'user_1')],
+            True
+        ))
@@ -0,0 +1,44 @@
+from cone.ugm.cache import LRUCache
+import unittest
+
+
+class TestCache(unittest.TestCase):
+
+    def test_LRUCache(self):
+        cache = LRUCache(maxsize=2)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue('a' in cache)
+
+        # Access marks entry as most recently used
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('b' in cache)
+        self.assertTrue('a' in cache)
+        self.assertTrue('c' in cache)
+
+        # Lookup counts hits and misses
+        created = list()
+
+        def factory():
+            created.append('d')
+            return 4
+
+        self.assertEqual(cache.lookup('d', factory), 4)
+        self.assertEqual(cache.lookup('d', factory), 4)
+        self.assertEqual(created, ['d'])
+        self.assertEqual(cache.stats, {
+            'hits': 1,
+            'misses': 1,
+            'size': 2,
+            'maxsize': 2
+        })
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,205 @@
+from cone.app import get_root
+from cone.ugm import testing
+from cone.ugm.index import attr_value
+from cone.ugm.index import groups_indexes
+from cone.ugm.index import normalize
+from cone.ugm.index import PrincipalIndexes
+from cone.ugm.index import SearchIndex
+from cone.ugm.index import SortIndex
+from cone.ugm.index import users_indexes
+from cone.ugm.index import WildcardFilter
+from node.tests import NodeTestCase
+
+
+class TestIndex(NodeTestCase):
+    layer = testing.ugm_layer
+
+    def test_attr_value(self):
+        self.assertEqual(attr_value({}, 'a'), '')
+        self.assertEqual(attr_value({'a': None}, 'a'), '')
+        self.assertEqual(attr_value({'a': 'a'}, 'a'), 'a')
+        self.assertEqual(attr_value({'a': ['a', 'b']}, 'a'), 'a')
+
+    def test_normalize(self):
+        self.assertEqual(normalize(u'AbC'), u'abc')
+
+    def test_WildcardFilter(self):
+        wf = WildcardFilter(u'*Example*')
+        self.assertEqual(wf.term, u'*Example*')
+        self.assertTrue(wf.match_value(u'user@EXAMPLE.com'))
+        self.assertFalse(wf.match_value(u'user@exampl.com'))
+        self.assertFalse(wf.match_value(None))
+        self.assertFalse(wf.match_value(''))
+        self.assertFalse(wf.match_value(b'example'))
+
+        # Multi valued
+        self.assertTrue(wf.match_value([u'a', u'example']))
+        self.assertFalse(wf.match_value([u'a', u'b']))
+
+        # Any value matches
+        self.assertTrue(wf.match([u'a', None, [u'b', u'an example']]))
+        self.assertFalse(wf.match([u'a', None]))
+
+        # fnmatch syntax
+        wf = WildcardFilter(u'user_?')
+        self.assertTrue(wf.match_value(u'User_1'))
+        self.assertFalse(wf.match_value(u'user_10'))
+
+        # Batch evaluation
+        rows = [
+            ('a', [u'user_1', u'a@example.com']),
+            ('b', [u'user_10', u'b@example.com']),
+            ('c', [u'User_2', [u'c', u'c@example.com']]),
+        ]
+        self.assertEqual(wf.filter(rows), ['a', 'c'])
+
+    @testing.principals(
+        users={
+            'user_1': {'fullname': 'Ultra'},
+            'user_2': {'fullname': 'Beta'},
+            'user_10': {'fullname': 'alpha'},
+        })
+    def test_SortIndex(self):
+        users = get_root()['users'].backend
+
+        index = SortIndex('id')
+        self.assertEqual(index.count(users), 3)
+        self.assertEqual(index.range(users), ['user_1', 'user_2', 'user_10'])
+        self.assertEqual(index.range(users, 1, 2), ['user_2'])
+        self.assertEqual(
+            index.range(users, reverse=True),
+            ['user_10', 'user_2', 'user_1']
+        )
+        self.assertEqual(index.range(users, 0, 2, reverse=True), [
+            'user_10', 'user_2'
+        ])
+        self.assertEqual(index.range(users, 2, 8, reverse=True), ['user_1'])
+        self.assertEqual(
+            index.sort(users, set(['user_10', 'user_1', 'inexistent'])),
+            ['user_1', 'user_10']
+        )
+        self.assertEqual(
+            index.sort(users, set(['user_10', 'user_1']), reverse=True),
+            ['user_10', 'user_1']
+        )
+
+        # Case insensitive
+        index = SortIndex('fullname')
+        self.assertEqual(index.range(users), ['user_10', 'user_2', 'user_1'])
+
+        # Incremental update
+        users['user_1'].attrs['fullname'] = 'Aaron'
+        self.assertEqual(index.range(users), ['user_10', 'user_2', 'user_1'])
+        index.invalidate('user_1')
+        self.assertEqual(index.range(users), ['user_1', 'user_10', 'user_2'])
+
+        users.create('user_3', fullname='Charly')
+        index.invalidate('user_3')
+        self.assertEqual(index.range(users), [
+            'user_1', 'user_10', 'user_2', 'user_3'
+        ])
+
+        del users['user_2']
+        index.invalidate('user_2')
+        self.assertEqual(index.range(users), ['user_1', 'user_10', 'user_3'])
+
+        # Rebuild
+        index.invalidate()
+        self.assertEqual(index._entries, None)
+        self.assertEqual(index.count(users), 3)
+
+    @testing.principals(
+        users={
+            'user_1': {'fullname': 'Ultra', 'email': 'ultra@example.com'},
+            'user_2': {'fullname': 'Beta', 'email': 'beta@example.org'},
+            'user_10': {'fullname': 'alpha'},
+        })
+    def test_SearchIndex(self):
+        users = get_root()['users'].backend
+
+        index = SearchIndex(['id', 'fullname', 'email'])
+        self.assertEqual(index.count(users), 3)
+
+        # Wildcard semantics match those of UGM backends
+        self.assertEqual(
+            index.search(users, '*'),
+            set(['user_1', 'user_2', 'user_10'])
+        )
+        self.assertEqual(index.search(users, '**'), set())
+        self.assertEqual(index.search(users, 'beta'), set(['user_2']))
+        self.assertEqual(index.search(users, 'bet'), set())
+        self.assertEqual(index.search(users, 'user_1*'), set([
+            'user_1', 'user_10'
+        ]))
+        self.assertEqual(index.search(users, '*.org'), set(['user_2']))
+        self.assertEqual(index.search(users, '*example*'), set([
+            'user_1', 'user_2'
+        ]))
+        self.assertEqual(index.search(users, '*ph*'), set(['user_10']))
+        self.assertEqual(index.search(users, '*xyz*'), set())
+
+        # Case insensitive
+        self.assertEqual(index.search(users, '*ULTRA*'), set(['user_1']))
+
+        # Inner wildcards
+        self.assertEqual(index.search(users, 'u*@*.com'), set(['user_1']))
+
+        # Incremental update
+        users['user_1'].attrs['fullname'] = 'Aaron'
+        index.invalidate('user_1')
+        self.assertEqual(index.search(users, '*ultra*'), set(['user_1']))
+        self.assertEqual(index.search(users, 'aaron'), set(['user_1']))
+        self.assertEqual(index.search(users, 'ultra'), set())
+
+        users.create('user_3', fullname='Charly')
+        index.invalidate('user_3')
+        self.assertEqual(index.search(users, 'char*'), set(['user_3']))
+
+        del users['user_3']
+        index.invalidate('user_3')
+        self.assertEqual(index.search(users, 'char*'), set())
+        self.assertFalse('cha' in index._grams)
+
+        # Rebuild
+        index.invalidate()
+        self.assertEqual(index._values, None)
+        self.assertEqual(index.count(users), 3)
+
+    @testing.principals(
+        users={
+            'user_1': {},
+        },
+        groups={
+            'group_1': {},
+        })
+    def test_PrincipalIndexes(self):
+        indexes = PrincipalIndexes()
+        index = indexes.sort_index('id')
+        self.assertTrue(isinstance(index, SortIndex))
+        self.assertTrue(index is indexes.sort_index('id'))
+
+        users = get_root()['users'].backend
+        self.assertEqual(index.range(users), ['user_1'])
+        search_index = indexes.search_index(['id'])
+        self.assertTrue(isinstance(search_index, SearchIndex))
+        self.assertTrue(search_index is indexes.search_index(('id',)))
+        self.assertEqual(search_index.search(users, 'user*'), set(['user_1']))
+
+        indexes.invalidate('user_1')
+        self.assertEqual(index._pending, set(['user_1']))
+        self.assertEqual(search_index._pending, set(['user_1']))
+        indexes.invalidate()
+        self.assertFalse(index is indexes.sort_index('id'))
+        self.assertFalse(search_index is indexes.search_index(['id']))
+
+        # Application model nodes invalidate related indexes
+        root = get_root()
+        self.assertTrue(root['users'].indexes is users_indexes)
+        self.assertTrue(root['groups'].indexes is groups_indexes)
+
+        index = users_indexes.sort_index('id')
+        self.assertEqual(index.range(users), ['user_1'])
+        root['users'].invalidate('user_1')
+        self.assertEqual(index._pending, set(['user_1']))
+        root['users'].invalidate()
+        self.assertFalse(index is users_indexes.sort_index('id'))
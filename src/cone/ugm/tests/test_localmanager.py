@@ -2,7 +2,14 @@ from cone.app import get_root
 from cone.app.model import BaseNode
 from cone.ugm import testing
 from cone.ugm.localmanager import LocalManager
+from cone.ugm.localmanager import invalidate_local_manager_state
+from cone.ugm.localmanager import local_manager_index
+from cone.ugm.localmanager import local_manager_state
 from cone.ugm.localmanager import LocalManagerConfigAttributes
+from cone.ugm.localmanager import LocalManagerIndex
+from cone.ugm.localmanager import LocalManagerState
+from cone.ugm.settings import check_principal_changes
+from cone.ugm.settings import PrincipalChanges
 from node.tests import NodeTestCase
 from plumber import plumbing
 import os
@@ -54,6 +61,23 @@ class TestModelLocalmanager(NodeTestCase):
             ('foo', {'default': ['bar'], 'target': ['bar', 'baz']})
         ])
 
+        # Rules are compiled into forward and reverse indexes
+        self.assertEqual(config.target_gids('foo'), frozenset(['bar', 'baz']))
+        self.assertEqual(config.target_gids('inexistent'), frozenset())
+        self.assertEqual(config.default_gids('aaa'), frozenset(['ccc']))
+        self.assertEqual(config.default_gids('inexistent'), frozenset())
+        self.assertEqual(config.manager_gids('ccc'), frozenset(['aaa']))
+        self.assertEqual(config.manager_gids('inexistent'), frozenset())
+
+        # Indexes are rebuilt on save
+        config['xxx'] = {
+            'target': ['ccc'],
+            'default': [],
+        }
+        self.assertEqual(config.manager_gids('ccc'), frozenset(['aaa']))
+        config()
+        self.assertEqual(config.manager_gids('ccc'), frozenset(['aaa', 'xxx']))
+
     @testing.principals(
         users={
             'local_manager_1': {},
@@ -101,14 +125,14 @@ class TestModelLocalmanager(NodeTestCase):
         # management is enabled.
 
         # Unauthenticated
-        self.layer.new_request()
+        request = self.layer.new_request()
         self.assertEqual(lm_node.local_manager_target_gids, [])
-        self.assertEqual(lm_node.local_manager_target_uids, [])
+        self.assertEqual(lm_node.local_manager_target_uids, frozenset())
 
         # Authenticated, no local manager
         with self.layer.authenticated('inexistent'):
             self.assertEqual(lm_node.local_manager_target_gids, [])
-            self.assertEqual(lm_node.local_manager_target_uids, [])
+            self.assertEqual(lm_node.local_manager_target_uids, frozenset())
 
         # Authenticated, invalid local management group member
         groups = root['groups'].backend
@@ -145,7 +169,7 @@ class TestModelLocalmanager(NodeTestCase):
             )
             self.assertEqual(
                 lm_node.local_manager_target_uids,
-                ['managed_user_1']
+                frozenset(['managed_user_1'])
             )
 
         with self.layer.authenticated('local_manager_2'):
@@ -154,10 +178,46 @@ class TestModelLocalmanager(NodeTestCase):
                 ['managed_group_1', 'managed_group_2']
             )
             self.assertEqual(
-                sorted(lm_node.local_manager_target_uids),
-                ['managed_user_1', 'managed_user_2']
+                lm_node.local_manager_target_uids,
+                frozenset(['managed_user_1', 'managed_user_2'])
+            )
+
+        # Local manager state is resolved once per request and user
+        with self.layer.authenticated('local_manager_2'):
+            state = lm_node.local_manager_state
+            self.assertTrue(isinstance(state, LocalManagerState))
+            self.assertTrue(state is local_manager_state(root, request))
+            other = LocalManagerNode(name='other', parent=root)
+            self.assertTrue(state is other.local_manager_state)
+            self.assertEqual(state.gid, 'admin_group_2')
+            self.assertTrue(
+                state.target_uids is other.local_manager_target_uids
             )
 
+            # State is not updated within request unless invalidated
+            group = groups['managed_group_1']
+            group.add('local_manager_1')
+            group()
+            root['groups'].invalidate('managed_group_1')
+            self.assertEqual(
+                lm_node.local_manager_target_uids,
+                frozenset(['managed_user_1', 'managed_user_2'])
+            )
+            invalidate_local_manager_state(request)
+            self.assertFalse(state is lm_node.local_manager_state)
+            self.assertEqual(
+                lm_node.local_manager_target_uids,
+                frozenset([
+                    'local_manager_1', 'managed_user_1', 'managed_user_2'
+                ])
+            )
+            del group['local_manager_1']
+            group()
+            root['groups'].invalidate('managed_group_1')
+
+        with self.layer.authenticated('local_manager_1'):
+            self.assertFalse(state is lm_node.local_manager_state)
+
         # Check if group id is marked as default
         self.assertFalse(lm_node.local_manager_is_default(
             'admin_group_1',
@@ -192,6 +252,101 @@ class TestModelLocalmanager(NodeTestCase):
             'managed_group_2'
         ))
 
+    @testing.principals(
+        users={
+            'managed_user_1': {},
+            'managed_user_2': {}
+        },
+        groups={
+            'managed_group_0': {},
+            'managed_group_1': {},
+            'managed_group_2': {}
+        },
+        membership={
+            'managed_group_1': ['managed_user_1'],
+            'managed_group_2': ['managed_user_1', 'managed_user_2'],
+        })
+    def test_LocalManagerIndex(self):
+        groups = get_root()['groups'].backend
+        index = LocalManagerIndex()
+        managed = index.managed_uids(
+            groups,
+            'admin_group_1',
+            ['managed_group_0', 'managed_group_1']
+        )
+        self.assertEqual(managed, frozenset(['managed_user_1']))
+        self.assertTrue(managed is index.managed_uids(
+            groups,
+            'admin_group_1',
+            ['managed_group_1', 'managed_group_0']
+        ))
+        self.assertEqual(index.managed_uids(
+            groups,
+            'admin_group_2',
+            ['managed_group_1', 'managed_group_2', 'inexistent']
+        ), frozenset(['managed_user_1', 'managed_user_2']))
+        self.assertEqual(sorted(index._members), [
+            'inexistent', 'managed_group_0', 'managed_group_1',
+            'managed_group_2'
+        ])
+
+        # Invalidate group, drops managed uids of targeting local managers
+        groups['managed_group_0'].add('managed_user_2')
+        index.invalidate('managed_group_0')
+        self.assertEqual(sorted(index._members), [
+            'inexistent', 'managed_group_1', 'managed_group_2'
+        ])
+        self.assertEqual(list(index._managed), [
+            ('admin_group_2', (
+                'inexistent', 'managed_group_1', 'managed_group_2'
+            ))
+        ])
+        self.assertEqual(index.managed_uids(
+            groups,
+            'admin_group_1',
+            ['managed_group_0', 'managed_group_1']
+        ), frozenset(['managed_user_1', 'managed_user_2']))
+
+        # Invalidate all
+        index.invalidate()
+        self.assertEqual(index._members, {})
+        self.assertEqual(index._managed, {})
+
+        # Groups and users application nodes invalidate global index
+        local_manager_index.managed_uids(
+            groups,
+            'admin_group_1',
+            ['managed_group_1']
+        )
+        root = get_root()
+        root['groups'].invalidate('managed_group_1')
+        self.assertEqual(local_manager_index._managed, {})
+        local_manager_index.managed_uids(
+            groups,
+            'admin_group_1',
+            ['managed_group_1']
+        )
+        root['users'].invalidate()
+        self.assertEqual(local_manager_index._managed, {})
+
+        # Membership changes of other processes drop affected groups
+        check_principal_changes(None)
+        local_manager_index.managed_uids(
+            groups,
+            'admin_group_1',
+            ['managed_group_1']
+        )
+        PrincipalChanges().publish(groups=['managed_group_1'])
+        check_principal_changes(None)
+        self.assertEqual(local_manager_index._managed, {})
+
+        # Index expires after max age
+        index.managed_uids(groups, 'admin_group_1', ['managed_group_1'])
+        index.managed_uids(groups, 'admin_group_2', ['managed_group_2'])
+        index._created -= index.max_age + 1
+        index.managed_uids(groups, 'admin_group_1', ['managed_group_1'])
+        self.assertEqual(list(index._members), ['managed_group_1'])
+
     @testing.principals(
         users={
             'local_manager_1': {},
@@ -1,7 +1,32 @@
 from cone.app import get_root
 from cone.app.model import XMLProperties
+from cone.app.ugm import ugm_backend
 from cone.ugm import testing
+from cone.ugm.settings import ColumnMap
 from cone.ugm.settings import GeneralSettings
+from cone.ugm.settings import GeneralSettingsSnapshot
+from cone.ugm.settings import PRINCIPAL_CHANGED
+from cone.ugm.settings import PRINCIPAL_DELETED
+from cone.ugm.settings import PRINCIPAL_GROUP
+from cone.ugm.settings import PRINCIPAL_USER
+from cone.ugm.settings import PrincipalChanges
+from cone.ugm.settings import check_principal_changes
+from cone.ugm.settings import check_settings_generation
+from cone.ugm.settings import reload_flags
+from cone.ugm.settings import reload_principals
+from cone.ugm.settings import RELOAD_ALL
+from cone.ugm.settings import RELOAD_BACKEND
+from cone.ugm.settings import RELOAD_GROUPS
+from cone.ugm.settings import RELOAD_GROUPS_LISTING
+from cone.ugm.settings import RELOAD_SETTINGS
+from cone.ugm.settings import RELOAD_USERS
+from cone.ugm.settings import RELOAD_USERS_LISTING
+from cone.ugm.settings import reload_ugm
+from cone.ugm.settings import SettingsCache
+from cone.ugm.settings import SettingsGeneration
+from cone.ugm.settings import settings_generation
+from cone.ugm.settings import SettingsSnapshot
+from cone.ugm.settings import ugm_cfg
 from cone.ugm.settings import UGMSettings
 from node.tests import NodeTestCase
 import os
@@ -41,6 +66,410 @@ class TestModelSettings(NodeTestCase):
         settings.invalidate()
         self.assertFalse(attrs is settings.attrs)
 
+        # Settings are private to settings node instances
+        other = MyUGMSettings()
+        self.assertFalse(settings.attrs is other.attrs)
+
+        # Snapshot of persisted settings is shared
+        snapshot = settings.snapshot
+        self.assertTrue(isinstance(snapshot, SettingsSnapshot))
+        self.assertEqual(snapshot.foo, 'foo')
+        self.assertTrue(snapshot is settings.snapshot)
+        self.assertTrue(snapshot is other.snapshot)
+
+        # Unsaved changes are not visible
+        settings.attrs.foo = 'bar'
+        self.assertEqual(settings.snapshot.foo, 'foo')
+        self.assertEqual(other.attrs.foo, 'foo')
+
+        # Snapshot gets replaced once changes are written
+        settings()
+        self.assertFalse(snapshot is settings.snapshot)
+        self.assertEqual(other.snapshot.foo, 'bar')
+
+        # Invalidate drops unsaved changes
+        settings.attrs.foo = 'baz'
+        settings.invalidate()
+        self.assertEqual(settings.attrs.foo, 'bar')
+        self.assertEqual(settings.snapshot.foo, 'bar')
+
+    def test_SettingsSnapshot(self):
+        snapshot = SettingsSnapshot({'a': 'a', 'b': {'c': 'c'}})
+        self.assertEqual(snapshot.a, 'a')
+        self.assertEqual(snapshot.b, {'c': 'c'})
+        self.assertEqual(snapshot.inexistent, None)
+
+        def set_value():
+            snapshot.a = 'b'
+        err = self.expect_error(AttributeError, set_value)
+        self.assertEqual(str(err), 'Settings snapshot is immutable')
+
+        def del_value():
+            del snapshot.a
+        err = self.expect_error(AttributeError, del_value)
+        self.assertEqual(str(err), 'Settings snapshot is immutable')
+
+    def test_ColumnMap(self):
+        columns = ColumnMap([('id', 'ID'), ('mail', 'Mail')])
+        self.assertEqual(columns.keys(), ['id', 'mail'])
+        self.assertEqual(columns.values(), ['ID', 'Mail'])
+        self.assertEqual(columns.items(), [('id', 'ID'), ('mail', 'Mail')])
+        self.assertEqual(list(columns), ['id', 'mail'])
+        self.assertEqual(len(columns), 2)
+        self.assertTrue('id' in columns)
+        self.assertEqual(columns['mail'], 'Mail')
+        self.assertEqual(columns.get('inexistent', 'default'), 'default')
+        self.assertEqual(columns, {'id': 'ID', 'mail': 'Mail'})
+        self.assertEqual(columns, ColumnMap({'id': 'ID', 'mail': 'Mail'}))
+        self.assertNotEqual(columns, ColumnMap([('id', 'ID')]))
+
+        def set_value():
+            columns._data = {}
+        err = self.expect_error(AttributeError, set_value)
+        self.assertEqual(str(err), 'Column map is immutable')
+
+    def test_GeneralSettingsSnapshot(self):
+        snapshot = GeneralSettingsSnapshot({
+            'users_account_expiration': 'True',
+            'users_expires_unit': '1',
+            'users_exposed_attributes': ['a', 'b'],
+            'users_listing_columns': {'id': 'ID', 'mail': 'Mail'},
+            'users_portrait': 'False',
+            'users_portrait_width': 'invalid',
+            'user_id_autoincrement_prefix': 'uid',
+        })
+        self.assertIs(snapshot.users_account_expiration, True)
+        self.assertEqual(snapshot.users_expires_unit, 1)
+        self.assertEqual(snapshot.users_exposed_attributes, ('a', 'b'))
+        self.assertTrue(isinstance(snapshot.users_listing_columns, ColumnMap))
+        self.assertEqual(
+            snapshot.users_listing_columns.keys(),
+            ['id', 'mail']
+        )
+        self.assertIs(snapshot.users_portrait, False)
+        self.assertEqual(snapshot.user_id_autoincrement_prefix, 'uid')
+
+        # Defaults for missing or invalid values
+        self.assertEqual(snapshot.users_portrait_width, 50)
+        self.assertEqual(snapshot.users_expires_attr, 'shadowExpire')
+        self.assertIs(snapshot.roles_principal_roles_enabled, False)
+        self.assertEqual(snapshot.groups_listing_columns.keys(), ['id'])
+        self.assertEqual(snapshot.groups_form_attrmap.keys(), [])
+
+        # Only settings defined by schema are available
+        self.expect_error(AttributeError, lambda: snapshot.inexistent)
+
+        def set_value():
+            snapshot.users_portrait = True
+        err = self.expect_error(AttributeError, set_value)
+        self.assertEqual(str(err), 'Settings snapshot is immutable')
+
+    @testing.temp_directory
+    def test_SettingsCache(self, tempdir):
+        path = os.path.join(tempdir, 'settings.xml')
+        with open(path, 'w') as f:
+            f.write('<properties><foo>foo</foo></properties>')
+
+        cache = SettingsCache()
+        snapshot = cache.snapshot(path)
+        self.assertEqual(snapshot.foo, 'foo')
+        self.assertTrue(snapshot is cache.snapshot(path))
+
+        # Snapshots are cached per factory
+        class CustomSnapshot(SettingsSnapshot):
+            pass
+
+        custom = cache.snapshot(path, factory=CustomSnapshot)
+        self.assertTrue(isinstance(custom, CustomSnapshot))
+        self.assertTrue(custom is cache.snapshot(path, factory=CustomSnapshot))
+        self.assertTrue(snapshot is cache.snapshot(path))
+
+        # File is not checked for modification on access
+        with open(path, 'w') as f:
+            f.write('<properties><foo>foobar</foo></properties>')
+        self.assertTrue(snapshot is cache.snapshot(path))
+
+        # Snapshots get replaced by written properties
+        properties = XMLProperties(path)
+        self.assertEqual(properties.foo, 'foobar')
+        properties.foo = 'changed'
+        properties()
+        cache.written(path, properties)
+        self.assertEqual(cache.snapshot(path).foo, 'changed')
+
+        # Written properties are copied
+        properties.foo = 'unsaved'
+        cache.written(path, properties)
+        properties.foo = 'changed'
+        self.assertEqual(cache.snapshot(path).foo, 'unsaved')
+
+        # Invalidate
+        cache.invalidate(path)
+        snapshot = cache.snapshot(path)
+        self.assertEqual(snapshot.foo, 'changed')
+        cache.invalidate()
+        self.assertFalse(snapshot is cache.snapshot(path))
+
+    def test_reload_flags(self):
+        snapshot = GeneralSettingsSnapshot({})
+        self.assertEqual(snapshot.changes(GeneralSettingsSnapshot({})), [])
+        other = GeneralSettingsSnapshot({
+            'users_listing_default_column': 'email',
+            'users_form_attrmap': {'id': 'ID'},
+        })
+        self.assertEqual(snapshot.changes(other), [
+            'users_form_attrmap',
+            'users_listing_default_column'
+        ])
+
+        # Presentation only
+        self.assertEqual(reload_flags([]), RELOAD_SETTINGS)
+        self.assertEqual(
+            reload_flags(['users_listing_default_column', 'users_portrait']),
+            RELOAD_SETTINGS
+        )
+
+        # Affected parts
+        self.assertEqual(
+            reload_flags(snapshot.changes(other)),
+            RELOAD_USERS
+        )
+        self.assertEqual(
+            reload_flags(['groups_form_attrmap', 'users_listing_columns']),
+            RELOAD_GROUPS
+        )
+        self.assertEqual(
+            reload_flags([
+                'users_listing_search_index',
+                'groups_listing_search_index'
+            ]),
+            RELOAD_USERS_LISTING | RELOAD_GROUPS_LISTING
+        )
+
+        # Settings read by backend factories reinitialize the backend
+        for name in [
+            'users_account_expiration',
+            'users_expires_attr',
+            'users_expires_unit',
+            'users_exposed_attributes'
+        ]:
+            self.assertEqual(reload_flags([name]), RELOAD_BACKEND)
+
+        # Unknown settings reload everything
+        self.assertEqual(reload_flags(['inexistent']), RELOAD_ALL)
+
+    @testing.principals(
+        users={
+            'user_1': {},
+        },
+        groups={
+            'group_1': {},
+        })
+    def test_reload_ugm(self):
+        root = get_root()
+        ugm = ugm_backend.ugm
+        users_index = root['users'].indexes.sort_index('id')
+        groups_index = root['groups'].indexes.sort_index('id')
+        users_cache = root['users'].indexes.search_cache
+        groups_cache = root['groups'].indexes.search_cache
+        users_cache.set('key', 'value')
+        groups_cache.set('key', 'value')
+
+        # Presentation only changes keep caches and backend
+        reload_ugm(root, RELOAD_SETTINGS)
+        self.assertTrue(ugm is ugm_backend.ugm)
+        self.assertTrue(users_index is root['users'].indexes.sort_index('id'))
+        self.assertEqual(len(users_cache), 1)
+        self.assertEqual(len(groups_cache), 1)
+
+        # Listing search results only
+        reload_ugm(root, RELOAD_USERS_LISTING)
+        self.assertTrue(users_index is root['users'].indexes.sort_index('id'))
+        self.assertEqual(len(users_cache), 0)
+        self.assertEqual(len(groups_cache), 1)
+
+        # Affected principals container only
+        reload_ugm(root, RELOAD_USERS)
+        self.assertTrue(ugm is ugm_backend.ugm)
+        self.assertFalse(
+            users_index is root['users'].indexes.sort_index('id')
+        )
+        self.assertTrue(
+            groups_index is root['groups'].indexes.sort_index('id')
+        )
+
+        # Backend
+        reload_ugm(root)
+        self.assertFalse(ugm is ugm_backend.ugm)
+        self.assertFalse(
+            groups_index is root['groups'].indexes.sort_index('id')
+        )
+
+    @testing.temp_directory
+    def test_SettingsGeneration(self, tempdir):
+        generation_file = ugm_cfg.generation_file
+        try:
+            ugm_cfg.generation_file = ''
+            generation = SettingsGeneration()
+            self.assertEqual(generation.current(), None)
+            self.assertEqual(generation.bump(), None)
+            self.assertEqual(generation.check(), None)
+
+            path = os.path.join(tempdir, 'generation')
+            ugm_cfg.generation_file = path
+            self.assertEqual(generation.current(), 0)
+            self.assertTrue(os.path.exists(path))
+
+            # First check only remembers current generation
+            self.assertEqual(generation.check(), None)
+            self.assertEqual(generation.check(), None)
+
+            # Bumping process does not consider generation changed
+            self.assertEqual(generation.bump(RELOAD_USERS), 1)
+            self.assertEqual(generation.check(), None)
+
+            # Other processes share the counter and reload flags via the
+            # mapped file
+            other = SettingsGeneration()
+            self.assertEqual(other.current(), 1)
+            self.assertEqual(other.check(), None)
+            self.assertEqual(other.bump(RELOAD_SETTINGS), 2)
+            self.assertEqual(generation.current(), 2)
+            self.assertEqual(generation.check(), RELOAD_SETTINGS)
+            self.assertEqual(generation.check(), None)
+
+            # Flags of missed changes get combined
+            other.bump(RELOAD_USERS)
+            other.bump(RELOAD_GROUPS)
+            self.assertEqual(
+                generation.check(),
+                RELOAD_USERS | RELOAD_GROUPS
+            )
+
+            # Bumping after missed changes does not skip the reload
+            other.bump(RELOAD_USERS_LISTING)
+            self.assertEqual(generation.bump(RELOAD_SETTINGS), 6)
+            self.assertEqual(generation.check(), RELOAD_USERS_LISTING)
+
+            # Everything gets reloaded if missed changes are not contained
+            # in the log anymore
+            for i in range(generation.slots + 1):
+                other.bump(RELOAD_SETTINGS)
+            self.assertEqual(generation.check(), RELOAD_ALL)
+
+            # Changed generation file gets mapped
+            ugm_cfg.generation_file = os.path.join(tempdir, 'other')
+            self.assertEqual(generation.current(), 0)
+
+            # Generation file which cannot be created disables propagation
+            ugm_cfg.generation_file = os.path.join(tempdir, 'missing', 'gen')
+            self.assertEqual(generation.current(), None)
+            self.assertEqual(generation.bump(), None)
+            self.assertEqual(generation.check(), None)
+            self.assertEqual(
+                generation._failed_path,
+                os.path.join(tempdir, 'missing', 'gen')
+            )
+            check_settings_generation(None)
+
+            # Mapping is retried if the generation file changes
+            ugm_cfg.generation_file = os.path.join(tempdir, 'other')
+            self.assertEqual(generation.current(), 0)
+        finally:
+            ugm_cfg.generation_file = generation_file
+
+    @testing.temp_directory
+    def test_PrincipalChanges(self, tempdir):
+        changes_file = ugm_cfg.changes_file
+        try:
+            ugm_cfg.changes_file = os.path.join(tempdir, 'changes')
+            changes = PrincipalChanges()
+            self.assertEqual(changes.check(), None)
+            self.assertEqual(changes.publish(users=['user_1']), 1)
+            self.assertEqual(changes.check(), None)
+
+            # Other processes read changes by principal id
+            other = PrincipalChanges()
+            self.assertEqual(other.check(), None)
+            long_id = 'g' * (PrincipalChanges.id_size + 1)
+            self.assertEqual(other.publish(
+                users=[u'user_\xe4'],
+                groups=['group_1', long_id]
+            ), 4)
+            other.publish(groups=['group_2'], action=PRINCIPAL_DELETED)
+            self.assertEqual(changes.check(), ([
+                (PRINCIPAL_USER, PRINCIPAL_CHANGED, u'user_\xe4'),
+                (PRINCIPAL_GROUP, PRINCIPAL_CHANGED, 'group_1'),
+                (PRINCIPAL_GROUP, PRINCIPAL_CHANGED, None),
+                (PRINCIPAL_GROUP, PRINCIPAL_DELETED, 'group_2'),
+            ], True))
+
+            # Changes exceeding log size are reported incomplete
+            other.publish(users=[
+                'user_{}'.format(i) for i in range(changes.slots + 1)
+            ])
+            self.assertEqual(changes.check(), ([], False))
+        finally:
+            ugm_cfg.changes_file = changes_file
+
+    @testing.principals(
+        users={
+            'user_1': {'fullname': 'User 1'},
+            'user_2': {'fullname': 'User 2'},
+        },
+        groups={
+            'group_1': {},
+        })
+    def test_reload_principals(self):
+        root = get_root()
+        users = root['users']
+        backend = users.backend
+        sort_index = users.indexes.sort_index('id')
+        self.assertEqual(sort_index.range(backend), ['user_1', 'user_2'])
+        check_principal_changes(None)
+
+        # Changed principals get invalidated by id, indexes are kept
+        users.indexes.search_cache.set('key', 'value')
+        PrincipalChanges().publish(users=['user_1'])
+        check_principal_changes(None)
+        self.assertTrue(sort_index is users.indexes.sort_index('id'))
+        self.assertEqual(sort_index._pending, set(['user_1']))
+        self.assertEqual(len(users.indexes.search_cache), 0)
+        self.assertTrue(backend is users.backend)
+
+        # Added and deleted principals reload the backend container too
+        PrincipalChanges().publish(
+            users=['user_2'],
+            action=PRINCIPAL_DELETED
+        )
+        check_principal_changes(None)
+        self.assertTrue(sort_index is users.indexes.sort_index('id'))
+        self.assertFalse(backend is users.backend)
+
+        # Incomplete changes invalidate principal containers
+        reload_principals(root, [], complete=False)
+        self.assertFalse(sort_index is users.indexes.sort_index('id'))
+
+    def test_check_settings_generation(self):
+        # Remember current generation
+        check_settings_generation(None)
+        ugm = ugm_backend.ugm
+
+        # Nothing changed
+        check_settings_generation(None)
+        self.assertTrue(ugm is ugm_backend.ugm)
+
+        # Other process changed presentation settings
+        SettingsGeneration().bump(RELOAD_SETTINGS)
+        check_settings_generation(None)
+        self.assertTrue(ugm is ugm_backend.ugm)
+
+        # Other process changed settings affecting backend
+        SettingsGeneration().bump()
+        check_settings_generation(None)
+        self.assertFalse(ugm is ugm_backend.ugm)
+        self.assertEqual(settings_generation.check(), None)
+
     @testing.invalidate_settings
     def test_UGMGeneralSettings(self):
         settings = get_root()['settings']['ugm_general']
@@ -56,6 +485,7 @@ class TestModelSettings(NodeTestCase):
             'groups_form_attrmap',
             'groups_listing_columns',
             'groups_listing_default_column',
+            'groups_listing_search_index',
             'roles_principal_roles_enabled',
             'user_id_autoincrement',
             'user_id_autoincrement_prefix',
@@ -67,6 +497,7 @@ class TestModelSettings(NodeTestCase):
             'users_form_attrmap',
             'users_listing_columns',
             'users_listing_default_column',
+            'users_listing_search_index',
             'users_local_management_enabled',
             'users_login_name_attr',
             'users_portrait',
@@ -76,6 +507,19 @@ class TestModelSettings(NodeTestCase):
             'users_portrait_width',
         ])
 
+        # Typed snapshot covers all general settings
+        snapshot = settings.snapshot
+        self.assertTrue(isinstance(snapshot, GeneralSettingsSnapshot))
+        self.assertEqual(
+            sorted(snapshot.__slots__),
+            sorted(attrs.keys())
+        )
+        self.assertEqual(snapshot.users_portrait_width, 50)
+        self.assertEqual(
+            snapshot.users_listing_columns,
+            attrs.users_listing_columns
+        )
+
         self.assertTrue(attrs is settings.attrs)
         settings.invalidate()
         self.assertFalse(attrs is settings.attrs)
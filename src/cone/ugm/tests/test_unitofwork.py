@@ -0,0 +1,110 @@
+from cone.app import get_root
+from cone.app.ugm import ugm_backend
+from cone.ugm import testing
+from cone.ugm.localmanager import LOCAL_MANAGER_STATE_KEY
+from cone.ugm.unitofwork import UNIT_OF_WORK_KEY
+from cone.ugm.unitofwork import unit_of_work
+from cone.ugm.unitofwork import UnitOfWork
+from node.tests import NodeTestCase
+from pyramid.response import Response
+
+
+def persisted_member_ids(group_id):
+    # read persisted state with a fresh backend instance
+    return sorted(ugm_backend.factory().groups[group_id].member_ids)
+
+
+class TestUnitOfWork(NodeTestCase):
+    layer = testing.ugm_layer
+
+    @testing.principals(
+        users={
+            'user_1': {},
+            'user_2': {},
+        },
+        groups={
+            'group_1': {},
+            'group_2': {},
+        })
+    def test_UnitOfWork(self):
+        root = get_root()
+        request = self.layer.new_request()
+        uow = UnitOfWork(root, request)
+        self.assertFalse(uow.dirty)
+        uow.flush()
+
+        # Changes get recorded but not persisted
+        groups = root['groups'].backend
+        groups['group_1'].add('user_1')
+        uow.membership_changed('user_1', 'group_1')
+        groups['group_1'].add('user_2')
+        uow.membership_changed('user_2', 'group_1')
+        groups['group_2'].add('user_1')
+        uow.membership_changed('user_1', 'group_2')
+        self.assertTrue(uow.dirty)
+        self.assertEqual(uow.groups, set(['group_1', 'group_2']))
+        self.assertEqual(uow.members, set(['user_1', 'user_2']))
+        self.assertEqual(uow.users, set())
+        self.assertEqual(persisted_member_ids('group_1'), [])
+
+        # Flush persists all changes at once and invalidates caches
+        search_cache = root['users'].indexes.search_cache
+        search_cache.set('key', 'value')
+        request.environ[LOCAL_MANAGER_STATE_KEY] = {}
+        uow.flush()
+        self.assertFalse(uow.dirty)
+        self.assertEqual(
+            persisted_member_ids('group_1'),
+            ['user_1', 'user_2']
+        )
+        self.assertEqual(persisted_member_ids('group_2'), ['user_1'])
+        self.assertEqual(len(search_cache), 0)
+        self.assertFalse(LOCAL_MANAGER_STATE_KEY in request.environ)
+        self.assertEqual(
+            sorted(root['users']['user_1'].model.group_ids),
+            ['group_1', 'group_2']
+        )
+
+        # Changed users and groups
+        users = root['users'].backend
+        users['user_1'].attrs['fullname'] = 'User 1'
+        uow.user_changed('user_1')
+        groups['group_1'].attrs['title'] = 'Group 1'
+        uow.group_changed('group_1')
+        uow.flush()
+        fresh = ugm_backend.factory()
+        self.assertEqual(fresh.users['user_1'].attrs['fullname'], 'User 1')
+        self.assertEqual(fresh.groups['group_1'].attrs['title'], 'Group 1')
+
+        # Discard drops unpersisted changes
+        del groups['group_1']['user_2']
+        uow.membership_changed('user_2', 'group_1')
+        uow.discard()
+        self.assertFalse(uow.dirty)
+        self.assertEqual(
+            sorted(root['groups']['group_1'].model.member_ids),
+            ['user_1', 'user_2']
+        )
+
+    @testing.principals(
+        users={
+            'user_1': {},
+        },
+        groups={
+            'group_1': {},
+        })
+    def test_unit_of_work(self):
+        root = get_root()
+        request = self.layer.new_request()
+        uow = unit_of_work(root, request)
+        self.assertTrue(isinstance(uow, UnitOfWork))
+        self.assertTrue(uow is unit_of_work(root, request))
+        self.assertTrue(request.environ[UNIT_OF_WORK_KEY] is uow)
+
+        # Unflushed changes get flushed by response callback
+        root['groups'].backend['group_1'].add('user_1')
+        uow.membership_changed('user_1', 'group_1')
+        self.assertEqual(persisted_member_ids('group_1'), [])
+        request._process_response_callbacks(Response())
+        self.assertFalse(uow.dirty)
+        self.assertEqual(persisted_member_ids('group_1'), ['user_1'])
@@ -0,0 +1,155 @@
+from cone.ugm.localmanager import invalidate_local_manager_state
+from cone.ugm.localmanager import local_manager_index
+from cone.ugm.settings import PRINCIPAL_DELETED
+from cone.ugm.settings import principals_changed
+from pyramid.threadlocal import get_current_request
+
+
+def invalidate_membership_caches(model, request, group_ids):
+    """Drop cached data which depends on memberships of given groups.
+
+    Local manager restrictions are computed from group memberships, thus
+    managed user ids of the local manager index, the local manager state
+    cached on the request and cached search results of both users and groups
+    listings get dropped.
+    """
+    for group_id in group_ids:
+        local_manager_index.invalidate(group_id)
+    invalidate_local_manager_state(request)
+    root = model.root
+    root['users'].indexes.search_cache.clear()
+    root['groups'].indexes.search_cache.clear()
+
+
+class UnitOfWork(object):
+    """Changes of principals made during a request.
+
+    Changed principals get recorded by ID and persisted at once on ``flush``
+    by calling either the users or groups backend or the UGM backend itself,
+    depending on what changed. There is no attribute level dirty tracking,
+    what actually gets written is up to the backend. The benefit is one
+    backend call for multiple changed principals instead of one per change,
+    and invalidation of related model nodes and caches in one place.
+
+    Units of work are request scoped, see ``unit_of_work``.
+    """
+
+    def __init__(self, root, request):
+        self.root = root
+        self.request = request
+        self._reset()
+
+    def _reset(self):
+        self.users = set()
+        self.groups = set()
+        self.members = set()
+        self.memberships = set()
+        self.deleted = set()
+
+    @property
+    def dirty(self):
+        """Flag whether unflushed changes exist.
+        """
+        return bool(self.users or self.groups)
+
+    def user_changed(self, user_id):
+        """Record changed user.
+        """
+        self.users.add(user_id)
+
+    def user_deleted(self, user_id):
+        """Record deleted user.
+        """
+        self.users.add(user_id)
+        self.deleted.add(user_id)
+
+    def group_changed(self, group_id):
+        """Record changed group.
+        """
+        self.groups.add(group_id)
+
+    def membership_changed(self, user_id, group_id):
+        """Record changed membership of user in group.
+
+        Memberships are stored on groups, the user only gets invalidated
+        after flush.
+        """
+        self.groups.add(group_id)
+        self.members.add(user_id)
+        self.memberships.add(group_id)
+
+    def flush(self):
+        """Persist recorded changes and invalidate related application model
+        nodes and caches.
+
+        If persisting fails, recorded changes get discarded and the exception
+        is raised.
+        """
+        if not self.dirty:
+            return
+        users = self.users
+        groups = self.groups
+        root = self.root
+        try:
+            if users and groups:
+                root['users'].backend.parent()
+            elif users:
+                root['users'].backend()
+            else:
+                root['groups'].backend()
+        except Exception:
+            self.discard()
+            raise
+        members = self.members
+        memberships = self.memberships
+        deleted = self.deleted
+        self._reset()
+        principals_changed(users=(users | members) - deleted, groups=groups)
+        principals_changed(users=deleted, action=PRINCIPAL_DELETED)
+        for user_id in users | members:
+            root['users'].invalidate(user_id)
+        for group_id in groups:
+            root['groups'].invalidate(group_id)
+        if memberships:
+            invalidate_membership_caches(root, self.request, memberships)
+
+    def discard(self):
+        """Drop recorded changes not persisted yet.
+        """
+        if not self.dirty:
+            return
+        memberships = self.memberships
+        self._reset()
+        root = self.root
+        root['users'].invalidate()
+        root['groups'].invalidate()
+        invalidate_membership_caches(root, self.request, memberships)
+
+
+UNIT_OF_WORK_KEY = 'cone.ugm.unit_of_work'
+
+
+def _flush_unit_of_work(request, response):
+    unit_of_work = request.environ.get(UNIT_OF_WORK_KEY)
+    if unit_of_work is not None:
+        unit_of_work.flush()
+
+
+def unit_of_work(root, request=None):
+    """Return ``UnitOfWork`` of request.
+
+    All views using the unit of work flush explicitly in order to report
+    persisting errors to the client, thus changes only get batched within a
+    view, not across a request. The response callback only flushes changes
+    left unflushed by mistake.
+    """
+    if request is None:
+        request = get_current_request()
+    unit_of_work = request.environ.get(UNIT_OF_WORK_KEY)
+    if unit_of_work is None:
+        unit_of_work = request.environ[UNIT_OF_WORK_KEY] = UnitOfWork(
+            root,
+            request
+        )
+        request.add_response_callback(_flush_unit_of_work)
+    return unit_of_work